@@ -9,33 +9,122 @@ Targets specific techniques used by Hercules v1.6.2:
 - Anti-tamper protection
 """
 
-import re
-import base64
-import string
 import argparse
+import logging
 import sys
-from typing import Dict, List, Set, Tuple, Optional, Any
+from typing import TYPE_CHECKING, Dict, List, Set, Tuple, Optional, Any
 import json
 
+from lua_patterns import (HERCULES_ANTI_TAMPER, HERCULES_PATTERNS, HERCULES_VM_STRUCTURE,
+                          contains_in_order)
+from lua_results import DeobfuscationResult, Source, Timings, decode_source
+
+# Heavier stages are imported on first use to keep CLI start-up cheap
+if TYPE_CHECKING:
+    from lua_devirtualizer import LiftedProgram, VirtualMachine
+    from lua_fingerprint import BuildParameters, FingerprintCache
+    from lua_triage import TriageResult
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# The alphabet used in the encoding (based on the pattern observed)
+DEFAULT_ALPHABET = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz_"
+
 class HerculesDeobfuscator:
-    def __init__(self):
+    def __init__(self, use_cache: bool = False, cache_path: Optional[str] = None):
         self.original_code = ""
         self.deobfuscated_code = ""
         self.vm_instructions = {}
         self.string_table = []
         self.function_table = []
         self.constant_table = []
+        self.vm_payload = b''
+        self.vm: Optional[VirtualMachine] = None
+        self.devirtualized: Optional[LiftedProgram] = None
+        self._vm_scanned = False
+        self.triage_result: Optional[TriageResult] = None
+        self.use_cache = use_cache or cache_path is not None    # opt-in: the cache writes to disk
+        self.cache_path = cache_path
+        self.cache: Optional[FingerprintCache] = None
+        self.build: Optional[BuildParameters] = None
+        self.timings = Timings()
         
     def load_file(self, filename: str) -> bool:
         """Load obfuscated Lua file"""
         try:
-            with open(filename, 'r', encoding='utf-8', errors='ignore') as f:
-                self.original_code = f.read()
+            with open(filename, 'rb') as f:
+                self.load_source(f.read())
             return True
         except Exception as e:
-            print(f"Error loading file: {e}")
+            logger.error("Error loading file: %s", e)
             return False
     
+    def load_source(self, source: Source):
+        """Load obfuscated Lua code from a str or bytes object"""
+        self.original_code = decode_source(source)
+        self.deobfuscated_code = ""
+        self.string_table = []
+        self.vm_payload = b''
+        self.vm = None
+        self.devirtualized = None
+        self._vm_scanned = False
+        self.triage_result = None
+        self.build = None
+    
+    def run(self, source: Source, analyze_only: bool = False,
+            fast_lane: bool = False) -> DeobfuscationResult:
+        """Deobfuscate (or just analyze) source in memory and return the results.
+        
+        With fast_lane, samples that triage as clean skip the pipeline and
+        come back unchanged with a triage-only report.
+        """
+        self.load_source(source)
+        timings = Timings()
+        if fast_lane:
+            with timings.stage('triage'):
+                result = self.triage()
+            if result.lane == 'fast':
+                self.deobfuscated_code = self.original_code
+                return DeobfuscationResult(None if analyze_only else self.original_code,
+                                           self.generate_triage_report(), timings)
+        if not analyze_only:
+            self.deobfuscate_hercules()
+            timings.stages.update(self.timings.stages)
+        self.timings = timings
+        with self.timings.stage('report'):
+            report = self.generate_analysis_report()
+        return DeobfuscationResult(None if analyze_only else self.deobfuscated_code,
+                                   report, self.timings)
+    
+    def triage(self) -> 'TriageResult':
+        """Cheap numeric pre-screen of the loaded sample (cached)"""
+        if self.triage_result is None:
+            from lua_triage import triage
+            self.triage_result = triage(self.original_code)
+        return self.triage_result
+    
+    def has_signature(self) -> bool:
+        """Does the sample carry the Hercules obfuscator signature?"""
+        return 'Hercules' in self.original_code and 'obfuscator' in self.original_code.lower()
+    
+    def learn_build(self) -> 'BuildParameters':
+        """Decoder parameters of the sample's obfuscator build, recalled from the
+        fingerprint cache when an earlier sample of the same build was seen (cached).
+        
+        Only signed samples are learned from: any long string passed to a call
+        would otherwise be taken for a payload and cached as a build.
+        """
+        if self.build is None:
+            from lua_fingerprint import BuildParameters, FingerprintCache, SampleIndex, resolve_build
+            if not self.has_signature():
+                self.build = BuildParameters(SampleIndex(self.original_code).fingerprint)
+                return self.build
+            if self.use_cache and self.cache is None:
+                self.cache = FingerprintCache(self.cache_path)
+            self.build = resolve_build(self.original_code, self.cache if self.use_cache else None)
+        return self.build
+    
     def detect_hercules(self) -> Dict[str, Any]:
         """Detect if this is Hercules obfuscated code"""
         detection = {
@@ -49,37 +138,36 @@ class HerculesDeobfuscator:
         indicators = []
         
         # Check for Hercules signature
-        if 'Hercules' in code and 'obfuscator' in code.lower():
+        if self.has_signature():
             indicators.append('hercules_signature')
             
         # Check for version string
-        version_match = re.search(r'Hercules.*?v?(\d+\.\d+(?:\.\d+)?)', code, re.IGNORECASE)
+        version_match = HERCULES_PATTERNS['version'].search(code)
         if version_match:
             detection['version'] = version_match.group(1)
             indicators.append('version_string')
             
         # Check for VM bytecode patterns
-        if re.search(r'return.*?function.*?local.*?while.*?alpha.*?do', code, re.DOTALL):
+        if contains_in_order(code, HERCULES_VM_STRUCTURE):
             indicators.append('vm_structure')
             
-        # Check for string encoding patterns specific to Hercules
-        if re.search(r'HuDWadUZyHyr\(.*?\)', code):
+        # Check for the decoder, loader and VM executor by the names learned
+        # for this build, so renamed builds score like stock ones; unsigned
+        # samples are not learned from and fall back to the stock names
+        build = self.learn_build()
+        if build.decoder is not None or HERCULES_PATTERNS['decoder_call'].search(code):
             indicators.append('string_decoder_function')
-            
-        # Check for bytecode conversion patterns
-        if 'SVkOeWirtS' in code:
+        if build.loader is not None or 'SVkOeWirtS' in code:
             indicators.append('bytecode_loader')
-            
-        # Check for VM execution patterns
-        if 'iLkvhyKfZlmz' in code:
+        if build.executor is not None or 'iLkvhyKfZlmz' in code:
             indicators.append('vm_executor')
             
-        # Check for function wrapping
+        # Check for function wrapping (not learned: stock name only)
         if 'oOctatkvH' in code:
             indicators.append('function_wrapper')
             
         # Check for anti-tamper patterns
-        if re.search(r'cuCzEJpiRD.*?afToLAMJHixs.*?fTAKBayDIjj', code):
+        if contains_in_order(code, HERCULES_ANTI_TAMPER, same_line=True):
             indicators.append('anti_tamper')
             
         # Calculate confidence
@@ -93,9 +181,11 @@ class HerculesDeobfuscator:
     
     def extract_vm_bytecode(self) -> Optional[str]:
         """Extract the VM bytecode string"""
-        # Look for the main bytecode string
-        bytecode_pattern = re.compile(r"HuDWadUZyHyr\('([^']+)'")
-        match = bytecode_pattern.search(self.original_code)
+        # The payload passed to the learned decoder, else the stock decoder name
+        build = self.learn_build()
+        if build.payload is not None:
+            return build.payload
+        match = HERCULES_PATTERNS['bytecode_string'].search(self.original_code)
         
         if match:
             return match.group(1)
@@ -133,11 +223,13 @@ class HerculesDeobfuscator:
         """Extract strings from VM bytecode"""
         strings = []
         
-        # The alphabet used in the encoding (based on the pattern observed)
-        alphabet = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz_"
-        
-        # Try to decode the bytecode
-        decoded_bytes = self.decode_custom_encoding(bytecode, alphabet)
+        # Try to decode the bytecode with the build's alphabet and cipher key
+        build = self.learn_build()
+        decoded_bytes = self.decode_custom_encoding(bytecode, build.alphabet or DEFAULT_ALPHABET)
+        if build.cipher_key:
+            shift = bytes((b - build.cipher_key) % 256 for b in range(256))
+            decoded_bytes = decoded_bytes.translate(shift)
+        self.vm_payload = decoded_bytes
         
         if decoded_bytes:
             # Look for string patterns in the decoded bytes
@@ -149,29 +241,43 @@ class HerculesDeobfuscator:
         
         return strings
     
+    def devirtualize_vm(self) -> Optional['LiftedProgram']:
+        """Recover the dispatch loop's opcode map and lift the instruction stream (cached)"""
+        if not self._vm_scanned:
+            from lua_devirtualizer import devirtualize
+            self.vm, self.devirtualized = devirtualize(self.original_code, self.vm_payload or None)
+            self._vm_scanned = True
+        return self.devirtualized
+    
     def analyze_vm_structure(self) -> Dict[str, Any]:
         """Analyze the VM structure and instructions"""
         analysis = {
             'vm_detected': False,
             'instructions': [],
             'functions': [],
-            'constants': []
+            'constants': [],
+            'dispatch_loop': None,
+            'devirtualized': None
         }
         
         code = self.original_code
         
         # Look for VM instruction patterns
-        if 'while alpha do' in code:
+        program = self.devirtualize_vm()
+        if 'while alpha do' in code or self.vm:
             analysis['vm_detected'] = True
+        if self.vm:
+            analysis['dispatch_loop'] = self.vm.summary()
+            analysis['instructions'] = sorted(set(self.vm.opcode_map.values()))
+        if program:
+            analysis['devirtualized'] = program.summary()
             
         # Extract function definitions
-        func_pattern = re.compile(r'function\s+(\w+)\s*\([^)]*\)')
-        functions = func_pattern.findall(code)
+        functions = HERCULES_PATTERNS['function_def'].findall(code)
         analysis['functions'] = functions
         
         # Extract local variable assignments (potential constants)
-        const_pattern = re.compile(r'local\s+(\w+)\s*=\s*([^;\n]+)')
-        constants = const_pattern.findall(code)
+        constants = HERCULES_PATTERNS['local_constant'].findall(code)
         analysis['constants'] = constants[:20]  # Limit output
         
         return analysis
@@ -199,7 +305,7 @@ class HerculesDeobfuscator:
             })
             
         # Check for anti-debugging measures
-        if re.search(r'debug\.|getfenv|setfenv', self.original_code):
+        if HERCULES_PATTERNS['debug_access'].search(self.original_code):
             vulnerabilities.append({
                 'type': 'anti_debugging',
                 'description': 'Contains anti-debugging measures',
@@ -223,8 +329,7 @@ class HerculesDeobfuscator:
         strings = []
         
         # Look for string literals
-        string_pattern = re.compile(r'"([^"\\]|\\.)*"|\'([^\'\\]|\\.)*\'')
-        matches = string_pattern.findall(self.original_code)
+        matches = HERCULES_PATTERNS['string_literal'].findall(self.original_code)
         for match in matches:
             string_content = match[0] if match[0] else match[1]
             if len(string_content) > 3:  # Filter out short strings
@@ -234,67 +339,92 @@ class HerculesDeobfuscator:
     
     def deobfuscate_hercules(self) -> str:
         """Main deobfuscation method for Hercules"""
-        print("Starting Hercules deobfuscation...")
+        logger.info("Starting Hercules deobfuscation...")
+        timings = self.timings = Timings()
         
-        # Step 1: Detect Hercules
-        detection = self.detect_hercules()
+        # Step 1: Detect Hercules, then fingerprint the runtime
+        with timings.stage('detection'):
+            detection = self.detect_hercules()
         if not detection['is_hercules']:
-            print("Warning: This doesn't appear to be Hercules obfuscated code")
+            logger.warning("Warning: This doesn't appear to be Hercules obfuscated code")
+            self.deobfuscated_code = self.original_code
             return self.original_code
             
-        print(f"Hercules detected (confidence: {detection['confidence']:.2f})")
+        logger.info("Hercules detected (confidence: %.2f)", detection['confidence'])
         if detection['version']:
-            print(f"Version: {detection['version']}")
-        print(f"Indicators: {', '.join(detection['indicators'])}")
+            logger.info("Version: %s", detection['version'])
+        logger.info("Indicators: %s", ', '.join(detection['indicators']))
+        with timings.stage('fingerprint'):
+            build = self.learn_build()
+        logger.info("Build %s: parameters %s", build.fingerprint[:12],
+                    "recalled from cache" if build.cached else "learned" if build.learned else "not learned")
         
         # Step 2: Extract VM bytecode
-        bytecode = self.extract_vm_bytecode()
+        with timings.stage('bytecode'):
+            bytecode = self.extract_vm_bytecode()
+            strings = self.extract_strings_from_vm(bytecode) if bytecode else []
         if bytecode:
-            print(f"Extracted VM bytecode ({len(bytecode)} characters)")
+            logger.info("Extracted VM bytecode (%d characters)", len(bytecode))
             
             # Try to decode strings from bytecode
-            strings = self.extract_strings_from_vm(bytecode)
             if strings:
-                print(f"Extracted {len(strings)} strings from VM")
+                logger.info("Extracted %d strings from VM", len(strings))
                 self.string_table = strings
         
         # Step 3: Analyze VM structure
-        vm_analysis = self.analyze_vm_structure()
-        print(f"VM analysis: {vm_analysis['vm_detected']}")
-        
-        # Step 4: Extract readable content
-        code = self._extract_readable_content()
+        with timings.stage('vm_analysis'):
+            vm_analysis = self.analyze_vm_structure()
+        logger.info("VM analysis: %s", vm_analysis['vm_detected'])
+        if self.vm:
+            logger.info("Recovered %d opcode handlers", len(self.vm.handlers))
+        
+        # Step 4: Lift the VM program, or extract readable content
+        with timings.stage('extraction'):
+            if self.devirtualized:
+                logger.info("Lifted %d/%d VM instructions", self.devirtualized.lifted,
+                            self.devirtualized.instructions)
+                code = self._string_comments() + self.devirtualized.source
+            else:
+                code = self._extract_readable_content()
         
         # Step 5: Clean up and format
-        code = self._cleanup_code(code)
+        with timings.stage('cleanup'):
+            code = self._cleanup_code(code)
         
         self.deobfuscated_code = code
         return code
     
+    def _string_comments(self) -> str:
+        """Extracted VM strings as a comment block"""
+        if not self.string_table:
+            return ""
+        content_lines = ["-- Extracted strings from VM:"]
+        for i, string_val in enumerate(self.string_table[:10]):  # Limit to first 10
+            content_lines.append(f"-- String {i+1}: {repr(string_val)}")
+        return '\n'.join(content_lines) + '\n'
+    
     def _extract_readable_content(self) -> str:
         """Extract readable content from the obfuscated code"""
         content_lines = []
         
         # Add extracted strings as comments
         if self.string_table:
-            content_lines.append("-- Extracted strings from VM:")
-            for i, string_val in enumerate(self.string_table[:10]):  # Limit to first 10
-                content_lines.append(f"-- String {i+1}: {repr(string_val)}")
+            content_lines.extend(self._string_comments().splitlines())
             content_lines.append("")
         
-        # Look for the original script structure
-        lines = self.original_code.split('\n')
-        for line in lines:
+        # Look for the original script structure, one statement per line even
+        # when the payload was minified onto a single line
+        from lua_format import iter_lines
+        for line in iter_lines(self.original_code):
             line = line.strip()
             
-            # Skip empty lines and very long obfuscated lines
-            if not line or len(line) > 200:
+            if not line:
                 continue
                 
             # Keep readable function definitions
-            if re.match(r'function\s+\w+\s*\(', line):
+            if HERCULES_PATTERNS['function_header'].match(line):
                 content_lines.append(line)
-            elif re.match(r'local\s+\w+\s*=\s*function', line):
+            elif HERCULES_PATTERNS['function_value'].match(line):
                 content_lines.append(line)
             elif line.startswith('--') and len(line) < 100:
                 content_lines.append(line)
@@ -322,8 +452,8 @@ class HerculesDeobfuscator:
         clean_lines = []
         
         for line in lines:
-            line = line.strip()
-            if line:
+            line = line.rstrip()
+            if line.strip():
                 clean_lines.append(line)
                 
         return '\n'.join(clean_lines)
@@ -335,7 +465,24 @@ class HerculesDeobfuscator:
         vm_analysis = self.analyze_vm_structure()
         embedded_strings = self.extract_embedded_strings()
         
+        if self.devirtualized:
+            notes = [
+                "This script uses Hercules obfuscator with VM-based protection",
+                f"Recovered {len(self.vm.handlers)} opcode handlers from the dispatch loop statically",
+                f"Lifted {self.devirtualized.lifted} of {self.devirtualized.instructions} "
+                "VM instructions back to Lua source",
+            ]
+        else:
+            notes = [
+                "This script uses Hercules obfuscator with VM-based protection",
+                "The original code is compiled to custom bytecode",
+                "Full deobfuscation requires VM emulation or dynamic analysis",
+                "Static analysis can extract some strings and structure"
+            ]
+        
         return {
+            'triage': self.triage().as_dict(),
+            'build': self.learn_build().summary(),
             'hercules_detection': detection,
             'vm_analysis': vm_analysis,
             'vulnerabilities': vulnerabilities,
@@ -349,12 +496,7 @@ class HerculesDeobfuscator:
                 'functions_found': len(vm_analysis.get('functions', [])),
                 'constants_found': len(vm_analysis.get('constants', []))
             },
-            'deobfuscation_notes': [
-                "This script uses Hercules obfuscator with VM-based protection",
-                "The original code is compiled to custom bytecode",
-                "Full deobfuscation requires VM emulation or dynamic analysis",
-                "Static analysis can extract some strings and structure"
-            ]
+            'deobfuscation_notes': notes
         }
     
     def save_deobfuscated(self, filename: str) -> bool:
@@ -364,59 +506,101 @@ class HerculesDeobfuscator:
                 f.write(self.deobfuscated_code)
             return True
         except Exception as e:
-            print(f"Error saving file: {e}")
+            logger.error("Error saving file: %s", e)
             return False
 
-def main():
+    def generate_triage_report(self) -> Dict[str, Any]:
+        """Report for samples routed to the fast lane"""
+        return {
+            'triage': self.triage().as_dict(),
+            'fast_lane': True,
+            'statistics': {
+                'original_size': len(self.original_code),
+                'deobfuscated_size': len(self.deobfuscated_code),
+                'obfuscation_ratio': 1.0,
+                'lines_original': len(self.original_code.split('\n')),
+                'functions_found': 0,
+                'constants_found': 0
+            }
+        }
+
+def deobfuscate_source(source: Source, analyze_only: bool = False, fast_lane: bool = False,
+                       use_cache: bool = False, cache_path: Optional[str] = None) -> DeobfuscationResult:
+    """Library entry point: deobfuscate Hercules-protected Lua held in memory.
+    
+    Nothing touches the disk unless use_cache or cache_path enables the
+    fingerprint cache.
+    """
+    return HerculesDeobfuscator(use_cache, cache_path).run(source, analyze_only=analyze_only,
+                                                           fast_lane=fast_lane)
+
+def main(argv: Optional[List[str]] = None):
     parser = argparse.ArgumentParser(description='Hercules Deobfuscator - Specialized tool for Hercules obfuscated Lua')
     parser.add_argument('input_file', help='Input Hercules obfuscated Lua file')
     parser.add_argument('-o', '--output', help='Output file for deobfuscated code')
     parser.add_argument('-r', '--report', help='Output file for analysis report (JSON)')
     parser.add_argument('-a', '--analyze-only', action='store_true', help='Only analyze, don\'t deobfuscate')
     parser.add_argument('-v', '--verbose', action='store_true', help='Verbose output')
+    parser.add_argument('-f', '--fast-lane', action='store_true',
+                        help='Triage first and pass clean files through untouched')
+    parser.add_argument('-c', '--cache', action='store_true',
+                        help='Recall and store build parameters in the fingerprint cache')
+    parser.add_argument('--cache-file', help='Fingerprint cache file, implies --cache '
+                                             '(default: $LUA_DEOBF_CACHE or the user cache directory)')
     
-    args = parser.parse_args()
-    
-    # Initialize deobfuscator
-    deobfuscator = HerculesDeobfuscator()
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO,
+                        format='%(message)s', stream=sys.stdout)
     
     # Load file
-    if not deobfuscator.load_file(args.input_file):
+    try:
+        with open(args.input_file, 'rb') as f:
+            source = f.read()
+    except OSError as e:
+        print(f"Error loading file: {e}")
         print(f"Failed to load file: {args.input_file}")
         return 1
     
     print(f"Loaded file: {args.input_file}")
-    print(f"File size: {len(deobfuscator.original_code)} bytes")
+    print(f"File size: {len(decode_source(source))} bytes")
+    
+    deobfuscator = HerculesDeobfuscator(use_cache=args.cache, cache_path=args.cache_file)
+    result = deobfuscator.run(source, analyze_only=args.analyze_only, fast_lane=args.fast_lane)
+    report = result.report
+    
+    if report.get('fast_lane'):
+        triage_report = report['triage']
+        print(f"\nTriage: {triage_report['family']} (score {triage_report['score']:.3f}) - fast lane, "
+              f"full analysis skipped")
     
     if args.analyze_only:
         # Analysis only
-        report = deobfuscator.generate_analysis_report()
-        
         if args.verbose:
             print("\n=== HERCULES ANALYSIS REPORT ===")
             print(json.dumps(report, indent=2))
-        else:
+        elif not report.get('fast_lane'):
             detection = report['hercules_detection']
             print(f"\nHercules detected: {detection['is_hercules']}")
             print(f"Confidence: {detection['confidence']:.2f}")
             if detection['version']:
                 print(f"Version: {detection['version']}")
             print(f"Indicators: {', '.join(detection['indicators'])}")
+            print(f"Build: {report['build']['fingerprint'][:12]}"
+                  f"{' (cached parameters)' if report['build']['cached'] else ''}")
             print(f"Vulnerabilities found: {len(report['vulnerabilities'])}")
             print(f"VM detected: {report['vm_analysis']['vm_detected']}")
     else:
-        # Full deobfuscation
-        deobfuscated = deobfuscator.deobfuscate_hercules()
-        
         # Save output
         output_file = args.output or args.input_file.replace('.lua', '_deobfuscated.lua')
-        if deobfuscator.save_deobfuscated(output_file):
+        try:
+            with open(output_file, 'w', encoding='utf-8') as f:
+                f.write(result.output)
             print(f"Deobfuscated code saved to: {output_file}")
+        except OSError as e:
+            print(f"Error saving file: {e}")
         
-        # Generate and save report
-        report = deobfuscator.generate_analysis_report()
+        # Save report
         report_file = args.report or args.input_file.replace('.lua', '_hercules_analysis.json')
-        
         try:
             with open(report_file, 'w') as f:
                 json.dump(report, f, indent=2)
@@ -431,6 +615,7 @@ def main():
             print(f"Obfuscation ratio: {stats['obfuscation_ratio']:.1f}x")
             print(f"Functions found: {stats['functions_found']}")
             print(f"Constants found: {stats['constants_found']}")
+            print(f"Timings: {result.timings}")
     
     return 0
 
@@ -0,0 +1,717 @@
+#!/usr/bin/env python3
+"""
+Lua Bytecode - Reader and disassembler for precompiled Lua chunks
+Parses string.dump() output for:
+- Lua 5.1, 5.2 and 5.3 (luac format, any endianness / word size)
+- Luau (Roblox) bytecode versions 3-6
+Everything is read in place from a memoryview with struct.unpack_from,
+so multi-megabyte payloads are parsed without intermediate copies.
+"""
+
+import argparse
+import base64
+import re
+import struct
+import sys
+from itertools import accumulate
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+from lua_lexer import decode_string_literal, tokenize
+
+LUA_SIGNATURE = b'\x1bLua'
+LUAC_TAIL = b'\x19\x93\r\n\x1a\n'
+LUAU_VERSIONS = range(3, 7)
+
+# Opcode tables, indexed by opcode number
+LUA51_OPCODES = (
+    'MOVE', 'LOADK', 'LOADBOOL', 'LOADNIL', 'GETUPVAL', 'GETGLOBAL', 'GETTABLE',
+    'SETGLOBAL', 'SETUPVAL', 'SETTABLE', 'NEWTABLE', 'SELF', 'ADD', 'SUB', 'MUL',
+    'DIV', 'MOD', 'POW', 'UNM', 'NOT', 'LEN', 'CONCAT', 'JMP', 'EQ', 'LT', 'LE',
+    'TEST', 'TESTSET', 'CALL', 'TAILCALL', 'RETURN', 'FORLOOP', 'FORPREP',
+    'TFORLOOP', 'SETLIST', 'CLOSE', 'CLOSURE', 'VARARG',
+)
+LUA52_OPCODES = (
+    'MOVE', 'LOADK', 'LOADKX', 'LOADBOOL', 'LOADNIL', 'GETUPVAL', 'GETTABUP',
+    'GETTABLE', 'SETTABUP', 'SETUPVAL', 'SETTABLE', 'NEWTABLE', 'SELF', 'ADD',
+    'SUB', 'MUL', 'DIV', 'MOD', 'POW', 'UNM', 'NOT', 'LEN', 'CONCAT', 'JMP', 'EQ',
+    'LT', 'LE', 'TEST', 'TESTSET', 'CALL', 'TAILCALL', 'RETURN', 'FORLOOP',
+    'FORPREP', 'TFORCALL', 'TFORLOOP', 'SETLIST', 'CLOSURE', 'VARARG', 'EXTRAARG',
+)
+LUA53_OPCODES = (
+    'MOVE', 'LOADK', 'LOADKX', 'LOADBOOL', 'LOADNIL', 'GETUPVAL', 'GETTABUP',
+    'GETTABLE', 'SETTABUP', 'SETUPVAL', 'SETTABLE', 'NEWTABLE', 'SELF', 'ADD',
+    'SUB', 'MUL', 'MOD', 'POW', 'DIV', 'IDIV', 'BAND', 'BOR', 'BXOR', 'SHL', 'SHR',
+    'UNM', 'BNOT', 'NOT', 'LEN', 'CONCAT', 'JMP', 'EQ', 'LT', 'LE', 'TEST',
+    'TESTSET', 'CALL', 'TAILCALL', 'RETURN', 'FORLOOP', 'FORPREP', 'TFORCALL',
+    'TFORLOOP', 'SETLIST', 'CLOSURE', 'VARARG', 'EXTRAARG',
+)
+LUAU_OPCODES = (
+    'NOP', 'BREAK', 'LOADNIL', 'LOADB', 'LOADN', 'LOADK', 'MOVE', 'GETGLOBAL',
+    'SETGLOBAL', 'GETUPVAL', 'SETUPVAL', 'CLOSEUPVALS', 'GETIMPORT', 'GETTABLE',
+    'SETTABLE', 'GETTABLEKS', 'SETTABLEKS', 'GETTABLEN', 'SETTABLEN', 'NEWCLOSURE',
+    'NAMECALL', 'CALL', 'RETURN', 'JUMP', 'JUMPBACK', 'JUMPIF', 'JUMPIFNOT',
+    'JUMPIFEQ', 'JUMPIFLE', 'JUMPIFLT', 'JUMPIFNOTEQ', 'JUMPIFNOTLE', 'JUMPIFNOTLT',
+    'ADD', 'SUB', 'MUL', 'DIV', 'MOD', 'POW', 'ADDK', 'SUBK', 'MULK', 'DIVK', 'MODK',
+    'POWK', 'AND', 'OR', 'ANDK', 'ORK', 'CONCAT', 'NOT', 'MINUS', 'LENGTH',
+    'NEWTABLE', 'DUPTABLE', 'SETLIST', 'FORNPREP', 'FORNLOOP', 'FORGLOOP',
+    'FORGPREP_INEXT', 'FASTCALL3', 'FORGPREP_NEXT', 'NATIVECALL', 'GETVARARGS',
+    'DUPCLOSURE', 'PREPVARARGS', 'LOADKX', 'JUMPX', 'FASTCALL', 'COVERAGE',
+    'CAPTURE', 'SUBRK', 'DIVRK', 'FASTCALL1', 'FASTCALL2', 'FASTCALL2K', 'FORGPREP',
+    'JUMPXEQKNIL', 'JUMPXEQKB', 'JUMPXEQKN', 'JUMPXEQKS', 'IDIV', 'IDIVK',
+)
+
+# Instructions followed by an auxiliary word
+LUAU_AUX = frozenset({
+    'GETGLOBAL', 'SETGLOBAL', 'GETIMPORT', 'GETTABLEKS', 'SETTABLEKS', 'NAMECALL',
+    'JUMPIFEQ', 'JUMPIFLE', 'JUMPIFLT', 'JUMPIFNOTEQ', 'JUMPIFNOTLE', 'JUMPIFNOTLT',
+    'NEWTABLE', 'SETLIST', 'FORGLOOP', 'LOADKX', 'FASTCALL2', 'FASTCALL2K',
+    'FASTCALL3', 'JUMPXEQKNIL', 'JUMPXEQKB', 'JUMPXEQKN', 'JUMPXEQKS',
+})
+
+# Operand layouts for the PUC-Rio formats
+_ABX = frozenset({'LOADK', 'GETGLOBAL', 'SETGLOBAL', 'CLOSURE', 'LOADKX'})
+_ASBX = frozenset({'JMP', 'FORLOOP', 'FORPREP', 'TFORLOOP'})
+
+
+class BytecodeError(Exception):
+    """Raised when a chunk is truncated or malformed"""
+    pass
+
+
+class Prototype:
+    """One function prototype of a chunk"""
+
+    __slots__ = ('source', 'line_defined', 'last_line', 'num_params', 'is_vararg',
+                 'max_stack', 'num_upvalues', 'code', 'constants', 'protos',
+                 'lineinfo', 'locals', 'upvalue_names', 'name')
+
+    def __init__(self):
+        self.source: Optional[str] = None
+        self.line_defined = 0
+        self.last_line = 0
+        self.num_params = 0
+        self.is_vararg = 0
+        self.max_stack = 0
+        self.num_upvalues = 0
+        self.code: Tuple[int, ...] = ()
+        self.constants: List[Any] = []
+        self.protos: List['Prototype'] = []
+        self.lineinfo: Tuple[int, ...] = ()
+        self.locals: List[Tuple[str, int, int]] = []
+        self.upvalue_names: List[str] = []
+        self.name: Optional[str] = None
+
+    def walk(self) -> Iterator['Prototype']:
+        """Yield this prototype and every nested one, depth first"""
+        stack = [self]
+        while stack:
+            proto = stack.pop()
+            yield proto
+            stack.extend(reversed(proto.protos))
+
+
+class Chunk:
+    """A parsed precompiled chunk"""
+
+    __slots__ = ('version', 'format', 'little_endian', 'main', 'size', 'strings')
+
+    def __init__(self, version: str, main: Prototype, size: int):
+        self.version = version      # '5.1', '5.2', '5.3' or 'luau-N'
+        self.format = 0
+        self.little_endian = True
+        self.main = main
+        self.size = size            # bytes consumed
+        self.strings: List[str] = []
+
+    @property
+    def functions(self) -> int:
+        return sum(1 for _ in self.main.walk())
+
+    @property
+    def instructions(self) -> int:
+        return sum(len(proto.code) for proto in self.main.walk())
+
+    def constants(self) -> List[Any]:
+        """Every constant of every prototype, in walk order"""
+        return [k for proto in self.main.walk() for k in proto.constants]
+
+    def summary(self, limit: int = 50) -> Dict[str, Any]:
+        constants = [k if isinstance(k, (int, float, bool, str)) or k is None else _constant_text(k)
+                     for k in self.constants()]
+        return {
+            'version': self.version,
+            'size': self.size,
+            'functions': self.functions,
+            'instructions': self.instructions,
+            'constants': constants[:limit],
+        }
+
+
+def _text(raw: Union[bytes, memoryview]) -> str:
+    return bytes(raw).decode('utf-8', errors='replace')
+
+
+class _PucReader:
+    """Reader for the PUC-Rio luac formats (5.1 - 5.3)"""
+
+    def __init__(self, buf: memoryview, pos: int):
+        self.buf = buf
+        self.pos = pos
+        self.version = 0
+        self.endian = '<'
+        self.int_fmt = 'i'
+        self.size_fmt = 'I'
+        self.number_fmt = 'd'
+        self.integer_fmt = 'q'
+        self.instruction_size = 4
+
+    def _unpack(self, fmt: str) -> Any:
+        try:
+            value = struct.unpack_from(self.endian + fmt, self.buf, self.pos)[0]
+        except struct.error:
+            raise BytecodeError(f"truncated chunk at offset {self.pos}")
+        self.pos += struct.calcsize(fmt)
+        return value
+
+    def byte(self) -> int:
+        if self.pos >= len(self.buf):
+            raise BytecodeError(f"truncated chunk at offset {self.pos}")
+        value = self.buf[self.pos]
+        self.pos += 1
+        return value
+
+    def int(self) -> int:
+        value = self._unpack(self.int_fmt)
+        if value < 0 or value > len(self.buf):
+            raise BytecodeError(f"implausible count {value} at offset {self.pos}")
+        return value
+
+    def raw(self, size: int) -> memoryview:
+        if self.pos + size > len(self.buf):
+            raise BytecodeError(f"truncated chunk at offset {self.pos}")
+        view = self.buf[self.pos:self.pos + size]
+        self.pos += size
+        return view
+
+    def string(self) -> Optional[str]:
+        if self.version == 0x53:
+            size = self.byte()
+            if size == 0xFF:
+                size = self._unpack(self.size_fmt)
+        else:
+            size = self._unpack(self.size_fmt)
+        if size == 0:
+            return None
+        text = _text(self.raw(size - 1))
+        if self.version != 0x53:
+            self.pos += 1       # trailing NUL
+        return text
+
+    def header(self) -> Chunk:
+        if bytes(self.raw(4)) != LUA_SIGNATURE:
+            raise BytecodeError("missing Lua signature")
+        self.version = self.byte()
+        if self.version not in (0x51, 0x52, 0x53):
+            raise BytecodeError(f"unsupported Lua version 0x{self.version:02x}")
+        fmt = self.byte()
+
+        if self.version == 0x53:
+            if bytes(self.raw(6)) != LUAC_TAIL:
+                raise BytecodeError("corrupted 5.3 header")
+            int_size, size_size, ins_size, integer_size, number_size = self.raw(5)
+            self.integer_fmt = {4: 'i', 8: 'q'}.get(integer_size, 'q')
+            self.number_fmt = {4: 'f', 8: 'd'}.get(number_size, 'd')
+            self.endian = '<'
+            check = struct.unpack_from('<' + self.integer_fmt, self.buf, self.pos)[0]
+            if check != 0x5678:
+                self.endian = '>'
+            self.pos += integer_size + number_size
+            self.byte()     # number of upvalues of the main function
+        else:
+            self.endian = '<' if self.byte() else '>'
+            int_size, size_size, ins_size, number_size, integral = self.raw(5)
+            self.number_fmt = {4: 'f', 8: 'd'}.get(number_size, 'd')
+            if integral:
+                self.number_fmt = {4: 'i', 8: 'q'}.get(number_size, 'q')
+            if self.version == 0x52 and bytes(self.raw(6)) != LUAC_TAIL:
+                raise BytecodeError("corrupted 5.2 header")
+
+        self.int_fmt = {2: 'h', 4: 'i', 8: 'q'}.get(int_size, 'i')
+        self.size_fmt = {4: 'I', 8: 'Q'}.get(size_size, 'I')
+        self.instruction_size = ins_size
+        if ins_size != 4:
+            raise BytecodeError(f"unsupported instruction size {ins_size}")
+
+        chunk = Chunk(f"5.{self.version & 0x0F}", Prototype(), 0)
+        chunk.format = fmt
+        chunk.little_endian = self.endian == '<'
+        return chunk
+
+    def code(self) -> Tuple[int, ...]:
+        count = self.int()
+        if self.pos + count * 4 > len(self.buf):
+            raise BytecodeError(f"truncated code at offset {self.pos}")
+        code = struct.unpack_from(f"{self.endian}{count}I", self.buf, self.pos)
+        self.pos += count * 4
+        return code
+
+    def constants(self, proto: Prototype):
+        for _ in range(self.int()):
+            kind = self.byte()
+            if kind == 0:
+                proto.constants.append(None)
+            elif kind == 1:
+                proto.constants.append(bool(self.byte()))
+            elif kind == 3:
+                proto.constants.append(self._unpack(self.number_fmt))
+            elif kind == 0x13:
+                proto.constants.append(self._unpack(self.integer_fmt))
+            elif kind in (4, 0x14):
+                proto.constants.append(self.string())
+            else:
+                raise BytecodeError(f"bad constant type {kind} at offset {self.pos}")
+
+    def debug(self, proto: Prototype):
+        count = self.int()
+        if self.pos + count * struct.calcsize(self.int_fmt) > len(self.buf):
+            raise BytecodeError(f"truncated line info at offset {self.pos}")
+        proto.lineinfo = struct.unpack_from(f"{self.endian}{count}{self.int_fmt}", self.buf, self.pos)
+        self.pos += count * struct.calcsize(self.int_fmt)
+        for _ in range(self.int()):
+            name = self.string()
+            proto.locals.append((name, self.int(), self.int()))
+        proto.upvalue_names = [self.string() for _ in range(self.int())]
+
+    def function(self, parent_source: Optional[str]) -> Prototype:
+        proto = Prototype()
+        version = self.version
+        if version != 0x52:
+            proto.source = self.string() or parent_source
+        proto.line_defined = self._unpack(self.int_fmt)
+        proto.last_line = self._unpack(self.int_fmt)
+        if version == 0x51:
+            proto.num_upvalues = self.byte()
+        proto.num_params = self.byte()
+        proto.is_vararg = self.byte()
+        proto.max_stack = self.byte()
+        proto.code = self.code()
+        self.constants(proto)
+
+        if version == 0x51:
+            proto.protos = [self.function(proto.source) for _ in range(self.int())]
+            self.debug(proto)
+        elif version == 0x52:
+            proto.protos = [self.function(None) for _ in range(self.int())]
+            proto.num_upvalues = self.int()
+            self.raw(proto.num_upvalues * 2)
+            proto.source = self.string()
+            self.debug(proto)
+        else:
+            proto.num_upvalues = self.int()
+            self.raw(proto.num_upvalues * 2)
+            proto.protos = [self.function(proto.source) for _ in range(self.int())]
+            self.debug(proto)
+        return proto
+
+
+class _LuauReader:
+    """Reader for Luau bytecode"""
+
+    def __init__(self, buf: memoryview, pos: int):
+        self.buf = buf
+        self.pos = pos
+        self.strings: List[str] = []
+
+    def byte(self) -> int:
+        if self.pos >= len(self.buf):
+            raise BytecodeError(f"truncated chunk at offset {self.pos}")
+        value = self.buf[self.pos]
+        self.pos += 1
+        return value
+
+    def varint(self) -> int:
+        result = 0
+        shift = 0
+        buf = self.buf
+        while True:
+            if self.pos >= len(buf) or shift > 35:
+                raise BytecodeError(f"bad varint at offset {self.pos}")
+            byte = buf[self.pos]
+            self.pos += 1
+            result |= (byte & 0x7F) << shift
+            shift += 7
+            if not byte & 0x80:
+                return result
+
+    def count(self) -> int:
+        value = self.varint()
+        if value > len(self.buf):
+            raise BytecodeError(f"implausible count {value} at offset {self.pos}")
+        return value
+
+    def skip(self, size: int):
+        if self.pos + size > len(self.buf):
+            raise BytecodeError(f"truncated chunk at offset {self.pos}")
+        self.pos += size
+
+    def unpack(self, fmt: str) -> Tuple[Any, ...]:
+        try:
+            values = struct.unpack_from('<' + fmt, self.buf, self.pos)
+        except struct.error:
+            raise BytecodeError(f"truncated chunk at offset {self.pos}")
+        self.pos += struct.calcsize('<' + fmt)
+        return values
+
+    def string_ref(self) -> Optional[str]:
+        index = self.varint()
+        if index == 0:
+            return None
+        if index > len(self.strings):
+            raise BytecodeError(f"bad string reference {index}")
+        return self.strings[index - 1]
+
+    def chunk(self) -> Chunk:
+        start = self.pos
+        version = self.byte()
+        if version == 0:
+            raise BytecodeError(f"compile error: {_text(self.buf[self.pos:])}")
+        if version not in LUAU_VERSIONS:
+            raise BytecodeError(f"unsupported Luau version {version}")
+        types_version = self.byte() if version >= 4 else 0
+
+        for _ in range(self.count()):
+            size = self.count()
+            self.skip(size)
+            self.strings.append(_text(self.buf[self.pos - size:self.pos]))
+
+        if types_version == 3:
+            while self.byte() != 0:
+                self.varint()   # userdata type name
+
+        protos = []
+        for _ in range(self.count()):
+            protos.append(self.function(version))
+        main_id = self.varint()
+        if main_id >= len(protos):
+            raise BytecodeError(f"bad main function id {main_id}")
+
+        # Child references were stored as ids; resolve them now all protos exist
+        for proto in protos:
+            proto.protos = [protos[i] for i in proto.protos]
+            proto.constants = [protos[k[1]] if isinstance(k, tuple) and k[0] == 'closure' else k
+                               for k in proto.constants]
+
+        chunk = Chunk(f"luau-{version}", protos[main_id], self.pos - start)
+        chunk.strings = self.strings
+        return chunk
+
+    def function(self, version: int) -> Prototype:
+        proto = Prototype()
+        proto.max_stack, proto.num_params, proto.num_upvalues, proto.is_vararg = self.unpack('4B')
+        if version >= 4:
+            self.byte()                 # flags
+            self.skip(self.count())     # type information
+
+        size = self.count()
+        if self.pos + size * 4 > len(self.buf):
+            raise BytecodeError(f"truncated code at offset {self.pos}")
+        proto.code = struct.unpack_from(f"<{size}I", self.buf, self.pos)
+        self.pos += size * 4
+
+        for _ in range(self.count()):
+            kind = self.byte()
+            if kind == 0:
+                proto.constants.append(None)
+            elif kind == 1:
+                proto.constants.append(bool(self.byte()))
+            elif kind == 2:
+                proto.constants.append(self.unpack('d')[0])
+            elif kind == 3:
+                proto.constants.append(self.string_ref())
+            elif kind == 4:
+                proto.constants.append(('import', self.unpack('I')[0]))
+            elif kind == 5:
+                proto.constants.append(('table', [self.varint() for _ in range(self.count())]))
+            elif kind == 6:
+                proto.constants.append(('closure', self.varint()))
+            elif kind == 7:
+                proto.constants.append(('vector', self.unpack('4f')))
+            elif kind == 8:
+                keys = []
+                for _ in range(self.count()):
+                    keys.append(self.varint())
+                    self.unpack('i')
+                proto.constants.append(('table', keys))
+            else:
+                raise BytecodeError(f"bad constant type {kind} at offset {self.pos}")
+
+        # Imports pack up to three constant indices: count << 30 | k0 << 20 | k1 << 10 | k2
+        constants = proto.constants
+        for n, k in enumerate(constants):
+            if isinstance(k, tuple) and k[0] == 'import':
+                ids = [(k[1] >> shift) & 0x3FF for shift in (20, 10, 0)][:k[1] >> 30]
+                names = [constants[i] if i < n and isinstance(constants[i], str) else '?' for i in ids]
+                constants[n] = ('import', '.'.join(names))
+
+        proto.protos = [self.varint() for _ in range(self.count())]
+        proto.line_defined = self.varint()
+        proto.name = self.string_ref()
+
+        if self.byte():
+            # Byte offsets within each 2**gap_log2 interval, both delta encoded
+            gap_log2 = self.byte()
+            intervals = ((size - 1) >> gap_log2) + 1 if size else 0
+            self.skip(size)
+            offsets = accumulate(self.buf[self.pos - size:self.pos], lambda a, b: (a + b) & 0xFF)
+            bases = list(accumulate(self.unpack(f'{intervals}i')))
+            proto.lineinfo = tuple(bases[pc >> gap_log2] + offset for pc, offset in enumerate(offsets))
+        if self.byte():
+            for _ in range(self.count()):
+                name = self.string_ref()
+                start, end = self.varint(), self.varint()
+                self.byte()
+                proto.locals.append((name, start, end))
+            proto.upvalue_names = [self.string_ref() for _ in range(self.count())]
+        return proto
+
+
+def parse_chunk(data: Union[bytes, bytearray, memoryview], offset: int = 0) -> Chunk:
+    """Parse a precompiled chunk (PUC-Rio or Luau) starting at offset"""
+    buf = data if isinstance(data, memoryview) else memoryview(data)
+    if buf.format != 'B':
+        buf = buf.cast('B')
+    if bytes(buf[offset:offset + 4]) == LUA_SIGNATURE:
+        reader = _PucReader(buf, offset)
+        chunk = reader.header()
+        chunk.main = reader.function(None)
+        chunk.size = reader.pos - offset
+        return chunk
+    return _LuauReader(buf, offset).chunk()
+
+
+def _constant_text(k: Any) -> str:
+    if isinstance(k, str):
+        return '"' + k.encode('unicode_escape').decode('ascii').replace('"', '\\"') + '"'
+    if isinstance(k, bool):
+        return 'true' if k else 'false'
+    if k is None:
+        return 'nil'
+    if isinstance(k, Prototype):
+        return f"function <{k.name or 'anonymous'}:{k.line_defined}>"
+    if isinstance(k, tuple):
+        return f"{k[0]} {k[1]}"
+    return repr(k)
+
+
+def _puc_operands(name: str, insn: int, proto: Prototype) -> Tuple[str, str]:
+    """Format the operands and comment of a 5.1-5.3 instruction"""
+    a = (insn >> 6) & 0xFF
+    c = (insn >> 14) & 0x1FF
+    b = (insn >> 23) & 0x1FF
+    bx = (insn >> 14) & 0x3FFFF
+    constants = proto.constants
+
+    def rk(value: int) -> str:
+        if value & 0x100 and (value & 0xFF) < len(constants):
+            return _constant_text(constants[value & 0xFF])
+        return ''
+
+    if name in _ABX:
+        comment = _constant_text(constants[bx]) if name != 'CLOSURE' and bx < len(constants) else ''
+        return f"{a} {bx}", comment
+    if name in _ASBX:
+        return f"{a} {bx - 131071}", ''
+    if name == 'EXTRAARG':
+        return f"{insn >> 6}", ''
+    comment = ' '.join(part for part in (rk(b), rk(c)) if part)
+    return f"{a} {b} {c}", comment
+
+
+def _luau_operands(name: str, insn: int, aux: Optional[int], proto: Prototype) -> Tuple[str, str]:
+    """Format the operands and comment of a Luau instruction"""
+    a = (insn >> 8) & 0xFF
+    b = (insn >> 16) & 0xFF
+    c = (insn >> 24) & 0xFF
+    d = (insn >> 16) - 0x10000 if insn >> 31 else insn >> 16
+    constants = proto.constants
+    comment = ''
+    if name in ('LOADK', 'DUPCLOSURE') and 0 <= d < len(constants):
+        comment = _constant_text(constants[d])
+    elif name in ('GETGLOBAL', 'SETGLOBAL', 'GETTABLEKS', 'SETTABLEKS', 'NAMECALL', 'LOADKX') \
+            and aux is not None and aux < len(constants):
+        comment = _constant_text(constants[aux])
+    elif name == 'GETIMPORT' and 0 <= d < len(constants):
+        comment = _constant_text(constants[d])
+    if name in ('LOADN', 'LOADK', 'JUMP', 'JUMPBACK', 'JUMPIF', 'JUMPIFNOT', 'NEWCLOSURE',
+                'DUPCLOSURE', 'GETIMPORT', 'FORNPREP', 'FORNLOOP', 'FORGLOOP', 'FORGPREP',
+                'FORGPREP_INEXT', 'FORGPREP_NEXT') or name.startswith(('JUMPIF', 'JUMPXEQ')):
+        operands = f"{a} {d}"
+    elif name == 'JUMPX':
+        operands = f"{(insn >> 8) - 0x1000000 if insn >> 31 else insn >> 8}"
+    else:
+        operands = f"{a} {b} {c}"
+    if aux is not None:
+        operands += f" [{aux}]"
+    return operands, comment
+
+
+def disassemble(chunk: Chunk) -> str:
+    """Produce a luac -l style listing of every function in the chunk"""
+    lines = []
+    luau = chunk.version.startswith('luau')
+    opcodes = LUAU_OPCODES if luau else {
+        '5.1': LUA51_OPCODES, '5.2': LUA52_OPCODES, '5.3': LUA53_OPCODES}[chunk.version]
+
+    for proto in chunk.main.walk():
+        kind = 'main' if proto is chunk.main else 'function'
+        source = (proto.name or proto.source or '?').split('\n', 1)[0][:40]
+        lines.append(f"{kind} <{source}:{proto.line_defined},{proto.last_line}> "
+                     f"({len(proto.code)} instructions)")
+        lines.append(f"{proto.num_params}{'+' if proto.is_vararg else ''} params, "
+                     f"{proto.max_stack} slots, {proto.num_upvalues} upvalues, "
+                     f"{len(proto.locals)} locals, {len(proto.constants)} constants, "
+                     f"{len(proto.protos)} functions")
+
+        code = proto.code
+        pc = 0
+        while pc < len(code):
+            insn = code[pc]
+            if luau:
+                op = insn & 0xFF
+                name = opcodes[op] if op < len(opcodes) else f"OP_{op}"
+                aux = code[pc + 1] if name in LUAU_AUX and pc + 1 < len(code) else None
+                operands, comment = _luau_operands(name, insn, aux, proto)
+            else:
+                op = insn & 0x3F
+                name = opcodes[op] if op < len(opcodes) else f"OP_{op}"
+                aux = None
+                operands, comment = _puc_operands(name, insn, proto)
+            line = proto.lineinfo[pc] if pc < len(proto.lineinfo) else '-'
+            text = f"\t{pc + 1}\t[{line}]\t{name:<12}\t{operands}"
+            if comment:
+                text += f"\t; {comment}"
+            lines.append(text)
+            pc += 2 if aux is not None else 1
+
+        if proto.constants:
+            lines.append(f"constants ({len(proto.constants)}):")
+            for n, k in enumerate(proto.constants):
+                lines.append(f"\t{n}\t{_constant_text(k)}")
+        lines.append("")
+    return '\n'.join(lines)
+
+
+_ESCAPED_BLOB = re.compile(r'(?:\\(?:\d{1,3}|x[0-9a-fA-F]{2})){8}')
+_BASE64_BLOB = re.compile(r'[A-Za-z0-9+/]{24,}')
+_HEX_RUN = re.compile(r'(?:\\x[0-9a-fA-F]{2})+')
+# Every spelling of a decimal escape's digits; anything else in a run is a KeyError
+_DECIMAL_BYTES = {text: n for n in range(256) for text in {str(n), f'{n:02d}', f'{n:03d}'}}
+HEAD_CHARS = 1024        # literal prefix decoded to check for a chunk header first
+
+
+def _decode_escaped(literal: str) -> bytes:
+    """decode_string_literal, translating literals made only of \\ddd or only of
+    \\xHH escapes in one batch instead of one escape at a time"""
+    body = literal[1:-1]
+    if len(literal) >= 2 and literal[0] in '"\'' and literal[-1] == literal[0]:
+        if body[:1] == '\\' and body[1:2].isdigit():
+            try:
+                return bytes(map(_DECIMAL_BYTES.__getitem__, body[1:].split('\\')))
+            except KeyError:
+                pass                 # other text or escapes in between; decode one by one
+        elif body[:2] == '\\x' and _HEX_RUN.fullmatch(body):
+            return bytes.fromhex(body.replace('\\x', ''))
+    return decode_string_literal(literal)
+
+
+def _luau_candidate(data: bytes) -> bool:
+    """Cheap check before trying to parse an arbitrary blob as Luau bytecode"""
+    return len(data) >= 8 and data[0] in LUAU_VERSIONS and any(b < 0x09 for b in data[:64])
+
+
+def find_chunks(code: str, raw: Optional[bytes] = None) -> List[Tuple[str, Chunk]]:
+    """Locate and parse precompiled chunks embedded in a script.
+
+    Looks at raw binary blobs (in raw, or code encoded as latin-1), escaped
+    string literals and base64 strings. Returns (origin, chunk) pairs.
+    """
+    found: List[Tuple[str, Chunk]] = []
+
+    data = raw if raw is not None else code.encode('latin-1', errors='ignore')
+    view = memoryview(data)
+    pos = data.find(LUA_SIGNATURE)
+    while pos >= 0:
+        try:
+            chunk = parse_chunk(view, pos)
+            found.append((f"raw@{pos}", chunk))
+            pos = data.find(LUA_SIGNATURE, pos + chunk.size)
+        except BytecodeError:
+            pos = data.find(LUA_SIGNATURE, pos + 1)
+
+    # Escaped or base64 encoded chunks inside string literals
+    if not _ESCAPED_BLOB.search(code) and not _BASE64_BLOB.search(code):
+        return found
+    for tok in tokenize(code):
+        if tok.kind != 'string' or len(tok.value) < 10:
+            continue
+        candidates = []
+        if '\\' in tok.value:
+            if len(tok.value) > HEAD_CHARS:
+                # Most long escaped literals are not chunks: check the header before decoding it all
+                head = decode_string_literal(tok.value[:HEAD_CHARS])
+                if len(head) >= 64 and not (head.startswith(LUA_SIGNATURE) or _luau_candidate(head)):
+                    continue
+            candidates.append(('literal', _decode_escaped(tok.value)))
+        else:
+            body = tok.value[1:-1].strip()
+            if len(body) >= 24 and re.fullmatch(r'[A-Za-z0-9+/]+={0,2}', body):
+                try:
+                    candidates.append(('base64', base64.b64decode(body, validate=True)))
+                except ValueError:
+                    pass
+        for origin, blob in candidates:
+            if not (blob.startswith(LUA_SIGNATURE) or _luau_candidate(blob)):
+                continue
+            try:
+                chunk = parse_chunk(blob)
+            except BytecodeError:
+                continue
+            if chunk.version.startswith('luau') and chunk.size != len(blob):
+                continue
+            found.append((f"{origin}@line {tok.line}", chunk))
+    return found
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description='Lua Bytecode - Disassemble precompiled Lua/Luau chunks')
+    parser.add_argument('input_file', help='Chunk file (luac output or string.dump payload)')
+    parser.add_argument('-s', '--scan', action='store_true',
+                        help='Treat the input as Lua source and disassemble embedded chunks')
+    args = parser.parse_args(argv)
+
+    try:
+        with open(args.input_file, 'rb') as f:
+            data = f.read()
+    except OSError as e:
+        print(f"Error loading file: {e}")
+        return 1
+
+    if args.scan:
+        chunks = find_chunks(data.decode('utf-8', errors='ignore'), data)
+        if not chunks:
+            print("No embedded chunks found")
+        for origin, chunk in chunks:
+            print(f"-- {chunk.version} chunk ({origin}, {chunk.size} bytes)")
+            print(disassemble(chunk))
+        return 0
+
+    try:
+        chunk = parse_chunk(data)
+    except BytecodeError as e:
+        print(f"Failed to parse chunk: {e}")
+        return 1
+    print(disassemble(chunk))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,1288 @@
+#!/usr/bin/env python3
+"""
+Lua Control Flow - CFG construction and deflattening
+Builds a control flow graph over the token stream of a Lua script:
+- Label-delimited basic blocks with a label index for goto resolution
+- State-variable dispatch loops (while/if chains keyed on a state local)
+and rewrites flattened code back into structured statements, dropping
+blocks that can never be reached.
+"""
+
+import bisect
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+from lua_lexer import BlockMap, Token, decode_string_literal, match_blocks, tokenize
+
+MAX_PASSES = 16       # nested dispatchers are unwound one level per pass
+MAX_TRACE_STEPS = 4096
+MAX_FORK_COPIES = 2   # arms duplicated into both sides of a fork, relative to all arms
+MAX_EXACT_INT = 2 ** 53   # integers Lua 5.1 doubles and 5.3+ int64s both hold exactly
+
+# Binary operator priorities (left, right) as used by the reference Lua parser
+BINARY_PRIORITY = {
+    'or': (1, 1), 'and': (2, 2),
+    '<': (3, 3), '>': (3, 3), '<=': (3, 3), '>=': (3, 3), '~=': (3, 3), '==': (3, 3),
+    '|': (4, 4), '~': (5, 5), '&': (6, 6), '<<': (7, 7), '>>': (7, 7),
+    '..': (9, 8), '+': (10, 10), '-': (10, 10),
+    '*': (11, 11), '/': (11, 11), '//': (11, 11), '%': (11, 11),
+    '^': (14, 13),
+}
+UNARY_PRIORITY = 12
+
+OPAQUE = ('opaque',)
+UNASSIGNED = object()   # a dispatcher arm that leaves the state variable alone
+
+
+class NotConstant(Exception):
+    """Raised when an expression cannot be folded to a constant"""
+    pass
+
+
+def parse_number(text: str) -> Optional[float]:
+    """Convert a Lua numeric literal to a Python number"""
+    text = text.replace('_', '')
+    try:
+        if text[:2] in ('0x', '0X'):
+            if '.' in text or 'p' in text or 'P' in text:
+                return float.fromhex(text)
+            return int(text, 16)
+        if '.' in text or 'e' in text or 'E' in text:
+            return float(text)
+        return int(text)
+    except ValueError:
+        return None
+
+
+class ExpressionParser:
+    """Precedence-climbing parser producing small tuple ASTs.
+
+    Only the shapes needed for constant folding are modelled: literals,
+    plain names, unary and binary operators. Anything else (calls, indexing,
+    table constructors, closures) becomes an opaque node so the caller can
+    still find where the expression ends.
+    """
+
+    def __init__(self, tokens: List[Token], blocks: BlockMap):
+        self.tokens = tokens
+        self.blocks = blocks
+
+    def parse(self, pos: int, limit: int = 0) -> Tuple[tuple, int]:
+        """Parse an expression starting at token pos, return (ast, next position)"""
+        tokens = self.tokens
+        if pos >= len(tokens):
+            raise NotConstant('unexpected end of input')
+        tok = tokens[pos]
+
+        if tok.value in ('not', '-', '#', '~') and tok.kind in ('keyword', 'op'):
+            operand, pos = self.parse(pos + 1, UNARY_PRIORITY)
+            node = ('unary', tok.value, operand)
+        else:
+            node, pos = self._parse_simple(pos)
+
+        while pos < len(tokens):
+            tok = tokens[pos]
+            if tok.kind not in ('op', 'keyword') or tok.value not in BINARY_PRIORITY:
+                break
+            left, right = BINARY_PRIORITY[tok.value]
+            if left <= limit:
+                break
+            rhs, pos = self.parse(pos + 1, right)
+            node = ('binary', tok.value, node, rhs)
+        return node, pos
+
+    def _parse_simple(self, pos: int) -> Tuple[tuple, int]:
+        tokens = self.tokens
+        tok = tokens[pos]
+
+        if tok.kind == 'number':
+            value = parse_number(tok.value)
+            return (('const', value) if value is not None else OPAQUE), pos + 1
+        if tok.kind == 'keyword':
+            if tok.value == 'true':
+                return ('const', True), pos + 1
+            if tok.value == 'false':
+                return ('const', False), pos + 1
+            if tok.value == 'nil':
+                return ('const', None), pos + 1
+            if tok.value == 'function':
+                closer = self.blocks.closer.get(pos)
+                if closer is None:
+                    raise NotConstant('unterminated function')
+                return OPAQUE, closer + 1
+            raise NotConstant(f'unexpected keyword {tok.value}')
+        if tok.kind == 'string':
+            # Decoded, so "\98", 'b' and [[b]] all compare equal
+            return ('string', decode_string_literal(tok.value)), pos + 1
+        if tok.value == '...':
+            return OPAQUE, pos + 1
+        if tok.value == '{':
+            return OPAQUE, self._skip_balanced(pos)
+
+        if tok.kind == 'name':
+            node, pos = ('name', tok.value), pos + 1
+        elif tok.value == '(' and self._is_thunk(pos + 1):
+            # (function() return <expr> end)() - a wrapped constant
+            pos += 5
+            if tokens[pos].value in (';', 'end'):
+                node = ('const', None)
+            else:
+                node, pos = self.parse(pos)
+            if pos < len(tokens) and tokens[pos].value == ';':
+                pos += 1
+            if [t.value for t in tokens[pos:pos + 4]] != ['end', ')', '(', ')']:
+                raise NotConstant('unexpected thunk body')
+            return node, pos + 4
+        elif tok.value == '(':
+            node, pos = self.parse(pos + 1)
+            if pos >= len(tokens) or tokens[pos].value != ')':
+                raise NotConstant('unbalanced parenthesis')
+            pos += 1
+        else:
+            raise NotConstant(f'unexpected token {tok.value}')
+
+        # Suffixes: field access, indexing, method and function calls
+        suffixed = False
+        while pos < len(tokens):
+            tok = tokens[pos]
+            if tok.value in ('.', ':') and tok.kind == 'op':
+                pos += 2
+            elif tok.value in ('[', '(', '{') and tok.kind == 'op':
+                pos = self._skip_balanced(pos)
+            elif tok.kind == 'string':
+                pos += 1
+            else:
+                break
+            suffixed = True
+        return (OPAQUE if suffixed else node), pos
+
+    def _is_thunk(self, pos: int) -> bool:
+        """Does `function() return` start at pos?"""
+        return [t.value for t in self.tokens[pos:pos + 4]] == ['function', '(', ')', 'return']
+
+    def _skip_balanced(self, pos: int) -> int:
+        """Skip a bracketed group starting at pos, return the index after it"""
+        tokens = self.tokens
+        closer = self.blocks.closer
+        depth = 0
+        while pos < len(tokens):
+            tok = tokens[pos]
+            if tok.kind == 'op':
+                if tok.value in ('(', '[', '{'):
+                    depth += 1
+                elif tok.value in (')', ']', '}'):
+                    depth -= 1
+                    if depth == 0:
+                        return pos + 1
+            elif tok.kind == 'keyword' and tok.value == 'function' and pos in closer:
+                pos = closer[pos]
+            pos += 1
+        raise NotConstant('unbalanced brackets')
+
+
+def _truthy(value: Any) -> bool:
+    return value is not None and value is not False
+
+
+def _arith(value: Any) -> Any:
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise NotConstant('arithmetic on non-number')
+    return value
+
+
+def _exact(value: Any) -> Any:
+    # Beyond this, 5.3+ integers wrap and 5.1 doubles round where Python does neither
+    if isinstance(value, int) and not isinstance(value, bool) and abs(value) > MAX_EXACT_INT:
+        raise NotConstant('integer out of range')
+    return value
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _lua_equal(left: Any, right: Any) -> bool:
+    if _is_number(left) and _is_number(right):
+        return left == right
+    return type(left) is type(right) and left == right
+
+
+def evaluate(node: tuple, env: Dict[str, Any]) -> Any:
+    """Evaluate an expression AST with Lua semantics, raising NotConstant"""
+    kind = node[0]
+    if kind == 'const':
+        return _exact(node[1])
+    if kind == 'name':
+        if node[1] in env:
+            return env[node[1]]
+        raise NotConstant(node[1])
+    if kind == 'string':
+        return node[1]
+    if kind == 'unary':
+        op, value = node[1], evaluate(node[2], env)
+        if op == 'not':
+            return not _truthy(value)
+        if op == '-':
+            return _exact(-_arith(value))
+        if op == '#' and isinstance(value, bytes):
+            return len(value)
+        raise NotConstant(op)
+    if kind == 'binary':
+        op = node[1]
+        if op == 'and':
+            left = evaluate(node[2], env)
+            return evaluate(node[3], env) if _truthy(left) else left
+        if op == 'or':
+            left = evaluate(node[2], env)
+            return left if _truthy(left) else evaluate(node[3], env)
+        left, right = evaluate(node[2], env), evaluate(node[3], env)
+        if op == '==' or op == '~=':
+            equal = _lua_equal(left, right)
+            return equal if op == '==' else not equal
+        try:
+            if op in ('<', '>', '<=', '>='):
+                if not (_is_number(left) and _is_number(right)):
+                    raise NotConstant('comparison of non-numbers')
+                return {'<': left < right, '>': left > right,
+                        '<=': left <= right, '>=': left >= right}[op]
+            left, right = _arith(left), _arith(right)
+            if op == '+':
+                return _exact(left + right)
+            if op == '-':
+                return _exact(left - right)
+            if op == '*':
+                return _exact(left * right)
+            if op == '/':
+                return left / right
+            if op == '%':
+                return left % right
+            if op == '//':
+                return left // right
+            if op == '^':
+                result = float(left) ** right
+                if isinstance(result, complex):
+                    raise NotConstant('complex power')
+                return result
+        except (ZeroDivisionError, OverflowError, ValueError) as e:
+            raise NotConstant(str(e))
+    raise NotConstant(kind)
+
+
+def expression_names(node: tuple) -> Set[str]:
+    """Collect the free names referenced by an expression AST"""
+    names = set()
+    stack = [node]
+    while stack:
+        current = stack.pop()
+        if current[0] == 'name':
+            names.add(current[1])
+        elif current[0] == 'unary':
+            stack.append(current[2])
+        elif current[0] == 'binary':
+            stack.append(current[2])
+            stack.append(current[3])
+        elif current[0] == 'opaque':
+            names.add('')
+    return names
+
+
+class BasicBlock:
+    """A straight-line region of the token stream"""
+
+    __slots__ = ('id', 'kind', 'scope', 'start', 'end', 'label', 'successors', 'reachable')
+
+    def __init__(self, block_id: int, kind: str, scope: int, start: int, end: int,
+                 label: Optional[str] = None):
+        self.id = block_id
+        self.kind = kind            # 'segment' (label-delimited) or 'case' (dispatcher arm)
+        self.scope = scope          # lexical block id from the BlockMap
+        self.start = start          # first token index
+        self.end = end              # one past the last token index
+        self.label = label
+        self.successors: List[int] = []
+        self.reachable = False
+
+
+class ForkBranch:
+    """One branch of the trailing if through which a dispatcher arm picks the next state"""
+
+    __slots__ = ('keyword', 'mark', 'stop', 'assignment', 'skip', 'terminal', 'has_locals')
+
+    def __init__(self, keyword: int, mark: int, stop: int):
+        self.keyword = keyword          # 'if'/'elseif' token, -1 for an implicit else
+        self.mark = mark                # 'then'/'else' token opening the body
+        self.stop = stop                # token closing the body
+        self.assignment: Any = UNASSIGNED
+        self.skip: Tuple[Tuple[int, int], ...] = ()
+        self.terminal: Optional[str] = None     # 'return' when the branch leaves the function
+        self.has_locals = False
+
+
+class DispatchCase:
+    """One arm of a dispatcher: its block plus how it updates the state variable"""
+
+    __slots__ = ('node', 'assignment', 'terminal', 'skip', 'has_locals', 'fork', 'branches',
+                 'values', 'tangled')
+
+    def __init__(self, node: BasicBlock, assignment: Any, terminal: Optional[str],
+                 skip: Tuple[Tuple[int, int], ...], has_locals: bool):
+        self.node = node
+        self.assignment = assignment    # new state value (nil included), or UNASSIGNED
+        self.terminal = terminal        # 'return', 'break' or None
+        self.skip = skip                # token spans dropped when the arm is inlined
+        self.has_locals = has_locals
+        self.fork = -1                  # 'if' token choosing the next state, or -1
+        self.branches: Tuple[ForkBranch, ...] = ()
+        self.values: List[Any] = []     # every state value the arm can assign, nested ones included
+        self.tangled = False            # nested assignments the simulation cannot follow
+
+
+class DispatchPath:
+    """The arms a dispatcher runs from one state on, up to an exit, a loop back or a fork"""
+
+    __slots__ = ('trace', 'loop', 'exit', 'back', 'terminal', 'branches')
+
+    def __init__(self):
+        self.trace: List[DispatchCase] = []
+        self.loop = -1                  # trace index a loop back (from here or a branch) lands on
+        self.exit = -1                  # branch leaving that loop, -1 when only a return does
+        self.back: Optional['DispatchPath'] = None  # path this one loops back into
+        self.terminal: Optional[str] = None
+        self.branches: List['DispatchPath'] = []   # per fork branch when the last arm forks
+
+
+class Dispatcher:
+    """A state-variable dispatch loop recovered from the token stream"""
+
+    __slots__ = ('loop', 'state_var', 'initial', 'init_span', 'cases', 'statements', 'path')
+
+    def __init__(self, loop: int, state_var: str, initial: Any):
+        self.loop = loop                # index of the 'while' token
+        self.state_var = state_var
+        self.initial = initial
+        self.init_span: Tuple[int, int] = (0, 0)
+        self.cases: List[DispatchCase] = []
+        self.statements: List[Tuple[int, List[DispatchCase]]] = []  # if token -> its arms
+        self.path: Optional[DispatchPath] = None    # None when the loop has to stay
+
+
+class ControlFlowGraph:
+    """Control flow graph over a token stream"""
+
+    def __init__(self, code: str, tokens: List[Token], blocks: BlockMap):
+        self.code = code
+        self.tokens = tokens
+        self.blocks = blocks
+        self.parser = ExpressionParser(tokens, blocks)
+        self.nodes: List[BasicBlock] = []
+        self.label_index: Dict[Tuple[int, str], int] = {}   # (scope, label) -> node id
+        self.segments: Dict[int, List[BasicBlock]] = {}     # scope -> segments in order
+        self.segment_starts: Dict[int, List[int]] = {}      # scope -> first token of each segment
+        self.flow: Dict[int, Optional[int]] = {}            # segment -> fall-through/goto target
+        self.gotos: List[int] = []                          # goto token indices
+        self.goto_targets: Dict[int, List[Tuple[int, int]]] = {}  # scope -> (goto token, segment)
+        self.name_uses: Dict[str, List[int]] = {}           # name -> token indices, in order
+        self.dispatchers: List[Dispatcher] = []
+
+    @property
+    def edges(self) -> int:
+        return sum(len(node.successors) for node in self.nodes)
+
+    @property
+    def unreachable(self) -> List[BasicBlock]:
+        return [node for node in self.nodes if not node.reachable]
+
+    # ------------------------------------------------------------------ helpers
+
+    def _new_node(self, kind: str, scope: int, start: int, end: int,
+                  label: Optional[str] = None) -> BasicBlock:
+        node = BasicBlock(len(self.nodes), kind, scope, start, end, label)
+        self.nodes.append(node)
+        return node
+
+    def text(self, start: int, end: int, skip: Tuple[Tuple[int, int], ...] = ()) -> str:
+        """Source text of tokens [start, end) with the token spans in skip removed"""
+        if start >= end:
+            return ''
+        tokens = self.tokens
+        pieces = []
+        pos = tokens[start].start
+        for skip_start, skip_end in sorted(skip):
+            if skip_start >= end or skip_end <= start or skip_start >= skip_end:
+                continue
+            pieces.append(self.code[pos:tokens[skip_start].start])
+            pos = tokens[skip_end - 1].end
+        pieces.append(self.code[pos:tokens[end - 1].end])
+        return ''.join(pieces).strip()
+
+    def indent_of(self, i: int) -> str:
+        """Leading whitespace of the line holding token i"""
+        offset = self.tokens[i].start
+        line_start = self.code.rfind('\n', 0, offset) + 1
+        prefix = self.code[line_start:offset]
+        return prefix if not prefix.strip() else ''
+
+    def resolve_label(self, scope: int, name: str) -> Optional[int]:
+        """Find the segment a goto in scope jumps to by walking enclosing scopes"""
+        parent = self.blocks.parent
+        while scope >= 0:
+            node = self.label_index.get((scope, name))
+            if node is not None:
+                return node
+            scope = parent[scope]
+        return None
+
+    def segment_at(self, scope: int, i: int) -> Optional[BasicBlock]:
+        """Segment of scope whose token range contains token i"""
+        segments = self.segments.get(scope)
+        if not segments:
+            return None
+        n = bisect.bisect_right(self.segment_starts[scope], i) - 1
+        if n < 0:
+            return None
+        # A label token belongs to the segment it opens
+        if n + 1 < len(segments) and segments[n + 1].start - 1 == i:
+            n += 1
+        node = segments[n]
+        return node if i < node.end or n + 1 == len(segments) else None
+
+    def _top_level(self, start: int, end: int):
+        """Yield token indices in [start, end) not nested in a sub-statement or bracket"""
+        tokens = self.tokens
+        closer = self.blocks.closer
+        depth = 0
+        i = start
+        while i < end:
+            tok = tokens[i]
+            if tok.kind == 'keyword' and i in closer:
+                if depth == 0 and tok.value != 'function':
+                    yield i
+                i = closer[i] + 1
+                continue
+            if tok.kind == 'op':
+                if tok.value in ('(', '[', '{'):
+                    depth += 1
+                elif tok.value in (')', ']', '}'):
+                    depth -= 1
+            if depth == 0:
+                yield i
+            i += 1
+
+    def _statement_start(self, i: int) -> bool:
+        """Heuristic: does token i begin a statement rather than continue an expression?"""
+        if i == 0:
+            return True
+        prev = self.tokens[i - 1]
+        if prev.kind == 'op':
+            return prev.value in (';', ')', ']', '}')
+        if prev.kind == 'keyword':
+            return prev.value in ('do', 'then', 'else', 'end', 'repeat', 'break',
+                                  'true', 'false', 'nil')
+        return True
+
+    # --------------------------------------------------------------- build
+
+    def build(self) -> 'ControlFlowGraph':
+        """Index labels and gotos, split scopes into segments, find dispatchers"""
+        tokens = self.tokens
+        block_of = self.blocks.block_of
+        labels_by_scope: Dict[int, List[int]] = {}
+
+        name_uses = self.name_uses
+        for i, tok in enumerate(tokens):
+            if tok.kind == 'name':
+                uses = name_uses.get(tok.value)
+                if uses is None:
+                    name_uses[tok.value] = [i]
+                else:
+                    uses.append(i)
+            elif tok.kind == 'label':
+                labels_by_scope.setdefault(block_of[i], []).append(i)
+            elif tok.kind == 'keyword' and tok.value == 'goto' and i + 1 < len(tokens):
+                self.gotos.append(i)
+
+        for scope, label_tokens in labels_by_scope.items():
+            self._build_scope(scope, label_tokens)
+        self._link_segments()
+
+        closer = self.blocks.closer
+        for i, tok in enumerate(tokens):
+            if tok.kind == 'keyword' and tok.value == 'while' and i in closer:
+                dispatcher = self._match_dispatcher(i)
+                if dispatcher is not None:
+                    self.dispatchers.append(dispatcher)
+        return self
+
+    def _build_scope(self, scope: int, label_tokens: List[int]):
+        blocks = self.blocks
+        first = blocks.start[scope] + 1 if scope > 0 else 0
+        owner = blocks.owner[scope]
+        if owner >= 0 and self.tokens[owner].value == 'function':
+            first = blocks.body.get(owner, first - 1) + 1
+        stop = blocks.stop[scope]
+
+        segments = [self._new_node('segment', scope, first, label_tokens[0])]
+        for n, label_tok in enumerate(label_tokens):
+            end = label_tokens[n + 1] if n + 1 < len(label_tokens) else stop
+            node = self._new_node('segment', scope, label_tok + 1, end, self.tokens[label_tok].value)
+            self.label_index[(scope, node.label)] = node.id
+            segments.append(node)
+        self.segments[scope] = segments
+        self.segment_starts[scope] = [node.start for node in segments]
+
+    def terminator(self, node: BasicBlock) -> Tuple[str, int]:
+        """How a segment ends: ('goto', goto token), ('exit', -1) or ('fall', -1)"""
+        tokens = self.tokens
+        end = node.end
+        while end > node.start and tokens[end - 1].value == ';':
+            end -= 1
+        if end - node.start >= 2 and tokens[end - 2].kind == 'keyword' and \
+                tokens[end - 2].value == 'goto' and self.blocks.block_of[end - 2] == node.scope:
+            return 'goto', end - 2
+        for i in self._top_level(node.start, end):
+            if tokens[i].kind == 'keyword' and tokens[i].value in ('return', 'break'):
+                return 'exit', -1
+        return 'fall', -1
+
+    def _link_segments(self):
+        """Add goto and fall-through edges between segments and mark reachability"""
+        tokens = self.tokens
+        block_of = self.blocks.block_of
+
+        for segments in self.segments.values():
+            for n, node in enumerate(segments):
+                kind, goto_tok = self.terminator(node)
+                target = None
+                if kind == 'goto':
+                    target = self.resolve_label(node.scope, tokens[goto_tok + 1].value)
+                elif kind == 'fall' and n + 1 < len(segments):
+                    target = segments[n + 1].id
+                self.flow[node.id] = target
+                if target is not None:
+                    node.successors.append(target)
+
+        # Conditional gotos nested inside a segment also leave it
+        for goto_tok in self.gotos:
+            target = self.resolve_label(block_of[goto_tok], tokens[goto_tok + 1].value)
+            if target is None:
+                continue
+            scope = self.nodes[target].scope
+            self.goto_targets.setdefault(scope, []).append((goto_tok, target))
+            source = self.segment_at(scope, goto_tok)
+            if source is not None and target not in source.successors:
+                source.successors.append(target)
+
+        for segments in self.segments.values():
+            work = [segments[0]]
+            while work:
+                node = work.pop()
+                if node.reachable:
+                    continue
+                node.reachable = True
+                work.extend(self.nodes[succ] for succ in node.successors
+                            if not self.nodes[succ].reachable)
+
+    # ---------------------------------------------------------- dispatchers
+
+    def _match_dispatcher(self, loop: int) -> Optional[Dispatcher]:
+        """Recognise `local s = k  while <cond(s)> do if <cond(s)> then ... end ... end`"""
+        tokens = self.tokens
+        blocks = self.blocks
+        body_tok = blocks.body.get(loop)
+        loop_end = blocks.closer[loop]
+        if body_tok is None:
+            return None
+
+        try:
+            loop_cond, cond_end = self.parser.parse(loop + 1)
+        except (NotConstant, RecursionError):
+            return None
+        if cond_end != body_tok:
+            return None
+
+        # The loop body must be a sequence of if statements
+        statements = []
+        i = body_tok + 1
+        while i < loop_end:
+            tok = tokens[i]
+            if tok.value == ';':
+                i += 1
+                continue
+            if tok.kind != 'keyword' or tok.value != 'if' or i not in blocks.closer:
+                return None
+            statements.append(i)
+            i = blocks.closer[i] + 1
+        if not statements:
+            return None
+
+        # Each arm: (condition ast or None for else, first body token, end token)
+        arms_by_statement = []
+        state_names = expression_names(loop_cond)
+        for stmt in statements:
+            marks = blocks.branches[stmt] + [blocks.closer[stmt]]
+            arms = []
+            cond_start = stmt + 1
+            for n, mark in enumerate(marks[:-1]):
+                mark_value = tokens[mark].value
+                if mark_value == 'then':
+                    try:
+                        cond, cond_end = self.parser.parse(cond_start)
+                    except (NotConstant, RecursionError):
+                        return None
+                    if cond_end != mark:
+                        return None
+                    state_names |= expression_names(cond)
+                    arms.append((cond, mark, marks[n + 1]))
+                elif mark_value == 'elseif':
+                    cond_start = mark + 1
+                else:
+                    arms.append((None, mark, marks[n + 1]))
+            arms_by_statement.append(arms)
+
+        if len(state_names) != 1 or '' in state_names:
+            return None
+        state_var = next(iter(state_names))
+
+        initial = self._find_initializer(loop, state_var)
+        if initial is None or self._referenced_after(loop_end, state_var) or self._captured(loop, state_var):
+            return None
+
+        dispatcher = Dispatcher(loop, state_var, initial[0])
+        dispatcher.init_span = initial[1]
+        dispatch_table = []
+        for stmt, arms in zip(statements, arms_by_statement):
+            cases = []
+            for cond, mark, end in arms:
+                case = self._analyse_case(dispatcher, mark, end)
+                if case is None:
+                    return None
+                cases.append((cond, case))
+                dispatcher.cases.append(case)
+            dispatch_table.append(cases)
+            dispatcher.statements.append((stmt, [case for _, case in cases]))
+
+        if not self._simulate(dispatcher, loop_cond, dispatch_table):
+            # The loop stays, but arms no state value selects can still go
+            self._mark_selectable(dispatcher, dispatch_table)
+        return dispatcher
+
+    def _previous_use(self, i: int, name: str) -> int:
+        """Index of the closest token before i naming name in the same block, or -1"""
+        tokens = self.tokens
+        blocks = self.blocks
+        scope = blocks.block_of[i]
+        i -= 1
+        for _ in range(512):
+            if i < 0 or blocks.block_of[i] != scope:
+                return -1
+            if i in blocks.opener:
+                i = blocks.opener[i] - 1
+                continue
+            if tokens[i].kind == 'name' and tokens[i].value == name:
+                return i
+            i -= 1
+        return -1
+
+    def _find_initializer(self, loop: int, state_var: str) -> Optional[Tuple[Any, Tuple[int, int]]]:
+        """Locate `[local] <state_var> = <constant>` earlier in the same block"""
+        tokens = self.tokens
+        i = self._previous_use(loop, state_var)
+        if i < 0 or tokens[i + 1].value != '=':
+            return None
+        declared = i > 0 and tokens[i - 1].value == 'local'
+        if not declared:
+            # A plain assignment must follow a declaration in this block,
+            # otherwise the state variable outlives the rewritten code
+            if not self._statement_start(i):
+                return None
+            j = self._previous_use(i, state_var)
+            if j < 1 or tokens[j - 1].value != 'local':
+                return None
+
+        try:
+            node, end = self.parser.parse(i + 2)
+            value = evaluate(node, {})
+        except (NotConstant, RecursionError):
+            return None
+        if end > loop:
+            return None
+        if end < loop and tokens[end].value == ';':
+            end += 1
+        if any(tokens[j].value == state_var for j in range(end, loop)):
+            return None
+        return value, (i - 1 if declared else i, end)
+
+    def _uses_between(self, name: str, start: int, stop: int) -> List[int]:
+        """Token indices in [start, stop) naming name"""
+        uses = self.name_uses.get(name, ())
+        return uses[bisect.bisect_left(uses, start):bisect.bisect_left(uses, stop)]
+
+    def _referenced_after(self, loop_end: int, name: str) -> bool:
+        """Is name used after the loop within the enclosing block?"""
+        stop = min(self.blocks.stop[self.blocks.block_of[loop_end]], len(self.tokens))
+        return bool(self._uses_between(name, loop_end + 1, stop))
+
+    def _captured(self, loop: int, name: str) -> bool:
+        """Is name captured by a closure in the loop's enclosing block? The
+        closure would observe the state assignments the rewrite drops"""
+        tokens = self.tokens
+        blocks = self.blocks
+        scope = blocks.block_of[loop]
+        first = blocks.start[scope] + 1 if scope > 0 else 0
+        stop = min(blocks.stop[scope], len(tokens)) if scope > 0 else len(tokens)
+        for i in self._uses_between(name, first, stop):
+            if tokens[i - 1].value in ('.', ':'):
+                continue
+            block = blocks.block_of[i]
+            while block != scope and block > 0:
+                if tokens[blocks.owner[block]].value == 'function':
+                    return True
+                block = blocks.parent[block]
+        return False
+
+    def _escapes_to(self, i: int, arm_scope: int) -> bool:
+        """Would a break/continue at token i leave the dispatcher arm?"""
+        blocks = self.blocks
+        tokens = self.tokens
+        scope = blocks.block_of[i]
+        while scope != arm_scope and scope > 0:
+            owner = blocks.owner[scope]
+            if tokens[owner].value in ('while', 'for', 'repeat', 'function'):
+                return False
+            scope = blocks.parent[scope]
+        return True
+
+    def _analyse_case(self, dispatcher: Dispatcher, mark: int, end: int) -> Optional[DispatchCase]:
+        """Work out what a dispatcher arm does to the state variable"""
+        tokens = self.tokens
+        blocks = self.blocks
+        state_var = dispatcher.state_var
+        start = mark + 1
+        arm_scope = blocks.block_of[start] if start < end else -1
+
+        assignment = UNASSIGNED
+        terminal = None
+        has_locals = False
+        skip = []
+        nested: List[Tuple[int, int, Any]] = []      # state assignments below the arm's top level
+
+        for i in range(start, end):
+            tok = tokens[i]
+            top = blocks.block_of[i] == arm_scope
+            if tok.kind == 'keyword':
+                if tok.value == 'goto':
+                    return None
+                if tok.value == 'break' and self._escapes_to(i, arm_scope):
+                    tail = i + 1
+                    while tail < end and tokens[tail].value == ';':
+                        tail += 1
+                    if not top or tail != end:
+                        return None
+                    terminal = 'break'
+                    skip.append((i, end))
+                elif tok.value == 'return' and top:
+                    terminal = 'return'
+                elif tok.value == 'local' and top:
+                    has_locals = True
+            elif tok.kind == 'name':
+                if tok.value == 'continue' and self._statement_start(i) and self._escapes_to(i, arm_scope):
+                    return None
+                if tok.value != state_var:
+                    continue
+                if i + 1 >= end or tokens[i + 1].value != '=' or not self._statement_start(i):
+                    return None
+                try:
+                    node, expr_end = self.parser.parse(i + 2)
+                    value = evaluate(node, {})
+                except (NotConstant, RecursionError):
+                    return None
+                if expr_end > end:
+                    return None
+                if expr_end < end and tokens[expr_end].value == ';':
+                    expr_end += 1
+                skip.append((i, expr_end))
+                if not top:
+                    nested.append((i, expr_end, value))
+                elif assignment is not UNASSIGNED:
+                    return None
+                else:
+                    assignment = value
+
+        node = self._new_node('case', arm_scope, start, end)
+        case = DispatchCase(node, assignment, terminal, tuple(skip), has_locals)
+        case.values = [value for _, _, value in nested]
+        if assignment is not UNASSIGNED:
+            case.values.append(assignment)
+        if nested and not self._analyse_fork(case, nested):
+            case.tangled = True
+        return case
+
+    def _analyse_fork(self, case: DispatchCase, nested: List[Tuple[int, int, Any]]) -> bool:
+        """Accept state assignments that end the branches of the arm's final if statement"""
+        tokens = self.tokens
+        blocks = self.blocks
+        block_of = blocks.block_of
+        if case.assignment is not UNASSIGNED or case.terminal is not None or case.has_locals:
+            return False
+        fork = blocks.owner[block_of[nested[0][0]]]
+        if fork < 0 or tokens[fork].value != 'if' or block_of[fork] != case.node.scope:
+            return False
+        tail = blocks.closer[fork] + 1
+        while tail < case.node.end and tokens[tail].value == ';':
+            tail += 1
+        if tail != case.node.end:
+            return False
+
+        by_block: Dict[int, Tuple[int, int, Any]] = {}
+        for entry in nested:
+            block = block_of[entry[0]]
+            # One assignment per branch, as the branch's last statement
+            if blocks.owner[block] != fork or block in by_block or entry[1] != blocks.stop[block]:
+                return False
+            by_block[block] = entry
+
+        marks = blocks.branches[fork] + [blocks.closer[fork]]
+        keyword = fork
+        branches = []
+        for n, mark in enumerate(marks[:-1]):
+            if tokens[mark].value == 'elseif':
+                keyword = mark
+                continue
+            branch = ForkBranch(keyword if tokens[mark].value == 'then' else -1, mark, marks[n + 1])
+            if mark + 1 < branch.stop:
+                block = block_of[mark + 1]
+                if block in by_block:
+                    at, expr_end, branch.assignment = by_block[block]
+                    branch.skip = ((at, expr_end),)
+                for i in range(mark + 1, branch.stop):
+                    if block_of[i] == block and tokens[i].value in ('return', 'local') and \
+                            tokens[i].kind == 'keyword':
+                        if tokens[i].value == 'return':
+                            branch.terminal = 'return'
+                        else:
+                            branch.has_locals = True
+            branches.append(branch)
+        if tokens[marks[-2]].value != 'else':
+            branches.append(ForkBranch(-1, -1, -1))     # falling through keeps the state
+        case.fork = fork
+        case.branches = tuple(branches)
+        return True
+
+    def _simulate(self, dispatcher: Dispatcher, loop_cond: tuple, dispatch_table) -> bool:
+        """Run the dispatcher on its constant state to recover the case order"""
+        budget = [MAX_TRACE_STEPS]
+        try:
+            path = self._walk(dispatcher, loop_cond, dispatch_table, dispatcher.initial, 0, {}, budget)
+        except (NotConstant, TypeError):
+            return False
+        if path is None:
+            return False
+
+        if not _nests(path, None):
+            return False
+
+        paths = list(_paths(path))
+        if sum(len(current.trace) for current, _ in paths) > MAX_FORK_COPIES * len(dispatcher.cases):
+            return False
+
+        # Record the recovered edges; arms never visited are unreachable
+        for current, previous in paths:
+            trace = current.trace
+            for case in trace:
+                case.node.reachable = True
+            steps = list(zip(trace, trace[1:]))
+            if previous is not None and trace:
+                steps.append((previous, trace[0]))
+            last = trace[-1] if trace else previous
+            if current.back is not None and last is not None:
+                steps.append((last, current.back.trace[current.back.loop]))
+            for case, following in steps:
+                if following.node.id not in case.node.successors:
+                    case.node.successors.append(following.node.id)
+        dispatcher.path = path
+        return True
+
+    def _mark_selectable(self, dispatcher: Dispatcher, dispatch_table) -> None:
+        """Mark the arms some assignable state value selects as reachable"""
+        values = [dispatcher.initial] + [value for case in dispatcher.cases for value in case.values]
+        for value in values:
+            env = {dispatcher.state_var: value}
+            for arms in dispatch_table:
+                for cond, case in arms:
+                    try:
+                        selected: Optional[bool] = cond is None or _truthy(evaluate(cond, env))
+                    except (NotConstant, TypeError):
+                        selected = None
+                    if selected is not False:
+                        case.node.reachable = True
+                    if selected:
+                        break
+
+    def _walk(self, dispatcher: Dispatcher, loop_cond: tuple, dispatch_table, state: Any, n: int,
+              seen: Dict[Tuple[Any, int], Tuple[DispatchPath, int]], budget: List[int]) -> Optional[DispatchPath]:
+        """Follow the dispatcher from state at its n-th if statement, splitting at forks.
+
+        Flow reaching a state it already ran loops back into the path that ran
+        it. Returns None when it spins without running an arm, loops back into
+        one path at two places, meets an arm it cannot follow, or runs past
+        the step budget.
+        """
+        env = {dispatcher.state_var: state}
+        path = DispatchPath()
+        trace = path.trace
+        while budget[0] > 0:
+            budget[0] -= 1
+            if n == 0 and not _truthy(evaluate(loop_cond, env)):
+                path.terminal = 'exit'
+                return path
+            key = (env[dispatcher.state_var], n)
+            if key in seen:
+                owner, index = seen[key]
+                if owner is path and index == len(trace):
+                    return None     # spins forever without running any arm
+                if owner.loop >= 0 and owner.loop != index:
+                    return None
+                owner.loop = index
+                path.back = owner
+                return path
+            seen[key] = (path, len(trace))
+            case = next((case for cond, case in dispatch_table[n]
+                         if cond is None or _truthy(evaluate(cond, env))), None)
+            n = (n + 1) % len(dispatch_table)
+            if case is None:
+                continue
+            if case.tangled:
+                return None
+            trace.append(case)
+            if case.terminal is not None:
+                path.terminal = case.terminal
+                return path
+            if case.fork >= 0:
+                for branch in case.branches:
+                    if branch.terminal is not None:
+                        following = DispatchPath()
+                        following.terminal = branch.terminal
+                    else:
+                        following = self._walk(
+                            dispatcher, loop_cond, dispatch_table,
+                            env[dispatcher.state_var] if branch.assignment is UNASSIGNED else branch.assignment,
+                            n, dict(seen), budget)
+                        if following is None:
+                            return None
+                    path.branches.append(following)
+                return path
+            if case.assignment is not UNASSIGNED:
+                env[dispatcher.state_var] = case.assignment
+        return None
+
+    # ------------------------------------------------------------- rewriting
+
+    def _render_case(self, case: DispatchCase, indent: str) -> str:
+        body = self.text(case.node.start, case.node.end, case.skip)
+        if body and case.has_locals and case.terminal != 'return':
+            body = _wrap('do', body, 'end', indent)
+        return body
+
+    def _render_branch(self, branch: ForkBranch, path: DispatchPath, indent: str) -> List[str]:
+        """Statements of a fork branch followed by the flow it leads to"""
+        pieces = self._render_path(path, indent)
+        if branch.mark >= 0:
+            body = self.text(branch.mark + 1, branch.stop, branch.skip)
+            if body and branch.has_locals and branch.terminal is None:
+                body = _wrap('do', body, 'end', indent)
+            if body:
+                pieces.insert(0, body)
+        return pieces
+
+    def _render_fork(self, case: DispatchCase, paths: List[DispatchPath], indent: str) -> str:
+        """An arm ending in a fork, with each branch followed by the flow it leads to"""
+        tokens = self.tokens
+        inner = indent + _indent_step(indent)
+        head = self.text(case.node.start, case.fork, case.skip)
+        lines = [head] if head else []
+        for branch, path in zip(case.branches, paths):
+            pieces = self._render_branch(branch, path, inner)
+            if branch.keyword < 0:
+                if not pieces:
+                    continue
+                lines.append('else')
+            else:
+                opener = 'if' if branch.keyword == case.fork else 'elseif'
+                lines.append(f"{opener} {self.text(branch.keyword + 1, branch.mark)} then")
+            if pieces:
+                lines.append(inner[len(indent):] + ('\n' + inner).join(pieces))
+        lines.append(tokens[self.blocks.closer[case.fork]].value)
+        return ('\n' + indent).join(lines)
+
+    def _render_loop(self, path: DispatchPath, indent: str) -> List[str]:
+        """The arms of a path from its loop head on as a while loop, followed by
+        the branch that leaves it"""
+        inner = indent + _indent_step(indent)
+        bodies = [self._render_case(case, inner) for case in path.trace[path.loop:]]
+        condition = 'true'
+        after: List[str] = []
+        if path.branches and path.exit < 0:
+            bodies[-1] = self._render_fork(path.trace[-1], path.branches, inner)
+        elif path.branches:
+            case = path.trace[-1]
+            stay = 1 - path.exit
+            test = self.text(case.fork + 1, case.branches[0].mark)
+            bodies[-1] = self.text(case.node.start, case.fork, case.skip)
+            if any(bodies):
+                bodies.append(f"if {test if stay else f'not ({test})'} then break end")
+            else:
+                condition = f"not ({test})" if stay else test
+            bodies.extend(self._render_branch(case.branches[stay], path.branches[stay], inner))
+            after = self._render_branch(case.branches[path.exit], path.branches[path.exit], indent)
+        loop_body = ('\n' + inner).join(body for body in bodies if body)
+        return [_wrap(f'while {condition} do', loop_body, 'end', indent)] + after
+
+    def _render_path(self, path: DispatchPath, indent: str) -> List[str]:
+        """Statements for the arms of a path, looping or forking at its end"""
+        if path.loop >= 0:
+            head = [self._render_case(case, indent) for case in path.trace[:path.loop]]
+            return [body for body in head if body] + self._render_loop(path, indent)
+        bodies = [self._render_case(case, indent) for case in path.trace]
+        if path.branches:
+            bodies[-1] = self._render_fork(path.trace[-1], path.branches, indent)
+        return [body for body in bodies if body]
+
+    def dispatcher_edit(self, dispatcher: Dispatcher) -> Tuple[int, int, str]:
+        """Replacement (start offset, end offset, text) for a dispatcher and its initializer"""
+        tokens = self.tokens
+        loop_end = self.blocks.closer[dispatcher.loop]
+        init_start, init_end = dispatcher.init_span
+        indent = self.indent_of(init_start)
+        path = dispatcher.path
+        pieces = self._render_path(path, indent)
+        while path.loop >= 0 and path.exit >= 0:
+            path = path.branches[path.exit]     # the flow rendered last
+        following = tokens[loop_end + 1].value if loop_end + 1 < len(tokens) else 'end'
+        if path.back is None and path.terminal == 'return' and pieces and \
+                following not in ('end', 'else', 'elseif', 'until'):
+            # return must stay the last statement of its block
+            pieces[-1] = _wrap('do', pieces[-1], 'end', indent)
+
+        between = self.code[tokens[init_end - 1].end:tokens[dispatcher.loop].start].strip()
+        if between:
+            pieces.insert(0, between)
+        return tokens[init_start].start, tokens[loop_end].end, ('\n' + indent).join(pieces)
+
+    def arm_edits(self, dispatcher: Dispatcher) -> List[Tuple[int, int, str, int]]:
+        """Replacements (start offset, end offset, text, arms dropped) removing the
+        unreachable arms of a dispatcher whose loop has to stay"""
+        tokens = self.tokens
+        code = self.code
+        edits = []
+        for stmt, cases in dispatcher.statements:
+            dropped = sum(1 for case in cases if not case.node.reachable)
+            if not dropped:
+                continue
+            pieces = []
+            keyword = stmt
+            for case in cases:
+                mark = case.node.start - 1
+                stop = tokens[case.node.end].start
+                if not case.node.reachable:
+                    pass
+                elif pieces:
+                    pieces.append(code[tokens[keyword].start:stop])
+                elif tokens[mark].value == 'else':
+                    pieces.append('do' + code[tokens[mark].end:stop])
+                else:
+                    pieces.append('if' + code[tokens[keyword].end:stop])
+                keyword = case.node.end
+            text = ''.join(pieces) + 'end' if pieces else ''
+            edits.append((tokens[stmt].start, tokens[self.blocks.closer[stmt]].end, text, dropped))
+        return edits
+
+    def goto_edit(self, scope: int) -> Optional[Tuple[int, int, str, int, int]]:
+        """Lay out the segments of a scope in fall-through order.
+
+        Returns (start offset, end offset, text, gotos removed, blocks dropped)
+        or None when the scope is already laid out or cannot be moved safely.
+        """
+        tokens = self.tokens
+        segments = self.segments[scope]
+        by_id = {node.id: node for node in segments}
+        terminators = {node.id: self.terminator(node) for node in segments}
+        entry = segments[0]
+
+        # Lay out chains by following unconditional edges
+        order: List[BasicBlock] = []
+        placed: Set[int] = set()
+        for head in segments:
+            if head.id in placed or not head.reachable:
+                continue
+            if order and terminators[order[-1].id][0] == 'fall' and self.flow[order[-1].id] is None:
+                return None     # the previous chain falls off the end of the scope
+            node = head
+            while node is not None and node.id not in placed:
+                order.append(node)
+                placed.add(node.id)
+                node = by_id.get(self.flow[node.id])
+
+        # Decide which jumps stay and which labels are still referenced
+        references: Set[int] = set()
+        elided = 0
+        jumps: Dict[int, Optional[str]] = {}
+        for k, node in enumerate(order):
+            kind, goto_tok = terminators[node.id]
+            target = self.flow[node.id]
+            following = order[k + 1].id if k + 1 < len(order) else None
+            if kind == 'goto' and target == following:
+                jumps[node.id] = None
+                elided += 1
+            elif kind == 'goto':
+                jumps[node.id] = self.text(goto_tok, goto_tok + 2)
+                if target in by_id:
+                    references.add(target)
+            elif kind == 'fall' and target is not None and target != following:
+                jumps[node.id] = f"goto {by_id[target].label}"
+                references.add(target)
+            else:
+                jumps[node.id] = None
+
+        for goto_tok, target in self.goto_targets.get(scope, ()):
+            source = self.segment_at(scope, goto_tok)
+            if source is None or not source.reachable or terminators[source.id] == ('goto', goto_tok):
+                continue
+            references.add(target)
+
+        dropped = len(segments) - len(order)
+        reordered = [node.id for node in order] != [node.id for node in segments if node.reachable]
+        if not reordered and not dropped and not elided:
+            return None
+        if reordered:
+            declaring = [node for node in segments
+                         if any(tokens[i].value == 'local' for i in self._top_level(node.start, node.end))]
+            if declaring and references:
+                return None     # a live goto could jump into the scope of a local
+            # Moving a segment across a declaration rebinds the names it uses
+            position = {node.id: n for n, node in enumerate(segments)}
+            laid_out = {node.id: n for n, node in enumerate(order)}
+            for node in declaring:
+                if node.id in laid_out and any(
+                        (laid_out[other.id] < laid_out[node.id]) != (position[other.id] < position[node.id])
+                        for other in order):
+                    return None
+
+        pieces = []
+        for node in order:
+            kind, goto_tok = terminators[node.id]
+            if node is not entry:
+                if node.id in references:
+                    pieces.append(f"::{node.label}::")
+                skip = ((goto_tok, node.end),) if kind == 'goto' else ()
+                body = self.text(node.start, node.end, skip)
+                if body:
+                    pieces.append(body)
+            if jumps[node.id]:
+                pieces.append(jumps[node.id])
+
+        # The entry keeps its text in place; only its trailing goto is rewritten
+        kind, goto_tok = terminators[entry.id]
+        first = goto_tok if kind == 'goto' else segments[1].start - 1
+        end = tokens[segments[-1].end - 1].end
+        return tokens[first].start, end, ('\n' + self.indent_of(first)).join(pieces), elided, dropped
+
+
+def _paths(path: DispatchPath) -> Iterator[Tuple[DispatchPath, Optional[DispatchCase]]]:
+    """Every path of a fork tree with the arm run just before it"""
+    work: List[Tuple[DispatchPath, Optional[DispatchCase]]] = [(path, None)]
+    while work:
+        current, previous = work.pop()
+        yield current, previous
+        last = current.trace[-1] if current.trace else previous
+        work.extend((branch, last) for branch in current.branches)
+
+
+def _loops_back(path: DispatchPath, target: DispatchPath) -> bool:
+    """Does path, or a path it forks into, loop back into target?"""
+    return any(current.back is target for current, _ in _paths(path))
+
+
+def _nests(path: DispatchPath, loop: Optional[DispatchPath]) -> bool:
+    """Can path be laid out inside the while loop of loop (None outside any)?
+
+    A loop back has to end the body of the innermost loop, and leaving the
+    dispatcher from inside a loop would need a break past the code after it.
+    Loop heads with a fork leave the loop through its one branch that never
+    comes back, which has to be the if or the else of a two-way fork.
+    """
+    if path.back is not None:
+        return path.back is path or path.back is loop
+    if not path.branches:
+        return loop is None or path.terminal == 'return'
+    if path.loop < 0:
+        return all(_nests(branch, loop) for branch in path.branches)
+    exits = [n for n, branch in enumerate(path.branches) if not _loops_back(branch, path)]
+    if not exits:
+        return all(_nests(branch, path) for branch in path.branches)
+    if len(exits) > 1 or len(path.branches) != 2:
+        return False
+    path.exit = exits[0]
+    return _nests(path.branches[1 - path.exit], path) and _nests(path.branches[path.exit], loop)
+
+
+def _indent_step(indent: str) -> str:
+    return '\t' if indent.startswith('\t') else '  '
+
+
+def _wrap(head: str, body: str, tail: str, indent: str) -> str:
+    """Wrap body in a block, indenting its first line one level deeper"""
+    return f"{head}\n{indent}{_indent_step(indent)}{body}\n{indent}{tail}"
+
+
+def build_cfg(code: str) -> ControlFlowGraph:
+    """Build the control flow graph of a Lua script"""
+    tokens = tokenize(code)
+    return ControlFlowGraph(code, tokens, match_blocks(tokens)).build()
+
+
+def deflatten(code: str) -> Tuple[str, Dict[str, int]]:
+    """Rewrite flattened dispatchers and goto chains into structured code"""
+    stats = {
+        'passes': 0,
+        'dispatchers_removed': 0,
+        'gotos_removed': 0,
+        'unreachable_blocks_removed': 0,
+    }
+
+    for _ in range(MAX_PASSES):
+        cfg = build_cfg(code)
+
+        # (start, end, text, dispatchers, gotos, unreachable)
+        edits = []
+        for dispatcher in cfg.dispatchers:
+            if dispatcher.path is None:
+                edits.extend((start, end, text, 0, 0, dropped)
+                             for start, end, text, dropped in cfg.arm_edits(dispatcher))
+                continue
+            start, end, text = cfg.dispatcher_edit(dispatcher)
+            dropped = sum(1 for case in dispatcher.cases if not case.node.reachable)
+            edits.append((start, end, text, 1, 0, dropped))
+        for scope in cfg.segments:
+            edit = cfg.goto_edit(scope)
+            if edit is not None:
+                start, end, text, elided, dropped = edit
+                edits.append((start, end, text, 0, elided, dropped))
+        if not edits:
+            break
+
+        # Apply non-overlapping edits, outermost first; nested ones wait a pass
+        pieces = []
+        pos = 0
+        for start, end, text, dispatchers, gotos, dropped in sorted(edits, key=lambda e: (e[0], -e[1])):
+            if start < pos:
+                continue
+            pieces.append(code[pos:start])
+            pieces.append(text)
+            pos = end
+            stats['dispatchers_removed'] += dispatchers
+            stats['gotos_removed'] += gotos
+            stats['unreachable_blocks_removed'] += dropped
+        pieces.append(code[pos:])
+        code = ''.join(pieces)
+        stats['passes'] += 1
+
+    return code, stats
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Lua Tools - Single entry point for the deobfuscation tools
+Run as `python -m lua_cli <command> ...` or from a zipapp built with
+`python -m lua_cli build`. Commands:
+- deobfuscate, hercules, triage, format, bytecode, devirtualize, fingerprint,
+  dedup, dce (each takes the arguments of the matching standalone script)
+- build: package the tools into a self-contained .pyz
+- check-startup: fail when import time exceeds the start-up budget
+Tool modules are only imported once their command is chosen.
+"""
+
+import argparse
+import importlib
+import os
+import sys
+from typing import List, Optional, Tuple
+
+COMMANDS = {
+    'deobfuscate': ('lua_deobfuscator', 'General-purpose Lua deobfuscator'),
+    'hercules': ('hercules_deobfuscator', 'Hercules obfuscator reversal'),
+    'triage': ('lua_triage', 'Score samples before full deobfuscation'),
+    'format': ('lua_format', 'Re-flow minified Lua into indented statements'),
+    'bytecode': ('lua_bytecode', 'Disassemble precompiled Lua/Luau chunks'),
+    'devirtualize': ('lua_devirtualizer', 'Lift VM dispatch loops back to Lua'),
+    'fingerprint': ('lua_fingerprint', 'Learn or recall per-build decoder parameters'),
+    'dedup': ('lua_dedup', 'Hoist repeated function bodies and blocks'),
+    'dce': ('lua_dce', 'Remove unused locals and dead branches'),
+}
+
+STARTUP_BUDGET = 0.060   # seconds to import the CLI and both tools, cold
+STARTUP_RUNS = 5
+# Modules that must not be loaded until a stage actually needs them
+DEFERRED_MODULES = ('numpy', 'lua_bytecode', 'lua_cfg', 'lua_dce', 'lua_dedup', 'lua_devirtualizer',
+                    'lua_fingerprint', 'lua_format', 'lua_lexer', 'lua_triage')
+
+_PROBE = '''import sys, time
+start = time.perf_counter()
+import lua_cli, lua_deobfuscator, hercules_deobfuscator
+elapsed = time.perf_counter() - start
+print(elapsed, *sorted(set(sys.modules) & set(sys.argv[1:])))
+'''
+_ZIP_MAIN = 'import sys\nfrom lua_cli import main\nsys.exit(main())\n'
+
+
+def _source_dir() -> str:
+    return os.path.dirname(os.path.abspath(__file__))
+
+
+def _modules() -> List[str]:
+    """Tool modules shipped alongside this one"""
+    return sorted(name for name in os.listdir(_source_dir())
+                  if name.endswith('.py') and name != '__main__.py')
+
+
+def measure_startup(runs: int = STARTUP_RUNS) -> Tuple[float, List[str]]:
+    """Best-of-N import time in a fresh interpreter, and deferred modules it loaded"""
+    import subprocess
+    env = dict(os.environ, PYTHONPATH=_source_dir())
+    best = float('inf')
+    loaded: List[str] = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', _PROBE, *DEFERRED_MODULES],
+                                env=env, capture_output=True, text=True, check=True).stdout.split()
+        best = min(best, float(output[0]))
+        loaded = output[1:]
+    return best, loaded
+
+
+def check_startup(budget: float = STARTUP_BUDGET) -> int:
+    """Start-up regression check; non-zero exit when over budget"""
+    elapsed, loaded = measure_startup()
+    print(f"Start-up import time: {elapsed * 1000:.1f} ms (budget {budget * 1000:.0f} ms)")
+    status = 0
+    if loaded:
+        print(f"Eagerly imported: {', '.join(loaded)}")
+        status = 1
+    if elapsed > budget:
+        print("Start-up budget exceeded")
+        status = 1
+    return status
+
+
+def build_zipapp(target: str) -> int:
+    """Package every tool module, precompiled, into an executable zipapp"""
+    import py_compile
+    import tempfile
+    import zipfile
+    with tempfile.TemporaryDirectory() as tmp, open(target, 'wb') as f:
+        f.write(b'#!/usr/bin/env python3\n')
+        with zipfile.ZipFile(f, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+            for name in _modules():
+                source = os.path.join(_source_dir(), name)
+                compiled = os.path.join(tmp, name + 'c')
+                # Unchecked hash-based pycs load straight from the archive
+                py_compile.compile(source, cfile=compiled, doraise=True,
+                                   invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH)
+                archive.write(source, name)
+                archive.write(compiled, name + 'c')
+            archive.writestr('__main__.py', _ZIP_MAIN)
+    os.chmod(target, 0o755)
+    print(f"Wrote {target}")
+    return 0
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(prog='lua_cli', description='Lua Tools - Deobfuscation toolkit')
+    commands = parser.add_subparsers(dest='command', metavar='command')
+    commands.required = True
+    for name, (_, description) in COMMANDS.items():
+        commands.add_parser(name, help=description, add_help=False)
+    build = commands.add_parser('build', help='Package the tools into a zipapp')
+    build.add_argument('-o', '--output', default='lua-tools.pyz', help='Output archive (default: lua-tools.pyz)')
+    startup = commands.add_parser('check-startup', help='Check import time against the start-up budget')
+    startup.add_argument('-b', '--budget', type=float, default=STARTUP_BUDGET,
+                         help=f'Budget in seconds (default: {STARTUP_BUDGET})')
+    args, rest = parser.parse_known_args(argv)
+
+    if args.command in COMMANDS:
+        module = importlib.import_module(COMMANDS[args.command][0])
+        return module.main(rest)
+    if rest:
+        parser.error(f"unrecognized arguments: {' '.join(rest)}")
+    if args.command == 'build':
+        return build_zipapp(args.output)
+    return check_startup(args.budget)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,701 @@
+#!/usr/bin/env python3
+"""
+Lua Dead Code - Def-use based junk and dead-code elimination
+One pass over the token stream resolves every name to the local that
+declares it, giving def-use chains for each local. From those:
+- Locals that are never written after their initializer fold into
+  conditions, so opaque predicates (`if x * 2 == 7 then`) are decided
+- if/elseif arms with a constant-false condition are dropped with their
+  whole body, constant-true arms are kept and the rest of the chain goes;
+  `while <false> do` and empty numeric `for` loops are removed
+- Unused locals with a side-effect-free initializer are removed, and
+  the uses inside their initializers are released in turn, so chains of
+  junk locals disappear through a worklist rather than repeated passes;
+  `do ... end` blocks emptied this way go as well
+Every token is visited a bounded number of times.
+"""
+
+import argparse
+import bisect
+import heapq
+import sys
+from collections import defaultdict
+from itertools import accumulate
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+from lua_cfg import ExpressionParser, NotConstant, OPAQUE, _truthy, evaluate
+from lua_lexer import BlockMap, match_blocks, tokenize
+
+_ASSIGNMENTS = frozenset({'=', '+=', '-=', '*=', '/=', '//=', '%=', '^=', '..='})
+_WRITE_SCAN = 256        # tokens scanned for the '=' of a multiple assignment
+_NOT_CONSTANT = object()
+
+Part = Union[str, Tuple[int, int]]   # literal text or a source range rendered with its edits
+
+
+class _LocalStatement:
+    """A `local` statement: the locals it declares and the initializers"""
+
+    __slots__ = ('start', 'end', 'decls', 'exprs', 'removable', 'live')
+
+    def __init__(self, start: int, end: int, decls: List[int], exprs: List[Tuple[int, tuple, int]],
+                 removable: bool):
+        self.start = start          # 'local' token
+        self.end = end              # token after the statement (past a trailing ';')
+        self.decls = decls
+        self.exprs = exprs          # (first token, AST, token after) per initializer
+        self.removable = removable  # no <close> attribute and the statement parsed
+        self.live = 0               # uses of its locals that are not dead
+
+
+class _Eliminator:
+    def __init__(self, code: str):
+        self.code = code
+        self.tokens = tokenize(code)
+        self.blocks: BlockMap = match_blocks(self.tokens)
+        self.parser = ExpressionParser(self.tokens, self.blocks)
+        self.start_block = {start: b for b, start in enumerate(self.blocks.start) if b}
+        count = len(self.tokens)
+        self.skip = bytearray(count + 1)      # declaration names, attributes, fields
+        self.dead = bytearray(count + 1)      # tokens removed by an edit
+        self.resolved = [-1] * count          # token -> local it refers to
+        # Per local
+        self.names: List[str] = []
+        self.scope: List[int] = []
+        self.statement: List[int] = []
+        self.pinned: List[bool] = []
+        self.uses: List[List[int]] = []
+        self.statements: List[_LocalStatement] = []
+        self.constants: Dict[int, Any] = {}
+        self.edits: List[Tuple[int, int, List[Part]]] = []
+        self.stats = {
+            'unused_locals_removed': 0,
+            'constant_branches_removed': 0,
+            'opaque_predicates_folded': 0,
+            'dead_loops_removed': 0,
+            'original_size': len(code),
+            'reduced_size': len(code),
+        }
+
+    # ------------------------------------------------------------------ def-use
+
+    def _declare(self, name: str, scope: int, statement: int = -1) -> int:
+        self.names.append(name)
+        self.scope.append(scope)
+        self.statement.append(statement)
+        self.pinned.append(False)
+        self.uses.append([])
+        return len(self.names) - 1
+
+    def _local_statement(self, i: int, activate) -> None:
+        tokens = self.tokens
+        skip = self.skip
+        count = len(tokens)
+        scope = self.blocks.block_of[i]
+        closer = self.blocks.closer
+
+        if i + 2 < count and tokens[i + 1].value == 'function':
+            skip[i + 2] = 1
+            end = closer.get(i + 1, -1) + 1
+            n = len(self.statements)
+            decl = self._declare(tokens[i + 2].value, scope, n if end else -1)
+            activate(i + 1, decl)
+            if end:
+                self.statements.append(_LocalStatement(i, end, [decl], [(i + 1, OPAQUE, end)], True))
+            return
+
+        names: List[int] = []
+        removable = True
+        j = i + 1
+        while j < count and tokens[j].kind == 'name':
+            names.append(j)
+            skip[j] = 1
+            j += 1
+            if j + 2 < count and tokens[j].value == '<' and tokens[j + 2].value == '>':
+                skip[j + 1] = 1
+                removable = removable and tokens[j + 1].value != 'close'
+                j += 3
+            if j < count and tokens[j].value == ',':
+                j += 1
+                continue
+            break
+
+        exprs: List[Tuple[int, tuple, int]] = []
+        end = j
+        try:
+            if j < count and tokens[j].value == '=' and tokens[j].kind == 'op':
+                end = j + 1
+                while True:
+                    node, after = self.parser.parse(end)
+                    exprs.append((end, node, after))
+                    end = after
+                    if end < count and tokens[end].value == ',':
+                        end += 1
+                        continue
+                    break
+        except (NotConstant, RecursionError, IndexError):
+            # The extent of the statement is unknown, so any same-named local
+            # of an enclosing scope may be referenced before these shadow it
+            visible = self.visible
+            for k in names:
+                if visible[tokens[k].value]:
+                    self.pinned[visible[tokens[k].value][-1]] = True
+            for k in names:
+                decl = self._declare(tokens[k].value, scope)
+                self.pinned[decl] = True
+                activate(j, decl)
+            return
+
+        stop = end + 1 if end < count and tokens[end].value == ';' else end
+        n = len(self.statements)
+        decls = [self._declare(tokens[k].value, scope, n) for k in names]
+        for decl in decls:
+            activate(end, decl)
+        self.statements.append(_LocalStatement(i, stop, decls, exprs, removable and bool(names)))
+
+    def _function(self, i: int, activate) -> None:
+        tokens = self.tokens
+        body = self.blocks.body.get(i)
+        scope = self.start_block.get(i)
+        if body is None or scope is None:
+            return
+        j = i + 1
+        while j < body and tokens[j].value != '(':
+            if tokens[j].value == ':':
+                activate(body, self._declare('self', scope))
+            j += 1
+        for k in range(j + 1, body):
+            if tokens[k].kind == 'name':
+                self.skip[k] = 1
+                activate(body, self._declare(tokens[k].value, scope))
+
+    def _for(self, i: int, activate) -> None:
+        tokens = self.tokens
+        body = self.blocks.body.get(i)
+        scope = self.start_block.get(body) if body is not None else None
+        j = i + 1
+        while j < len(tokens) and tokens[j].value not in ('=', 'in'):
+            if tokens[j].kind == 'name':
+                self.skip[j] = 1
+                if scope is not None:
+                    activate(body + 1, self._declare(tokens[j].value, scope))
+            j += 1
+
+    def resolve(self) -> None:
+        """Resolve every name token to its declaring local in one pass"""
+        tokens = self.tokens
+        blocks = self.blocks
+        block_of = blocks.block_of
+        parent = blocks.parent
+        closer = blocks.closer
+        skip = self.skip
+        resolved = self.resolved
+        uses = self.uses
+
+        self.visible = visible = defaultdict(list)    # name -> locals in scope, innermost last
+        scopes: List[Tuple[int, List[str]]] = [(0, [])]
+        open_blocks = {0}
+        pending: List[Tuple[int, int]] = []          # heap of (activation token, local)
+        brackets: List[str] = []
+
+        def activate(at: int, decl: int) -> None:
+            heapq.heappush(pending, (at, decl))
+
+        for i, tok in enumerate(tokens):
+            # Leave finished blocks, enter new ones
+            b = block_of[i]
+            if b != scopes[-1][0]:
+                chain = []
+                while b not in open_blocks:
+                    chain.append(b)
+                    b = parent[b]
+                while scopes[-1][0] != b:
+                    block, declared = scopes.pop()
+                    open_blocks.discard(block)
+                    for name in declared:
+                        visible[name].pop()
+                for b in reversed(chain):
+                    scopes.append((b, []))
+                    open_blocks.add(b)
+
+            while pending and pending[0][0] <= i:
+                decl = heapq.heappop(pending)[1]
+                scope = self.scope[decl]
+                if scope == scopes[-1][0]:
+                    visible[self.names[decl]].append(decl)
+                    scopes[-1][1].append(self.names[decl])
+                elif scope in open_blocks:
+                    self.pinned[decl] = True       # unexpected nesting: keep it
+                # otherwise its scope already ended and it can have no uses
+
+            kind = tok.kind
+            if kind == 'name':
+                if skip[i]:
+                    continue
+                prev = tokens[i - 1] if i else None
+                if prev is not None and (prev.kind == 'op' and prev.value in ('.', ':') or prev.value == 'goto'):
+                    continue
+                if (brackets and brackets[-1] == '{' and prev is not None and prev.value in ('{', ',', ';')
+                        and i + 1 < len(tokens) and tokens[i + 1].value == '='):
+                    continue               # table constructor key
+                declared = visible.get(tok.value)
+                if declared:
+                    resolved[i] = declared[-1]
+                    uses[declared[-1]].append(i)
+            elif kind == 'op':
+                if tok.value in ('(', '[', '{'):
+                    brackets.append(tok.value)
+                elif tok.value in (')', ']', '}') and brackets:
+                    brackets.pop()
+            elif kind == 'keyword':
+                value = tok.value
+                if value == 'local':
+                    self._local_statement(i, activate)
+                elif value == 'function':
+                    if i in closer:
+                        brackets.append('function')
+                    self._function(i, activate)
+                elif value == 'for':
+                    self._for(i, activate)
+                elif value == 'end' and brackets and brackets[-1] == 'function':
+                    opener = blocks.opener.get(i)
+                    if opener is not None and tokens[opener].value == 'function':
+                        brackets.pop()
+
+        # Locals of a repeat body stay visible in its until-condition,
+        # which the block map places outside the body
+        for statement in self.statements:
+            owner = blocks.owner[block_of[statement.start]]
+            if owner >= 0 and tokens[owner].value == 'repeat':
+                for decl in statement.decls:
+                    self.pinned[decl] = True
+
+    def _written(self, use: int) -> bool:
+        """Is the name at token use an assignment target?"""
+        tokens = self.tokens
+        count = len(tokens)
+        if use + 1 >= count:
+            return False
+        if use and tokens[use - 1].kind == 'keyword' and tokens[use - 1].value == 'function':
+            return True     # function name() ... end, and by extension name.field / name:method
+        after = tokens[use + 1]
+        if after.kind == 'op' and after.value in _ASSIGNMENTS:
+            return True
+        if after.value != ',':
+            return False
+        depth = 0
+        for k in range(use + 1, min(count, use + _WRITE_SCAN)):
+            tok = tokens[k]
+            if tok.value in ('(', '[', '{'):
+                depth += 1
+            elif tok.value in (')', ']', '}'):
+                depth -= 1
+                if depth < 0:
+                    return False
+            elif depth == 0:
+                if tok.value == '=' and tok.kind == 'op':
+                    return True
+                if tok.kind != 'name' and tok.value not in (',', '.'):
+                    return False
+        return False
+
+    def _env(self, start: int, end: int) -> Dict[str, Any]:
+        """Known values of the locals referenced in tokens [start, end)"""
+        env = {}
+        resolved = self.resolved
+        constants = self.constants
+        for k in range(start, end):
+            decl = resolved[k]
+            if decl >= 0 and decl in constants:
+                env[self.names[decl]] = constants[decl]
+        return env
+
+    def _value(self, start: int, node: tuple, end: int) -> Any:
+        """Constant value of an expression, or _NOT_CONSTANT"""
+        if node is OPAQUE:
+            return _NOT_CONSTANT
+        if any(tok.kind == 'string' for tok in self.tokens[start:end]):
+            return _NOT_CONSTANT     # raw literals do not compare by content
+        try:
+            return evaluate(node, self._env(start, end))
+        except (NotConstant, RecursionError):
+            return _NOT_CONSTANT
+
+    def propagate(self) -> None:
+        """Record the value of every local that is only ever set by its initializer"""
+        written = [any(self._written(use) for use in uses) for uses in self.uses]
+        for statement in self.statements:
+            for n, decl in enumerate(statement.decls):
+                if written[decl] or self.pinned[decl]:
+                    continue
+                if n < len(statement.exprs):
+                    value = self._value(*statement.exprs[n])
+                elif not statement.exprs or statement.exprs[-1][1] is not OPAQUE:
+                    value = None
+                else:
+                    continue
+                if value is not _NOT_CONSTANT:
+                    self.constants[decl] = value
+
+    # ------------------------------------------------------------------ folding
+
+    def _span(self, start: int, end: int, whole_lines: bool) -> Tuple[int, int]:
+        """Source range of tokens [start, end), widened to whole lines when they hold nothing else"""
+        code = self.code
+        begin, finish = self.tokens[start].start, self.tokens[end - 1].end
+        if whole_lines:
+            line_start = code.rfind('\n', 0, begin) + 1
+            line_end = code.find('\n', finish)
+            if line_end < 0:
+                line_end = len(code) - 1
+            if not code[line_start:begin].strip() and not code[finish:line_end].strip():
+                return line_start, line_end + 1
+        return begin, finish
+
+    def _kill(self, start: int, end: int) -> None:
+        self.dead[start:end] = b'\1' * (end - start)
+
+    def _condition(self, start: int, end: int) -> Any:
+        """Constant value of the condition in tokens [start, end), or _NOT_CONSTANT"""
+        tokens = self.tokens
+        if end - start == 1 and tokens[start].kind == 'string':
+            return tokens[start].value
+        try:
+            node, after = self.parser.parse(start)
+        except (NotConstant, RecursionError, IndexError):
+            return _NOT_CONSTANT
+        if after != end:
+            return _NOT_CONSTANT
+        return self._value(start, node, end)
+
+    def _is_literal(self, start: int, end: int) -> bool:
+        return end - start == 1 and self.tokens[start].value in ('true', 'false', 'nil')
+
+    def _statement_end(self, close: int) -> int:
+        tokens = self.tokens
+        return close + 2 if close + 1 < len(tokens) and tokens[close + 1].value == ';' else close + 1
+
+    def _fold_if(self, i: int) -> None:
+        tokens = self.tokens
+        blocks = self.blocks
+        close = blocks.closer[i]
+        marks = blocks.branches[i]
+        # (keyword, then, body start, body end): 'then' is None for else
+        arms = []
+        keyword = i
+        for n, mark in enumerate(marks):
+            if tokens[mark].value == 'then':
+                nxt = marks[n + 1] if n + 1 < len(marks) else close
+                arms.append((keyword, mark, mark + 1, nxt))
+            elif tokens[mark].value == 'elseif':
+                keyword = mark
+            else:
+                arms.append((mark, None, mark + 1, close))
+
+        kept = []        # (arm, conditional)
+        folded = opaque = dropped = 0
+        for arm in arms:
+            keyword, then = arm[0], arm[1]
+            if then is None:
+                kept.append((arm, False))
+                break
+            value = self._condition(keyword + 1, then)
+            if value is _NOT_CONSTANT:
+                kept.append((arm, True))
+                continue
+            folded += 1
+            opaque += not self._is_literal(keyword + 1, then)
+            if _truthy(value):
+                kept.append((arm, False))
+                break
+            dropped += 1
+        if not folded:
+            return
+        dropped += len(arms) - len(kept) - dropped
+
+        stop = self._statement_end(close)
+        if not kept:
+            parts: List[Part] = []
+            span = self._span(i, stop, True)
+        elif not kept[0][1]:
+            (keyword, then, body, end), _ = kept[0]
+            inner = (tokens[body - 1].end, tokens[end].start)
+            if self._inlinable(then if then is not None else keyword, body, end):
+                parts = [inner]
+            else:
+                parts = ['do ', inner, ' end']
+            span = self._span(i, close + 1, False)
+        else:
+            parts = []
+            for n, ((keyword, then, body, end), conditional) in enumerate(kept):
+                if conditional:
+                    parts += ['if ' if n == 0 else ' elseif ', (tokens[keyword].end, tokens[then].start), ' then ']
+                else:
+                    parts.append(' else ')
+                parts.append((tokens[body - 1].end, tokens[end].start))
+            parts.append(' end')
+            span = self._span(i, close + 1, False)
+
+        # Everything outside the surviving conditions and bodies is dead
+        alive = []
+        for (keyword, then, body, end), conditional in kept:
+            if conditional:
+                alive.append((keyword + 1, then))
+            alive.append((body, end))
+        pos = i
+        for start, end in alive:
+            self._kill(pos, start)
+            pos = end
+        self._kill(pos, stop if not kept else close + 1)
+
+        self.edits.append((span[0], span[1], parts))
+        self.stats['constant_branches_removed'] += dropped
+        self.stats['opaque_predicates_folded'] += opaque
+
+    def _inlinable(self, opener: int, start: int, end: int) -> bool:
+        """Can a block body replace its statement without a do ... end scope?"""
+        scope = self.start_block.get(opener)
+        tokens = self.tokens
+        block_of = self.blocks.block_of
+        for k in range(start, end):
+            if block_of[k] == scope and (tokens[k].kind == 'label' or (
+                    tokens[k].kind == 'keyword' and tokens[k].value in ('local', 'return', 'break', 'goto'))):
+                return False
+        return True
+
+    def _fold_loop(self, i: int) -> None:
+        tokens = self.tokens
+        body = self.blocks.body.get(i)
+        if body is None:
+            return
+        if tokens[i].value == 'while':
+            value = self._condition(i + 1, body)
+            if value is _NOT_CONSTANT or _truthy(value):
+                return
+            opaque = not self._is_literal(i + 1, body)
+        else:
+            if i + 3 >= body or tokens[i + 1].kind != 'name' or tokens[i + 2].value != '=':
+                return
+            bounds = []
+            pos = i + 3
+            try:
+                while pos < body:
+                    node, after = self.parser.parse(pos)
+                    bounds.append(self._value(pos, node, after))
+                    pos = after + 1 if tokens[after].value == ',' else after
+            except (NotConstant, RecursionError, IndexError):
+                return
+            if pos != body or len(bounds) not in (2, 3):
+                return
+            first, last, step = (bounds + [1])[:3]
+            if not all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in (first, last, step)):
+                return
+            if not ((step > 0 and first > last) or (step < 0 and first < last)):
+                return
+            opaque = False
+        stop = self._statement_end(self.blocks.closer[i])
+        self._kill(i, stop)
+        self.edits.append((*self._span(i, stop, True), []))
+        self.stats['dead_loops_removed'] += 1
+        self.stats['opaque_predicates_folded'] += opaque
+
+    def fold(self) -> None:
+        """Decide constant conditions, outermost first"""
+        tokens = self.tokens
+        closer = self.blocks.closer
+        for i, tok in enumerate(tokens):
+            if tok.kind != 'keyword' or i not in closer or self.dead[i]:
+                continue
+            if tok.value == 'if':
+                self._fold_if(i)
+            elif tok.value in ('while', 'for'):
+                self._fold_loop(i)
+
+    # ------------------------------------------------------------------ unused locals
+
+    def _pure(self, start: int, node: tuple, end: int) -> bool:
+        """Can the initializer in tokens [start, end) be dropped without losing an effect?"""
+        tokens = self.tokens
+        first = tokens[start].value
+        if first == 'function':
+            return self.blocks.closer.get(start) == end - 1
+        if first == '...':
+            return end == start + 1
+        if first == '{':
+            for k in range(start + 1, end):
+                tok = tokens[k]
+                prev = tokens[k - 1]
+                if tok.value in ('(', 'function') and tok.kind != 'string':
+                    return False
+                if (tok.kind == 'string' or tok.value == '{') and (
+                        prev.kind == 'name' or prev.value in (')', ']')):
+                    return False     # call sugar: f"..." / f{...}
+            return True
+        if node is OPAQUE:
+            return False
+        if node[0] in ('const', 'string', 'name'):
+            return True
+        return self._value(start, node, end) is not _NOT_CONSTANT
+
+    def sweep(self) -> None:
+        """Remove unused locals, releasing the uses in their initializers"""
+        dead = self.dead
+        statements = self.statements
+        statement_of = self.statement
+        resolved = self.resolved
+
+        for n, statement in enumerate(statements):
+            for decl in statement.decls:
+                # Recursive references of a local function do not keep it alive
+                statement.live += sum(1 for use in self.uses[decl]
+                                      if not dead[use] and not statement.start <= use < statement.end)
+        candidates = [n for n, statement in enumerate(statements)
+                      if statement.live == 0 and self._removable(statement)]
+
+        while candidates:
+            n = candidates.pop()
+            statement = statements[n]
+            if dead[statement.start]:
+                continue
+            for k in range(statement.start, statement.end):
+                if dead[k]:
+                    continue
+                dead[k] = 1
+                decl = resolved[k]
+                owner = statement_of[decl] if decl >= 0 else -1
+                if owner >= 0 and owner != n:
+                    other = statements[owner]
+                    other.live -= 1
+                    if other.live == 0 and not dead[other.start] and self._removable(other):
+                        candidates.append(owner)
+            self.edits.append((*self._span(statement.start, statement.end, True), []))
+            self.stats['unused_locals_removed'] += len(statement.decls)
+
+    def prune(self) -> None:
+        """Remove `do ... end` blocks left with nothing alive inside, innermost first.
+
+        Live tokens come from prefix sums taken once; each block hands the
+        live tokens its removed descendants took with them up to its parent
+        as a single count, so every block is settled in constant time.
+        """
+        tokens = self.tokens
+        closer = self.blocks.closer
+        dead = self.dead
+        live = [0, *accumulate(1 - flag for flag in dead)]
+        # (first token, live tokens removed inside) per settled block, innermost on top
+        settled: List[Tuple[int, int]] = []
+        for i in range(len(tokens) - 1, -1, -1):
+            if tokens[i].value != 'do' or tokens[i].kind != 'keyword' or dead[i] or i not in closer:
+                continue
+            close = closer[i]
+            removed = 0
+            while settled and settled[-1][0] < close:
+                removed += settled.pop()[1]
+            if live[close] - live[i + 1] > removed:
+                settled.append((i, removed))
+                continue
+            stop = self._statement_end(close)
+            self._kill(i, stop)
+            self.edits.append((*self._span(i, stop, True), []))
+            settled.append((i, live[stop] - live[i]))
+
+    def _removable(self, statement: _LocalStatement) -> bool:
+        return (statement.removable and not any(self.pinned[decl] for decl in statement.decls)
+                and all(self._pure(*expr) for expr in statement.exprs))
+
+    # ------------------------------------------------------------------ output
+
+    def render(self) -> str:
+        """Source with every edit applied; kept ranges may hold nested edits"""
+        code = self.code
+        edits = sorted(self.edits, key=lambda e: (e[0], -e[1]))
+        starts = [edit[0] for edit in edits]
+
+        def parts(lo: int, hi: int) -> Iterator[Part]:
+            n = bisect.bisect_left(starts, lo)
+            pos = lo
+            while n < len(edits) and starts[n] < hi:
+                start, end, replacement = edits[n]
+                yield code[pos:start]
+                yield from replacement
+                pos = end
+                n = bisect.bisect_left(starts, end, n + 1)
+            yield code[pos:hi]
+
+        out: List[str] = []
+        stack = [parts(0, len(code))]
+        while stack:
+            part = next(stack[-1], None)
+            if part is None:
+                stack.pop()
+            elif isinstance(part, str):
+                out.append(part)
+            else:
+                stack.append(parts(*part))
+        return ''.join(out)
+
+    def balanced(self) -> bool:
+        """Does every block close? Scopes cannot be trusted otherwise"""
+        blocks = self.blocks
+        count = len(self.tokens)
+        if any(stop >= count for stop in blocks.stop[1:]):
+            return False
+        return all(i in blocks.opener for i, tok in enumerate(self.tokens)
+                   if tok.kind == 'keyword' and tok.value in ('end', 'until'))
+
+    def run(self) -> Tuple[str, Dict[str, Any]]:
+        if not self.balanced():
+            return self.code, self.stats
+        # Step 1: def-use chains and known values of never-written locals
+        self.resolve()
+        self.propagate()
+        # Step 2: constant conditions, opaque predicates and empty loops
+        self.fold()
+        # Step 3: unused locals, cascading through their initializers
+        self.sweep()
+        self.prune()
+        if not self.edits:
+            return self.code, self.stats
+        output = self.render()
+        self.stats['reduced_size'] = len(output)
+        return output, self.stats
+
+
+def eliminate_dead_code(code: str) -> Tuple[str, Dict[str, Any]]:
+    """Remove unused locals, constant branches and opaque predicates"""
+    return _Eliminator(code).run()
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description='Lua Dead Code - Remove junk locals and dead branches')
+    parser.add_argument('input_file', help='Lua file to clean')
+    parser.add_argument('-o', '--output', help='Output file (default: stdout)')
+    args = parser.parse_args(argv)
+
+    try:
+        with open(args.input_file, 'r', encoding='utf-8', errors='ignore') as f:
+            code = f.read()
+    except OSError as e:
+        print(f"Error loading file: {e}")
+        return 1
+
+    output, stats = eliminate_dead_code(code)
+    summary = (f"{stats['unused_locals_removed']} unused locals, {stats['constant_branches_removed']} "
+               f"constant branches, {stats['dead_loops_removed']} dead loops, "
+               f"{stats['opaque_predicates_folded']} opaque predicates removed "
+               f"({stats['original_size']} -> {stats['reduced_size']} bytes)")
+    if not args.output:
+        print(output, end='')
+        print(f"-- {summary}")
+        return 0
+    try:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    except OSError as e:
+        print(f"Error saving file: {e}")
+        return 1
+    print(summary)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+"""
+Lua Dedup - Hash-consing of repeated function bodies and blocks
+Obfuscators inline the same helper functions and junk blocks hundreds of
+times. Every function expression, function statement and `do ... end`
+block is hashed after alpha-renaming the names it binds, so copies that
+differ only in local names share a hash. Bodies seen more than once are
+hoisted into a single shared table and each copy becomes a reference:
+- function bodies:  `__shared.f1`  (or `NAME = __shared.f1` for statements)
+- do-blocks:        `__shared.b2()`
+A body is only hoisted when that cannot change what its names refer to:
+names are resolved scope by scope, and it may use globals and its own
+locals, but no local of an enclosing scope, no `self`, no globals while
+a local `_ENV` is in scope, and (for blocks) no `...`, return, break or goto.
+Hoisting makes every copy the same closure, so `f1 == f2` turns true and
+copies used as table keys collide. Functions are therefore only hoisted
+when bound to a plain name that is never read except to call it, or when
+passed straight to pcall / xpcall: any other read (a comparison, an
+argument, a constructor entry, an alias) can reach an identity check.
+Names are matched by spelling across scopes, which errs towards keeping
+a copy. Bodies are hashed innermost first and a nested body enters its
+parent's hash as its own digest, so every token is hashed once.
+"""
+
+import argparse
+import hashlib
+import sys
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from lua_dce import _Eliminator
+from lua_lexer import BlockMap, Token
+
+MIN_TOKENS = 16          # smaller bodies are cheaper to repeat than to reference
+SHARED_TABLE = '__shared'
+
+_BLOCK_EXITS = frozenset({'return', 'break', 'goto', '...'})
+_IDENTITY_OPS = frozenset({'==', '~='})
+_PROTECTED_CALLS = frozenset({'pcall', 'xpcall'})    # run their first argument without exposing it
+
+
+class _Candidate:
+    """One hashable body: a function (from its parameter list) or a do-block"""
+
+    __slots__ = ('kind', 'start', 'end', 'body', 'close', 'binding', 'hash', 'free', 'uses_self',
+                 'uses_globals', 'exits', 'digest')
+
+    def __init__(self, kind: str, start: int, end: int, body: int, close: int, binding: str):
+        self.kind = kind          # 'function' or 'block'
+        self.start = start        # first token replaced by the reference
+        self.end = end            # last token replaced
+        self.body = body          # first token of the hashed range ('(' or 'do')
+        self.close = close        # the closing 'end'
+        self.binding = binding    # statement prefix kept before the reference ('' / 'NAME = ')
+        self.hash = ''            # normalised hash, whether or not the body can be hoisted
+        self.free: List[int] = []     # locals of enclosing scopes it refers to, by first use
+        self.uses_self = False
+        self.uses_globals = False
+        self.exits = False        # return, break, goto, a label or `...` somewhere inside
+        self.digest: Optional[str] = None     # the hash, when the body can be hoisted
+
+
+def _escaping_names(tokens: List[Token], scopes: _Eliminator) -> Set[str]:
+    """Names read other than to call them or assign to them (needs resolved scopes)"""
+    names: Set[str] = set()
+    skip = scopes.skip
+    for i, tok in enumerate(tokens):
+        if tok.kind != 'name' or skip[i]:
+            continue
+        before = tokens[i - 1].value if i else ''
+        if before in ('.', ':', 'goto'):
+            continue
+        after = tokens[i + 1] if i + 1 < len(tokens) else None
+        if after is not None and (after.value in ('(', '{') or after.kind == 'string'):
+            continue
+        if not scopes._written(i):
+            names.add(tok.value)
+    return names
+
+
+class _Deduplicator:
+    def __init__(self, code: str):
+        self.code = code
+        # The dead-code pass's resolver tells which local each name refers to
+        self.scopes = _Eliminator(code)
+        self.tokens = self.scopes.tokens
+        self.blocks: BlockMap = self.scopes.blocks
+        self.escaping: Set[str] = set()
+        self.env_scopes: Set[int] = set()     # blocks declaring a local or parameter _ENV
+
+    def candidates(self) -> List[_Candidate]:
+        tokens = self.tokens
+        closer = self.blocks.closer
+        opener = self.blocks.opener
+        found = []
+        brackets: List[int] = []      # open brackets and function bodies, innermost last
+        for i, tok in enumerate(tokens):
+            if tok.kind == 'op':
+                if tok.value in ('(', '[', '{'):
+                    brackets.append(i)
+                elif tok.value in (')', ']', '}') and brackets and tokens[brackets[-1]].kind == 'op':
+                    brackets.pop()
+                continue
+            if tok.kind != 'keyword':
+                continue
+            if tok.value == 'end' and brackets and opener.get(i) == brackets[-1]:
+                brackets.pop()
+            if i not in closer:
+                continue
+            if tok.value == 'do':
+                found.append(_Candidate('block', i, closer[i], i, closer[i], ''))
+            elif tok.value == 'function':
+                candidate = self._function(i, closer[i], brackets[-1] if brackets else -1)
+                if candidate is not None:
+                    found.append(candidate)
+                brackets.append(i)
+        return found
+
+    def _function(self, i: int, close: int, enclosing: int) -> Optional[_Candidate]:
+        """Candidate for the function at token i; enclosing is the innermost open bracket or function"""
+        tokens = self.tokens
+        j = i + 1
+        while j < close and tokens[j].value != '(':
+            if tokens[j].value in ('.', ':'):
+                return None         # stored into a table field, or a method binding an implicit self
+            j += 1
+        if j == i + 1:
+            # An anonymous function: only plain `NAME = function` bindings and call arguments
+            before = tokens[i - 1].value if i else ''
+            after = tokens[close + 1].value if close + 1 < len(tokens) else ''
+            if after in _IDENTITY_OPS:
+                return None
+            in_brackets = enclosing >= 0 and tokens[enclosing].kind == 'op'
+            if before == '=':
+                target = tokens[i - 2] if i > 1 else None
+                if in_brackets or target is None or target.kind != 'name' or target.value in self.escaping or \
+                        i > 2 and tokens[i - 3].value in ('.', ':', ','):
+                    return None
+            elif not (before == '(' and enclosing == i - 1 and self._protected_call(i - 2)):
+                return None
+            return _Candidate('function', i, close, j, close, '')
+        if tokens[j - 1].value in self.escaping:
+            return None
+        target = self.code[tokens[i + 1].start:tokens[j - 1].end]
+        if i > 0 and tokens[i - 1].value == 'local':
+            return _Candidate('function', i - 1, close, j, close, f'local {target} = ')
+        return _Candidate('function', i, close, j, close, f'{target} = ')
+
+    def _protected_call(self, callee: int) -> bool:
+        """Is the token at callee the global pcall or xpcall?"""
+        tokens = self.tokens
+        return (callee > 0 and tokens[callee].value in _PROTECTED_CALLS and tokens[callee].kind == 'name'
+                and tokens[callee - 1].value not in ('.', ':') and self.scopes.resolved[callee] < 0
+                and not self._env_visible(callee))
+
+    def digests(self, candidates: List[_Candidate]) -> None:
+        """Hash every candidate, nested ones before the bodies around them"""
+        by_body = {candidate.body: candidate for candidate in candidates}
+        for candidate in sorted(candidates, key=lambda c: c.close):
+            self.digest(candidate, by_body)
+
+    def digest(self, candidate: _Candidate, by_body: Dict[int, _Candidate]) -> None:
+        """Alpha-normalised hash of a candidate, kept as its digest when it can be hoisted.
+
+        A nested candidate, already hashed, stands in for its tokens: its
+        hash, then this body's names for the enclosing locals it refers to.
+        """
+        tokens = self.tokens
+        scopes = self.scopes
+        block_start = self.blocks.start
+        start, end = candidate.body, candidate.close
+        # Locals whose scope opens at or after this keyword are bound inside the body
+        opened = start if candidate.kind == 'block' else candidate.start
+        if tokens[opened].value == 'local':
+            opened += 1
+        renames: Dict[str, str] = {}
+        free: Dict[int, int] = {}       # local of an enclosing scope -> position
+        uses_self = uses_globals = exits = False
+
+        def local(decl: int) -> str:
+            if block_start[scopes.scope[decl]] < opened:
+                return f'^{free.setdefault(decl, len(free))}'
+            return renames.setdefault(scopes.names[decl], f'${len(renames)}')
+
+        digest = hashlib.sha1(candidate.kind.encode())
+        k = start
+        while k <= end:
+            nested = by_body.get(k) if k != start else None
+            if nested is not None:
+                values = [nested.hash] + [local(decl) for decl in nested.free]
+                uses_self = uses_self or nested.uses_self
+                uses_globals = uses_globals or nested.uses_globals
+                exits = exits or nested.exits
+                for value in values:
+                    digest.update(value.encode())
+                    digest.update(b'\0')
+                k = nested.close + 1
+                continue
+            tok = tokens[k]
+            value = tok.value
+            if tok.kind == 'name' and tokens[k - 1].value not in ('.', ':', 'goto'):
+                decl = scopes.resolved[k]
+                uses_self = uses_self or value == 'self'
+                if decl < 0 and scopes.skip[k] and tokens[k - 1].value == '<':
+                    value = '<' + value      # a local's attribute
+                elif decl >= 0:
+                    value = local(decl)
+                elif scopes.skip[k]:
+                    value = renames.setdefault(value, f'${len(renames)}')
+                else:
+                    uses_globals = True
+                    value = '@' + value  # a global (or table key), kept as written
+            elif value in _BLOCK_EXITS or tok.kind == 'label':
+                exits = True
+            digest.update(value.encode('utf-8', errors='surrogateescape'))
+            digest.update(b'\0')
+            k += 1
+
+        candidate.hash = digest.hexdigest()
+        candidate.free = list(free)
+        candidate.uses_self, candidate.uses_globals, candidate.exits = uses_self, uses_globals, exits
+        if (end - start + 1 < MIN_TOKENS or free or uses_self or candidate.kind == 'block' and exits
+                or uses_globals and self._env_visible(candidate.start)):
+            return               # refers to a local of an enclosing scope, or may not move
+        candidate.digest = candidate.hash
+
+    def _env_visible(self, i: int) -> bool:
+        """Is a local or parameter named _ENV declared in a block enclosing token i?"""
+        parent = self.blocks.parent
+        block = self.blocks.block_of[i]
+        while block >= 0:
+            if block in self.env_scopes:
+                return True
+            block = parent[block]
+        return False
+
+    def definition(self, candidate: _Candidate) -> str:
+        tokens = self.tokens
+        code = self.code
+        if candidate.kind == 'block':
+            return f'function(){code[tokens[candidate.body].end:tokens[candidate.close].start]}end'
+        return 'function' + code[tokens[candidate.body].start:tokens[candidate.close].end]
+
+    def run(self) -> Tuple[str, Dict[str, Any]]:
+        tokens = self.tokens
+        if not self.scopes.balanced():
+            candidates: List[_Candidate] = []      # scopes cannot be trusted
+        else:
+            self.scopes.resolve()
+            self.env_scopes = {self.scopes.scope[decl] for decl, name in enumerate(self.scopes.names)
+                               if name == '_ENV'}
+            self.escaping = _escaping_names(tokens, self.scopes)
+            candidates = self.candidates()
+            self.digests(candidates)
+        counts: Dict[str, int] = defaultdict(int)
+        for candidate in candidates:
+            if candidate.digest is not None:
+                counts[candidate.digest] += 1
+
+        stats: Dict[str, Any] = {
+            'candidates': len(candidates),
+            'unique_bodies': len(counts),
+            'shared_definitions': 0,
+            'duplicates_replaced': 0,
+            'original_size': len(self.code),
+            'deduplicated_size': len(self.code),
+            'dedup_ratio': 1.0,
+        }
+
+        names = {tok.value for tok in tokens if tok.kind == 'name'}
+        table = SHARED_TABLE
+        while table in names:
+            table += '_'
+        shared: Dict[str, str] = {}      # digest -> reference
+        definitions: List[str] = []
+        pieces: List[str] = []
+        pos = 0
+        if self.code.startswith('#'):
+            pos = self.code.find('\n') + 1 or len(self.code)    # a shebang line stays first
+        while self.code.startswith('--!', pos):
+            pos = self.code.find('\n', pos) + 1 or len(self.code)   # so do Luau --!strict directives
+        shebang = self.code[:pos]
+        for candidate in candidates:     # source order, so outer bodies come first
+            if candidate.digest is None or counts[candidate.digest] < 2:
+                continue
+            begin = tokens[candidate.start].start
+            if begin < pos:
+                continue                 # inside a body that was already replaced
+            reference = shared.get(candidate.digest)
+            if reference is None:
+                reference = f"{table}.{'f' if candidate.kind == 'function' else 'b'}{len(shared) + 1}"
+                shared[candidate.digest] = reference
+                definitions.append(f'{reference} = {self.definition(candidate)}')
+            pieces.append(self.code[pos:begin])
+            pieces.append(candidate.binding + reference + ('()' if candidate.kind == 'block' else ''))
+            pos = tokens[candidate.end].end
+            stats['duplicates_replaced'] += 1
+
+        if not shared:
+            return self.code, stats
+        pieces.append(self.code[pos:])
+        header = f'local {table} = {{}}\n' + '\n'.join(definitions) + '\n'
+        output = shebang + header + ''.join(pieces)
+        stats['shared_definitions'] = len(shared)
+        stats['deduplicated_size'] = len(output)
+        stats['dedup_ratio'] = round(len(output) / max(1, len(self.code)), 4)
+        return output, stats
+
+
+def deduplicate(code: str) -> Tuple[str, Dict[str, Any]]:
+    """Hoist repeated function bodies and blocks into shared definitions"""
+    return _Deduplicator(code).run()
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description='Lua Dedup - Hoist repeated function bodies and blocks')
+    parser.add_argument('input_file', help='Lua file to deduplicate')
+    parser.add_argument('-o', '--output', help='Output file (default: stdout)')
+    args = parser.parse_args(argv)
+
+    try:
+        with open(args.input_file, 'r', encoding='utf-8', errors='ignore') as f:
+            code = f.read()
+    except OSError as e:
+        print(f"Error loading file: {e}")
+        return 1
+
+    output, stats = deduplicate(code)
+    if not args.output:
+        print(output, end='')
+        print(f"-- {stats['duplicates_replaced']} duplicates -> {stats['shared_definitions']} shared "
+              f"definitions, size ratio {stats['dedup_ratio']:.3f}")
+        return 0
+    try:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    except OSError as e:
+        print(f"Error saving file: {e}")
+        return 1
+    print(f"{stats['duplicates_replaced']} duplicates -> {stats['shared_definitions']} shared definitions, "
+          f"size ratio {stats['dedup_ratio']:.3f}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -8,65 +8,100 @@ Supports various obfuscation techniques including:
 - Bytecode encoding
 - Function inlining
 - Garbage code insertion
+- Control flow flattening (goto chains and state-machine dispatch loops)
 """
 
 import re
 import base64
-import string
-import ast
 import argparse
+import logging
 import sys
-from typing import Dict, List, Set, Tuple, Optional, Any
+from typing import TYPE_CHECKING, Dict, List, Set, Tuple, Optional, Any
 import json
 
+from lua_patterns import LUA_PATTERNS
+from lua_results import DeobfuscationResult, Source, Timings, decode_source
+
+# Heavier stages are imported on first use to keep CLI start-up cheap
+if TYPE_CHECKING:
+    from lua_lexer import Token
+    from lua_triage import TriageResult
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
 class LuaDeobfuscator:
     def __init__(self):
         self.original_code = ""
+        self.original_bytes = None
         self.deobfuscated_code = ""
+        self.bytecode_chunks = None
         self.patterns = self._load_patterns()
         self.string_mappings = {}
         self.variable_mappings = {}
         self.function_mappings = {}
+        self.deflatten_stats = {}
+        self.dedup_stats = {}
+        self.dead_code_stats = {}
+        self.triage_result: Optional[TriageResult] = None
+        self.timings = Timings()
         
     def _load_patterns(self) -> Dict[str, re.Pattern]:
-        """Load common obfuscation patterns"""
-        return {
-            # String encoding patterns
-            'string_concat': re.compile(r'string\.char\([^)]+\)', re.IGNORECASE),
-            'string_format': re.compile(r'string\.format\([^)]+\)', re.IGNORECASE),
-            'table_concat': re.compile(r'table\.concat\([^)]+\)', re.IGNORECASE),
-            
-            # Variable obfuscation patterns
-            'random_vars': re.compile(r'\b[a-zA-Z][a-zA-Z0-9_]{10,}\b'),
-            'hex_vars': re.compile(r'\b[a-fA-F0-9]{8,}\b'),
-            
-            # Function obfuscation patterns
-            'loadstring': re.compile(r'loadstring\([^)]+\)', re.IGNORECASE),
-            'load': re.compile(r'\bload\([^)]+\)', re.IGNORECASE),
-            
-            # Bytecode patterns
-            'bytecode_dump': re.compile(r'string\.dump\([^)]+\)', re.IGNORECASE),
-            
-            # Control flow patterns
-            'goto_labels': re.compile(r'::[a-zA-Z_][a-zA-Z0-9_]*::', re.IGNORECASE),
-            'goto_jumps': re.compile(r'goto\s+[a-zA-Z_][a-zA-Z0-9_]*', re.IGNORECASE),
-            
-            # Encoded strings
-            'base64_like': re.compile(r'[A-Za-z0-9+/]{20,}={0,2}'),
-            'hex_encoded': re.compile(r'\\x[0-9a-fA-F]{2}'),
-            'decimal_encoded': re.compile(r'\\[0-9]{1,3}'),
-        }
+        """Common obfuscation patterns (compiled once per process)"""
+        return LUA_PATTERNS
     
     def load_file(self, filename: str) -> bool:
         """Load obfuscated Lua file"""
         try:
-            with open(filename, 'r', encoding='utf-8', errors='ignore') as f:
-                self.original_code = f.read()
+            with open(filename, 'rb') as f:
+                self.load_source(f.read())
             return True
         except Exception as e:
-            print(f"Error loading file: {e}")
+            logger.error("Error loading file: %s", e)
             return False
     
+    def load_source(self, source: Source):
+        """Load obfuscated Lua code from a str or bytes object"""
+        self.original_code = decode_source(source)
+        # Keep raw bytes around: binary chunks do not survive utf-8 decoding
+        self.original_bytes = None if isinstance(source, str) else bytes(source)
+        self.deobfuscated_code = ""
+        self.bytecode_chunks = None
+        self.triage_result = None
+    
+    def run(self, source: Source, analyze_only: bool = False,
+            fast_lane: bool = False) -> DeobfuscationResult:
+        """Deobfuscate (or just analyze) source in memory and return the results.
+        
+        With fast_lane, samples that triage as clean skip the pipeline and
+        come back unchanged with a triage-only report.
+        """
+        self.load_source(source)
+        timings = Timings()
+        if fast_lane:
+            with timings.stage('triage'):
+                result = self.triage()
+            if result.lane == 'fast':
+                self.deobfuscated_code = self.original_code
+                return DeobfuscationResult(None if analyze_only else self.original_code,
+                                           self.generate_triage_report(), timings)
+        if not analyze_only:
+            self.deobfuscate()
+            timings.stages.update(self.timings.stages)
+        self.timings = timings
+        with self.timings.stage('report'):
+            report = self.generate_report()
+        return DeobfuscationResult(None if analyze_only else self.deobfuscated_code,
+                                   report, self.timings)
+    
+    def triage(self) -> 'TriageResult':
+        """Cheap numeric pre-screen of the loaded sample (cached)"""
+        if self.triage_result is None:
+            from lua_triage import triage
+            raw = self.original_bytes if self.original_bytes is not None else self.original_code
+            self.triage_result = triage(raw)
+        return self.triage_result
+    
     def analyze_obfuscation(self) -> Dict[str, Any]:
         """Analyze the type and level of obfuscation"""
         analysis = {
@@ -97,7 +132,7 @@ class LuaDeobfuscator:
             techniques_found.append('dynamic_code_execution')
             
         # Check for bytecode obfuscation
-        if self.patterns['bytecode_dump'].search(code):
+        if self.patterns['bytecode_dump'].search(code) or self.find_bytecode():
             techniques_found.append('bytecode_encoding')
             
         # Check for control flow obfuscation
@@ -138,7 +173,7 @@ class LuaDeobfuscator:
         for match in char_matches:
             try:
                 # Extract numbers from string.char(num1, num2, ...)
-                numbers = re.findall(r'\d+', match)
+                numbers = self.patterns['digits'].findall(match)
                 if numbers:
                     decoded = ''.join(chr(int(num)) for num in numbers if 0 <= int(num) <= 255)
                     strings.append(decoded)
@@ -157,42 +192,111 @@ class LuaDeobfuscator:
                 
         return strings
     
+    def find_bytecode(self) -> List[Tuple[str, Any]]:
+        """Locate precompiled chunks embedded in the script (cached per load)"""
+        if self.bytecode_chunks is None:
+            from lua_bytecode import find_chunks
+            self.bytecode_chunks = find_chunks(self.original_code, self.original_bytes)
+        return self.bytecode_chunks
+    
+    def disassemble_bytecode(self) -> str:
+        """Disassembly listing of every embedded chunk"""
+        from lua_bytecode import disassemble
+        listings = []
+        for origin, chunk in self.find_bytecode():
+            listings.append(f"-- Lua {chunk.version} chunk ({origin}, {chunk.size} bytes)")
+            listings.append(disassemble(chunk))
+        return '\n'.join(listings)
+    
     def deobfuscate_strings(self) -> str:
         """Deobfuscate string encodings"""
+        from lua_lexer import encode_string_literal, normalize_string_literal, tokenize
         code = self.original_code
-        
-        # Deobfuscate string.char() calls
-        def replace_string_char(match):
-            try:
-                numbers = re.findall(r'\d+', match.group(0))
-                if numbers:
-                    decoded = ''.join(chr(int(num)) for num in numbers if 0 <= int(num) <= 255)
-                    return f'"{decoded}"'
-            except:
-                pass
-            return match.group(0)
-            
-        code = self.patterns['string_concat'].sub(replace_string_char, code)
-        
-        # Deobfuscate hex encoded strings
-        def replace_hex_strings(match):
+        tokens = tokenize(code)
+        pieces = []
+        pos = 0
+        i = 0
+        shadowed = self._local_string_uses(code, tokens)
+        
+        # One pass over the tokens: fold string.char() calls and re-emit every
+        # literal in its shortest readable form, whatever escapes it used
+        while i < len(tokens):
+            tok = tokens[i]
+            if tok.kind == 'string':
+                literal = normalize_string_literal(tok.value)
+                if literal != tok.value:
+                    pieces.append(code[pos:tok.start])
+                    pieces.append(literal)
+                    pos = tok.end
+            elif tok.kind == 'name' and tok.value == 'string' and shadowed is not None and i not in shadowed:
+                call = self._string_char_call(tokens, i)
+                if call is not None:
+                    close, data = call
+                    literal = encode_string_literal(data)
+                    # A literal cannot be indexed or called without parentheses
+                    if close + 1 < len(tokens) and (tokens[close + 1].value in ('.', ':', '[', '(', '{')
+                                                    or tokens[close + 1].kind == 'string'):
+                        literal = f'({literal})'
+                    pieces.append(code[pos:tok.start])
+                    pieces.append(literal)
+                    pos = tokens[close].end
+                    i = close
+            i += 1
+        
+        pieces.append(code[pos:])
+        return ''.join(pieces)
+    
+    def _local_string_uses(self, code: str, tokens: List['Token']) -> Optional[Set[int]]:
+        """Tokens where `string` names a local rather than the library, None when scopes are unclear"""
+        # A declared name is never followed by '.' or ':', so most scripts need no resolution
+        if all(k + 1 < len(tokens) and tokens[k + 1].value in ('.', ':')
+               for k, tok in enumerate(tokens) if tok.kind == 'name' and tok.value == 'string'):
+            return set()
+        from lua_dce import _Eliminator
+        scopes = _Eliminator(code)
+        if not scopes.balanced():
+            return None
+        scopes.resolve()
+        return {k for k, decl in enumerate(scopes.resolved) if decl >= 0 and scopes.names[decl] == 'string'}
+    
+    def _string_char_call(self, tokens: List['Token'], i: int) -> Optional[Tuple[int, bytes]]:
+        """Index of the ')' and the bytes of a string.char(<constant bytes>) call at token i"""
+        if i > 0 and tokens[i - 1].value in ('.', ':'):
+            return None
+        if [tok.value for tok in tokens[i + 1:i + 4]] != ['.', 'char', '(']:
+            return None
+        data = bytearray()
+        j = i + 4
+        while j < len(tokens) and tokens[j].kind == 'number':
+            text = tokens[j].value
             try:
-                hex_str = match.group(0)
-                decoded = bytes.fromhex(hex_str.replace('\\x', '')).decode('utf-8', errors='ignore')
-                return f'"{decoded}"'
-            except:
-                return match.group(0)
-                
-        code = self.patterns['hex_encoded'].sub(replace_hex_strings, code)
-        
-        return code
+                value = int(text, 16) if text[:2] in ('0x', '0X') else int(text)
+            except ValueError:
+                return None
+            if not 0 <= value <= 255:
+                return None
+            data.append(value)
+            j += 1
+            if j < len(tokens) and tokens[j].value == ',':
+                j += 1
+            elif j < len(tokens) and tokens[j].value == ')':
+                break
+            else:
+                return None
+        if j >= len(tokens) or tokens[j].value != ')':
+            return None
+        return j, bytes(data)
     
-    def analyze_control_flow(self) -> Dict[str, List[str]]:
+    def analyze_control_flow(self) -> Dict[str, Any]:
         """Analyze control flow obfuscation"""
         analysis = {
             'labels': [],
             'jumps': [],
-            'suspicious_patterns': []
+            'suspicious_patterns': [],
+            'blocks': 0,
+            'edges': 0,
+            'dispatchers': [],
+            'unreachable_blocks': 0
         }
         
         # Find goto labels
@@ -209,6 +313,27 @@ class LuaDeobfuscator:
         if len(analysis['jumps']) > len(analysis['labels']):
             analysis['suspicious_patterns'].append('more_jumps_than_labels')
             
+        # Build the control flow graph for block-level statistics
+        from lua_cfg import build_cfg
+        cfg = build_cfg(self.original_code)
+        analysis['blocks'] = len(cfg.nodes)
+        analysis['edges'] = cfg.edges
+        analysis['unreachable_blocks'] = len(cfg.unreachable)
+        analysis['dispatchers'] = [
+            {
+                'line': cfg.tokens[d.loop].line,
+                'state_variable': d.state_var,
+                'recovered': d.path is not None,
+                'cases': len(d.cases),
+                'reachable_cases': sum(1 for case in d.cases if case.node.reachable)
+            }
+            for d in cfg.dispatchers
+        ]
+        if cfg.dispatchers:
+            analysis['suspicious_patterns'].append('flattened_dispatch_loops')
+        if cfg.unreachable:
+            analysis['suspicious_patterns'].append('unreachable_blocks')
+            
         return analysis
     
     def find_vulnerabilities(self) -> List[Dict[str, str]]:
@@ -262,42 +387,63 @@ class LuaDeobfuscator:
             'strings': [],
             'numbers': [],
             'tables': [],
-            'functions': []
+            'functions': [],
+            'bytecode': []
         }
         
         # Extract string literals
-        string_pattern = re.compile(r'"([^"\\]|\\.)*"|\'([^\'\\]|\\.)*\'')
-        constants['strings'] = string_pattern.findall(self.original_code)
+        constants['strings'] = self.patterns['string_literal'].findall(self.original_code)
         
         # Extract numeric constants
-        number_pattern = re.compile(r'\b\d+(?:\.\d+)?\b')
-        constants['numbers'] = list(set(number_pattern.findall(self.original_code)))
+        constants['numbers'] = list(set(self.patterns['number_literal'].findall(self.original_code)))
+        
+        # Constants of embedded precompiled chunks
+        for _, chunk in self.find_bytecode():
+            constants['bytecode'].extend(chunk.summary()['constants'])
         
         return constants
     
     def deobfuscate(self) -> str:
         """Main deobfuscation method"""
-        print("Starting deobfuscation process...")
+        logger.info("Starting deobfuscation process...")
+        timings = self.timings = Timings()
         
         # Step 1: Analyze obfuscation
-        analysis = self.analyze_obfuscation()
-        print(f"Obfuscation analysis: {analysis}")
+        with timings.stage('analysis'):
+            analysis = self.analyze_obfuscation()
+        logger.info("Obfuscation analysis: %s", analysis)
         
         # Step 2: Deobfuscate strings
-        code = self.deobfuscate_strings()
-        print("String deobfuscation completed")
-        
-        # Step 3: Simplify variable names (basic approach)
-        code = self._simplify_variables(code)
-        print("Variable simplification completed")
-        
-        # Step 4: Remove junk code
-        code = self._remove_junk_code(code)
-        print("Junk code removal completed")
-        
-        # Step 5: Format code
-        code = self._format_code(code)
-        print("Code formatting completed")
+        with timings.stage('strings'):
+            code = self.deobfuscate_strings()
+        logger.info("String deobfuscation completed")
+        
+        # Step 3: Deflatten control flow
+        with timings.stage('control_flow'):
+            from lua_cfg import deflatten
+            code, self.deflatten_stats = deflatten(code)
+        logger.info("Control flow deflattening completed: %s", self.deflatten_stats)
+        
+        # Step 4: Hoist repeated function bodies and blocks, so later stages see each once
+        with timings.stage('dedup'):
+            from lua_dedup import deduplicate
+            code, self.dedup_stats = deduplicate(code)
+        logger.info("Deduplication completed: %s", self.dedup_stats)
+        
+        # Step 5: Simplify variable names (basic approach)
+        with timings.stage('variables'):
+            code = self._simplify_variables(code)
+        logger.info("Variable simplification completed")
+        
+        # Step 6: Remove junk code
+        with timings.stage('junk_code'):
+            code = self._remove_junk_code(code)
+        logger.info("Junk code removal completed: %s", self.dead_code_stats)
+        
+        # Step 7: Format code
+        with timings.stage('formatting'):
+            code = self._format_code(code)
+        logger.info("Code formatting completed")
         
         self.deobfuscated_code = code
         return code
@@ -305,8 +451,7 @@ class LuaDeobfuscator:
     def _simplify_variables(self, code: str) -> str:
         """Simplify variable names"""
         # Find all variable-like identifiers
-        var_pattern = re.compile(r'\b[a-zA-Z_][a-zA-Z0-9_]*\b')
-        variables = set(var_pattern.findall(code))
+        variables = set(self.patterns['identifier'].findall(code))
         
         # Filter out Lua keywords and built-in functions
         lua_keywords = {
@@ -328,51 +473,15 @@ class LuaDeobfuscator:
         return code
     
     def _remove_junk_code(self, code: str) -> str:
-        """Remove obvious junk code"""
-        lines = code.split('\n')
-        clean_lines = []
-        
-        for line in lines:
-            line = line.strip()
-            
-            # Skip empty lines and comments
-            if not line or line.startswith('--'):
-                continue
-                
-            # Skip obvious junk patterns
-            if re.match(r'^local \w+\s*=\s*\d+$', line):  # local var = number
-                continue
-            if re.match(r'^if false then', line):  # if false blocks
-                continue
-            if re.match(r'^while false do', line):  # while false blocks
-                continue
-                
-            clean_lines.append(line)
-            
-        return '\n'.join(clean_lines)
+        """Remove unused locals, constant branches and opaque predicates"""
+        from lua_dce import eliminate_dead_code
+        code, self.dead_code_stats = eliminate_dead_code(code)
+        return code
     
     def _format_code(self, code: str) -> str:
-        """Basic code formatting"""
-        lines = code.split('\n')
-        formatted_lines = []
-        indent_level = 0
-        
-        for line in lines:
-            line = line.strip()
-            if not line:
-                continue
-                
-            # Decrease indent for end statements
-            if re.match(r'^(end|else|elseif|until)', line):
-                indent_level = max(0, indent_level - 1)
-                
-            formatted_lines.append('  ' * indent_level + line)
-            
-            # Increase indent for block statements
-            if re.match(r'.*(then|do|else|function.*\)|repeat)$', line):
-                indent_level += 1
-                
-        return '\n'.join(formatted_lines)
+        """Re-flow code into one indented statement per line"""
+        from lua_format import reflow
+        return reflow(code)
     
     def save_deobfuscated(self, filename: str) -> bool:
         """Save deobfuscated code to file"""
@@ -381,7 +490,7 @@ class LuaDeobfuscator:
                 f.write(self.deobfuscated_code)
             return True
         except Exception as e:
-            print(f"Error saving file: {e}")
+            logger.error("Error saving file: %s", e)
             return False
     
     def generate_report(self) -> Dict[str, Any]:
@@ -393,9 +502,15 @@ class LuaDeobfuscator:
         strings = self.extract_strings()
         
         return {
+            'triage': self.triage().as_dict(),
             'obfuscation_analysis': analysis,
             'vulnerabilities': vulnerabilities,
             'control_flow': control_flow,
+            'deflattening': self.deflatten_stats,
+            'deduplication': self.dedup_stats,
+            'dead_code': self.dead_code_stats,
+            'bytecode_chunks': [dict(origin=origin, **chunk.summary())
+                                for origin, chunk in self.find_bytecode()],
             'extracted_constants': constants,
             'extracted_strings': strings[:50],  # Limit output
             'statistics': {
@@ -406,52 +521,82 @@ class LuaDeobfuscator:
             }
         }
 
-def main():
+    def generate_triage_report(self) -> Dict[str, Any]:
+        """Report for samples routed to the fast lane"""
+        return {
+            'triage': self.triage().as_dict(),
+            'fast_lane': True,
+            'statistics': {
+                'original_size': len(self.original_code),
+                'deobfuscated_size': len(self.deobfuscated_code),
+                'lines_original': len(self.original_code.split('\n')),
+                'lines_deobfuscated': len(self.deobfuscated_code.split('\n')),
+            }
+        }
+
+def deobfuscate_source(source: Source, analyze_only: bool = False,
+                       fast_lane: bool = False) -> DeobfuscationResult:
+    """Library entry point: deobfuscate Lua code held in memory"""
+    return LuaDeobfuscator().run(source, analyze_only=analyze_only, fast_lane=fast_lane)
+
+def main(argv: Optional[List[str]] = None):
     parser = argparse.ArgumentParser(description='Lua Deobfuscator - Analyze and deobfuscate Lua scripts')
     parser.add_argument('input_file', help='Input obfuscated Lua file')
     parser.add_argument('-o', '--output', help='Output file for deobfuscated code')
     parser.add_argument('-r', '--report', help='Output file for analysis report (JSON)')
     parser.add_argument('-a', '--analyze-only', action='store_true', help='Only analyze, don\'t deobfuscate')
     parser.add_argument('-v', '--verbose', action='store_true', help='Verbose output')
+    parser.add_argument('-d', '--disassemble', action='store_true', help='Print a listing of embedded bytecode chunks')
+    parser.add_argument('-f', '--fast-lane', action='store_true',
+                        help='Triage first and pass clean files through untouched')
     
-    args = parser.parse_args()
-    
-    # Initialize deobfuscator
-    deobfuscator = LuaDeobfuscator()
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO,
+                        format='%(message)s', stream=sys.stdout)
     
     # Load file
-    if not deobfuscator.load_file(args.input_file):
+    try:
+        with open(args.input_file, 'rb') as f:
+            source = f.read()
+    except OSError as e:
+        print(f"Error loading file: {e}")
         print(f"Failed to load file: {args.input_file}")
         return 1
     
     print(f"Loaded file: {args.input_file}")
-    print(f"File size: {len(deobfuscator.original_code)} bytes")
+    print(f"File size: {len(decode_source(source))} bytes")
+    
+    result = deobfuscate_source(source, analyze_only=args.analyze_only, fast_lane=args.fast_lane)
+    report = result.report
+    
+    if report.get('fast_lane'):
+        triage_report = report['triage']
+        print(f"\nTriage: {triage_report['family']} (score {triage_report['score']:.3f}) - fast lane, "
+              f"full analysis skipped")
     
     if args.analyze_only:
         # Analysis only
-        report = deobfuscator.generate_report()
-        
         if args.verbose:
             print("\n=== ANALYSIS REPORT ===")
             print(json.dumps(report, indent=2))
-        else:
+        elif not report.get('fast_lane'):
             print(f"\nObfuscation detected: {report['obfuscation_analysis']['obfuscation_detected']}")
             print(f"Techniques found: {', '.join(report['obfuscation_analysis']['techniques'])}")
             print(f"Complexity: {report['obfuscation_analysis']['complexity']}")
             print(f"Vulnerabilities found: {len(report['vulnerabilities'])}")
+            print(f"Bytecode chunks found: {len(report['bytecode_chunks'])}")
     else:
-        # Full deobfuscation
-        deobfuscated = deobfuscator.deobfuscate()
-        
         # Save output
         output_file = args.output or args.input_file.replace('.lua', '_deobfuscated.lua')
-        if deobfuscator.save_deobfuscated(output_file):
+        try:
+            with open(output_file, 'w', encoding='utf-8') as f:
+                f.write(result.output)
             print(f"Deobfuscated code saved to: {output_file}")
+        except OSError as e:
+            print(f"Error saving file: {e}")
         
-        # Generate and save report
-        report = deobfuscator.generate_report()
+        # Save report
         report_file = args.report or args.input_file.replace('.lua', '_analysis.json')
-        
         try:
             with open(report_file, 'w') as f:
                 json.dump(report, f, indent=2)
@@ -463,6 +608,12 @@ def main():
             print(f"\nOriginal size: {report['statistics']['original_size']} bytes")
             print(f"Deobfuscated size: {report['statistics']['deobfuscated_size']} bytes")
             print(f"Reduction: {((report['statistics']['original_size'] - report['statistics']['deobfuscated_size']) / report['statistics']['original_size'] * 100):.1f}%")
+            print(f"Timings: {result.timings}")
+    
+    if args.disassemble:
+        deobfuscator = LuaDeobfuscator()
+        deobfuscator.load_source(source)
+        print(deobfuscator.disassemble_bytecode() or "No embedded bytecode chunks found")
     
     return 0
 
@@ -0,0 +1,1392 @@
+#!/usr/bin/env python3
+"""
+Lua Devirtualizer - Static recovery of interpreter-style VM protection
+Works on the `while alpha do` dispatch loops emitted by VM obfuscators:
+- Opcode handlers recovered by walking the if/elseif dispatch tree
+- Handler roles (register stack, constants, environment, operands)
+  inferred from how the handlers index their tables
+- Every handler mapped to a semantic operation (MOVE, LOADK, CALL, JMP, ...)
+The decoded instruction stream is then lifted back to Lua in one linear
+pass. Opcode maps are cached per VM build, keyed by a hash of the loop.
+"""
+
+import argparse
+import hashlib
+import math
+import re
+import sys
+from collections import Counter
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from lua_cfg import parse_number
+from lua_lexer import BlockMap, Token, decode_string_literal, encode_string_literal, match_blocks, tokenize
+
+MIN_HANDLERS = 3
+MAX_CACHED_VMS = 64
+
+# Role placeholders substituted into handler token streams; none is a valid Lua name
+STACK, CONSTANTS, ENV, PC, HALT = '@R', '@K', '@E', '@PC', '@HALT'
+
+_NAME = re.compile(r'[A-Za-z_][A-Za-z0-9_]*\Z')
+_STATEMENT_KEYWORDS = frozenset({'local', 'if', 'while', 'for', 'return', 'do', 'function',
+                                 'repeat', 'goto', 'break'})
+_EXPRESSION_END = frozenset({')', ']', '}', 'end', 'true', 'false', 'nil', '...'})
+_CONDITION = re.compile(r'\(?(.+?)(==|~=|<=|>=|<|>)(.+?)\)?')
+
+# Semantic operations, matched in order against the compacted handler text
+_REG = r'@R\[[^\[\]]+\]'
+_KST = r'@K\[[^\[\]]+\]'
+_OPND = r'-?\$\w+'
+_RK = rf'(?:{_REG}|{_KST}|{_OPND})'
+_GLOBAL = rf'@E\[(?:{_KST}|{_OPND})\]'
+_JUMP = rf'@PC=(?:@PC[-+])?(?:{_OPND}|\d+)'
+_ARITH_NAMES = {
+    '+': 'ADD', '-': 'SUB', '*': 'MUL', '/': 'DIV', '//': 'IDIV', '%': 'MOD', '^': 'POW',
+    '..': 'CONCAT', '&': 'BAND', '|': 'BOR', '~': 'BXOR', '<<': 'SHL', '>>': 'SHR',
+}
+_COMPARE_NAMES = {'==': 'EQ', '~=': 'EQ', '<': 'LT', '>': 'LT', '<=': 'LE', '>=': 'LE'}
+_SEMANTICS = [
+    ('NOP', re.compile(r'')),
+    ('MOVE', re.compile(rf'{_REG}={_REG}')),
+    ('LOADK', re.compile(rf'{_REG}={_KST}')),
+    ('LOADNIL', re.compile(rf'{_REG}=nil')),
+    ('LOADBOOL', re.compile(rf'{_REG}=(?:true|false|\(?{_OPND}[~=]=0\)?)(?:;.*)?')),
+    ('LOADI', re.compile(rf'{_REG}={_OPND}')),
+    ('GETGLOBAL', re.compile(rf'{_REG}={_GLOBAL}')),
+    ('SETGLOBAL', re.compile(rf'{_GLOBAL}={_RK}')),
+    ('NEWTABLE', re.compile(rf'{_REG}=\{{\}}')),
+    ('GETTABLE', re.compile(rf'{_REG}={_REG}\[{_RK}\]')),
+    ('SETTABLE', re.compile(rf'{_REG}\[{_RK}\]={_RK}')),
+    ('ARITH', re.compile(rf'{_REG}={_RK}(\.\.|//|<<|>>|[-+*/%^&|~]){_RK}')),
+    ('UNM', re.compile(rf'{_REG}=-{_RK}')),
+    ('NOT', re.compile(rf'{_REG}=not {_RK}')),
+    ('LEN', re.compile(rf'{_REG}=#{_RK}')),
+    ('JMP', re.compile(_JUMP)),
+    ('TEST', re.compile(rf'if (?:not )?{_REG}then {_JUMP} end')),
+    ('COMPARE', re.compile(rf'if (?:not )?\(?{_RK}(==|~=|<=|>=|<|>){_RK}\)?then {_JUMP} end')),
+]
+_CALL = re.compile(rf'{_REG}\(')
+_RETURN = re.compile(r'(?:^|;)(?:return\b|@HALT=false|break\b)')
+
+# Most recently analysed dispatch loops, keyed by VirtualMachine.fingerprint
+_OPCODE_MAPS: Dict[str, 'VirtualMachine'] = {}
+
+
+class Unliftable(Exception):
+    """Raised when a handler cannot be instantiated for a concrete instruction"""
+    pass
+
+
+class Handler:
+    """One opcode handler of the dispatch loop, in role-normalised form.
+
+    statements is a list of ('stmt', values) and ('if', arms, otherwise)
+    entries, where arms is a list of (condition values, statements).
+    """
+
+    __slots__ = ('opcode', 'operation', 'pattern', 'statements')
+
+    def __init__(self, opcode: int, statements: List[tuple]):
+        self.opcode = opcode
+        self.statements = statements
+        self.pattern = _compact_block(statements)
+        self.operation = classify(self.pattern)
+
+
+class VirtualMachine:
+    """Static description of one VM build: roles, pc discipline and opcode map"""
+
+    __slots__ = ('fingerprint', 'roles', 'dispatch', 'pc_mode', 'handlers')
+
+    def __init__(self, fingerprint: str, roles: Dict[str, Optional[str]], dispatch: str,
+                 pc_mode: str, handlers: Dict[int, Handler]):
+        self.fingerprint = fingerprint
+        self.roles = roles          # instruction, code, pc, halt, stack, constants, env
+        self.dispatch = dispatch    # operand field holding the opcode
+        self.pc_mode = pc_mode      # 'pre', 'post' or 'self' incremented program counter
+        self.handlers = handlers
+
+    @property
+    def opcode_map(self) -> Dict[int, str]:
+        return {opcode: handler.operation for opcode, handler in sorted(self.handlers.items())}
+
+    @property
+    def operand_width(self) -> int:
+        """Number of positional fields per instruction used by the handlers"""
+        fields = [_field_key(self.dispatch)]
+        for handler in self.handlers.values():
+            fields.extend(_field_key(f) for f in re.findall(r'\$(\w+)', handler.pattern))
+        return max((f for f in fields if isinstance(f, int)), default=1)
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            'fingerprint': self.fingerprint,
+            'roles': dict(self.roles),
+            'pc_mode': self.pc_mode,
+            'handlers': len(self.handlers),
+            'opcode_map': {str(op): name for op, name in self.opcode_map.items()},
+        }
+
+    def as_dict(self) -> Dict[str, Any]:
+        """JSON-serialisable form, restored by from_dict()"""
+        return {
+            'fingerprint': self.fingerprint,
+            'roles': dict(self.roles),
+            'dispatch': self.dispatch,
+            'pc_mode': self.pc_mode,
+            'handlers': {str(op): handler.statements for op, handler in sorted(self.handlers.items())},
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'VirtualMachine':
+        handlers = {int(op): Handler(int(op), _restore_statements(statements))
+                    for op, statements in data['handlers'].items()}
+        return cls(data['fingerprint'], dict(data['roles']), data['dispatch'], data['pc_mode'], handlers)
+
+
+class LiftedProgram:
+    """Lua source recovered from one instruction stream"""
+
+    __slots__ = ('source', 'instructions', 'lifted', 'unknown', 'registers')
+
+    def __init__(self, source: str, instructions: int, lifted: int, unknown: int, registers: int):
+        self.source = source
+        self.instructions = instructions
+        self.lifted = lifted
+        self.unknown = unknown
+        self.registers = registers
+
+    def summary(self) -> Dict[str, int]:
+        return {
+            'instructions': self.instructions,
+            'lifted': self.lifted,
+            'unknown': self.unknown,
+            'registers': self.registers,
+        }
+
+
+# ------------------------------------------------------------------ helpers
+
+def _is_name(value: str) -> bool:
+    return bool(_NAME.match(value)) and value not in ('and', 'or', 'not', 'nil', 'true', 'false',
+                                                       'function', 'end', 'local', 'return')
+
+
+def _field_key(field: str) -> Any:
+    return int(field) if field.isdigit() else field
+
+
+def _ends_expression(tok: Token) -> bool:
+    return tok.kind in ('name', 'number', 'string') or tok.value in _EXPRESSION_END
+
+
+def _split_statements(tokens: List[Token], blocks: BlockMap, start: int,
+                      end: int) -> List[Tuple[int, int]]:
+    """Split the token range [start, end) into top-level statement ranges"""
+    statements = []
+    closer = blocks.closer
+    begin = start
+    prev: Optional[Token] = None
+    depth = 0
+    i = start
+    while i < end:
+        tok = tokens[i]
+        if tok.value == ';' and depth == 0:
+            if begin < i:
+                statements.append((begin, i))
+            begin, prev = i + 1, None
+            i += 1
+            continue
+        if (depth == 0 and prev is not None and _ends_expression(prev)
+                and (tok.kind in ('name', 'label') or tok.value in _STATEMENT_KEYWORDS)):
+            statements.append((begin, i))
+            begin = i
+        if tok.kind == 'keyword' and i in closer:
+            i = closer[i]
+            tok = tokens[i]
+        elif tok.kind == 'op' and tok.value in ('(', '[', '{'):
+            depth += 1
+        elif tok.kind == 'op' and tok.value in (')', ']', '}'):
+            depth -= 1
+        prev = tok
+        i += 1
+    if begin < end:
+        statements.append((begin, end))
+    return statements
+
+
+def _matching(values: Sequence[str], i: int) -> int:
+    """Index of the bracket closing the one at values[i]"""
+    pairs = {'(': ')', '[': ']', '{': '}'}
+    opening = values[i]
+    closing = pairs[opening]
+    depth = 0
+    for j in range(i, len(values)):
+        if values[j] == opening:
+            depth += 1
+        elif values[j] == closing:
+            depth -= 1
+            if depth == 0:
+                return j
+    return len(values) - 1
+
+
+def _restore_statements(statements: List[Any]) -> List[tuple]:
+    """Rebuild Handler.statements entries after a JSON round trip"""
+    out = []
+    for entry in statements:
+        if entry[0] == 'stmt':
+            out.append(('stmt', list(entry[1])))
+        else:
+            arms = [(list(cond), _restore_statements(body)) for cond, body in entry[1]]
+            out.append(('if', arms, None if entry[2] is None else _restore_statements(entry[2])))
+    return out
+
+
+def _compact(values: Sequence[str]) -> str:
+    """Join normalised tokens with a space only between two word-like tokens"""
+    out = []
+    prev = ''
+    for value in values:
+        if out and (prev[-1:].isalnum() or prev[-1:] == '_') and (value[:1].isalnum() or value[:1] in '_@$'):
+            out.append(' ')
+        out.append(value)
+        prev = value
+    return ''.join(out)
+
+
+def _compact_block(statements: List[tuple]) -> str:
+    parts = []
+    for entry in statements:
+        if entry[0] == 'stmt':
+            parts.append(_compact(entry[1]))
+            continue
+        _, arms, otherwise = entry
+        text = 'if ' + ' elseif '.join(f"{_compact(cond)}then {_compact_block(body)}"
+                                       for cond, body in arms)
+        if otherwise is not None:
+            text += ' else ' + _compact_block(otherwise)
+        parts.append(text + ' end')
+    return ';'.join(parts)
+
+
+def classify(pattern: str) -> str:
+    """Map a compacted, role-normalised handler to a semantic operation name"""
+    for name, regex in _SEMANTICS:
+        m = regex.fullmatch(pattern)
+        if not m:
+            continue
+        if name == 'ARITH':
+            return _ARITH_NAMES[m.group(1)]
+        if name == 'COMPARE':
+            return _COMPARE_NAMES[m.group(1)]
+        return name
+    if _CALL.search(pattern):
+        return 'CALL'
+    if _RETURN.search(pattern):
+        return 'RETURN'
+    if 'function' in pattern:
+        return 'CLOSURE'
+    return 'UNKNOWN'
+
+
+# ----------------------------------------------------------------- analysis
+
+class _LoopAnalysis:
+    """Recovers the handlers of one candidate dispatch loop"""
+
+    def __init__(self, tokens: List[Token], blocks: BlockMap, loop: int):
+        self.tokens = tokens
+        self.blocks = blocks
+        self.loop = loop
+        self.aliases: Dict[str, str] = {}    # token value -> placeholder
+        self.roles: Dict[str, Optional[str]] = {}
+        self._compared: List[int] = []
+
+    def run(self) -> Optional[VirtualMachine]:
+        tokens, blocks = self.tokens, self.blocks
+        loop = self.loop
+        do = blocks.body.get(loop)
+        end = blocks.closer.get(loop)
+        if do is None or end is None:
+            return None
+        condition = [tok.value for tok in tokens[loop + 1:do]]
+        halt = condition[0] if len(condition) == 1 and _is_name(condition[0]) else None
+        if halt is None and condition != ['true']:
+            return None
+
+        statements = _split_statements(tokens, blocks, do + 1, end)
+        dispatch_at = next((n for n, (s, _) in enumerate(statements)
+                            if tokens[s].value == 'if' and s in blocks.branches), None)
+        if dispatch_at is None:
+            return None
+
+        # Step 1: instruction fetch and program counter discipline
+        pc_mode = 'self'
+        for n, (s, e) in enumerate(statements):
+            values = [tok.value for tok in tokens[s:e]]
+            if (len(values) == 7 and values[0] == 'local' and values[2] == '=' and values[4] == '['
+                    and values[6] == ']' and 'instruction' not in self.roles):
+                self.roles.update(instruction=values[1], code=values[3], pc=values[5])
+            elif (len(values) in (6, 7) and values[0] == 'local' and values[2] == '='
+                  and values[3] == self.roles.get('instruction')):
+                if values[4:5] == ['['] and values[6:7] == [']']:
+                    self.aliases[values[1]] = '$' + values[5]
+                elif values[4:5] == ['.']:
+                    self.aliases[values[1]] = '$' + values[5]
+            elif values == [self.roles.get('pc'), '=', self.roles.get('pc'), '+', '1']:
+                pc_mode = 'pre' if n < dispatch_at else 'post'
+        if 'instruction' not in self.roles:
+            return None
+        self.roles['halt'] = halt
+        self.aliases[self.roles['pc']] = PC
+        if halt:
+            self.aliases[halt] = HALT
+
+        # Step 2: walk the dispatch tree, collecting one handler per opcode
+        leaves: List[tuple] = []
+        self._walk(statements[dispatch_at][0], -math.inf, math.inf, frozenset(), leaves)
+        bodies = {}
+        for lo, hi, excluded, s, e in leaves:
+            # Opcodes are numbered densely, so open ranges end one past the constants compared
+            lo = max(lo, min(self._compared, default=0))
+            hi = min(hi, max(self._compared, default=0) + 1)
+            remaining = [v for v in range(int(lo), int(hi) + 1) if v not in excluded][:2]
+            if len(remaining) == 1:
+                bodies[remaining[0]] = self._structure(s, e)
+        if len(bodies) < MIN_HANDLERS:
+            return None
+        dispatch = self._dispatch_field
+
+        # Step 3: name the stack, constant and environment tables
+        self._infer_roles(bodies.values())
+        renames = {self.roles[role]: placeholder for role, placeholder in
+                   (('stack', STACK), ('constants', CONSTANTS), ('env', ENV)) if self.roles.get(role)}
+        handlers = {}
+        for opcode, body in bodies.items():
+            body = _rename(body, renames)
+            if pc_mode == 'self':
+                body = [entry for entry in body if entry != ('stmt', [PC, '=', PC, '+', '1'])] or body
+            handlers[opcode] = Handler(opcode, body)
+
+        fingerprint = loop_fingerprint(tokens, loop, end)
+        return VirtualMachine(fingerprint, self.roles, dispatch, pc_mode, handlers)
+
+    # -- dispatch tree
+
+    _dispatch_field = ''
+
+    def _compare(self, start: int, end: int) -> Optional[Tuple[str, float]]:
+        """Parse `D op n` / `n op D` where D is the dispatched operand"""
+        values = self._normalise(start, end)
+        m = _CONDITION.fullmatch(''.join(values))
+        if not m:
+            return None
+        left, op, right = m.groups()
+        number = parse_number(right)
+        if number is None:
+            number = parse_number(left)
+            if number is None:
+                return None
+            left = right
+            op = {'<': '>', '>': '<', '<=': '>=', '>=': '<='}.get(op, op)
+        if not left.startswith('$') or (self._dispatch_field and left[1:] != self._dispatch_field):
+            return None
+        self._dispatch_field = left[1:]
+        self._compared.append(int(number))
+        return op, number
+
+    def _walk(self, stmt: int, lo: float, hi: float, excluded: frozenset, leaves: List[tuple]):
+        tokens, blocks = self.tokens, self.blocks
+        marks = blocks.branches[stmt] + [blocks.closer[stmt]]
+        head = stmt
+        for n, mark in enumerate(marks[:-1]):
+            if tokens[mark].value == 'else':
+                self._leaf(mark + 1, marks[n + 1], lo, hi, excluded, leaves)
+                return
+            if tokens[mark].value != 'then':
+                head = mark
+                continue
+            compare = self._compare(head + 1, mark)
+            if compare is None:
+                return
+            op, k = compare
+            if op == '==':
+                arm, rest = (k, k, excluded), (lo, hi, excluded | {k})
+            elif op == '~=':
+                arm, rest = (lo, hi, excluded | {k}), (k, k, excluded)
+            elif op in ('<', '<='):
+                top = k - 1 if op == '<' else k
+                arm, rest = (lo, min(hi, top), excluded), (max(lo, top + 1), hi, excluded)
+            else:
+                bottom = k + 1 if op == '>' else k
+                arm, rest = (max(lo, bottom), hi, excluded), (lo, min(hi, bottom - 1), excluded)
+            self._leaf(mark + 1, marks[n + 1], *arm, leaves)
+            lo, hi, excluded = rest
+
+    def _leaf(self, start: int, end: int, lo: float, hi: float, excluded: frozenset,
+              leaves: List[tuple]):
+        blocks = self.blocks
+        if (self.tokens[start].value == 'if' and blocks.closer.get(start) == end - 1
+                and self._compare(start + 1, blocks.branches[start][0]) is not None):
+            self._walk(start, lo, hi, excluded, leaves)
+            return
+        if lo <= hi:
+            leaves.append((lo, hi, excluded, start, end))
+
+    # -- handler normalisation
+
+    def _normalise(self, start: int, end: int) -> List[str]:
+        """Token values with operand accesses, pc and halt flag replaced by placeholders"""
+        tokens = self.tokens
+        instruction = self.roles.get('instruction')
+        aliases = self.aliases
+        values = []
+        i = start
+        while i < end:
+            value = tokens[i].value
+            if value == instruction and i + 3 < end + 1 and (i == start or tokens[i - 1].value not in ('.', ':')):
+                nxt = tokens[i + 1].value if i + 1 < end else ''
+                if nxt == '[' and i + 3 < end and tokens[i + 3].value == ']' and tokens[i + 2].kind == 'number':
+                    values.append('$' + tokens[i + 2].value)
+                    i += 4
+                    continue
+                if nxt == '.' and i + 2 < end and tokens[i + 2].kind == 'name':
+                    values.append('$' + tokens[i + 2].value)
+                    i += 3
+                    continue
+            if tokens[i].kind == 'name' and value in aliases and (i == start or tokens[i - 1].value not in ('.', ':')):
+                values.append(aliases[value])
+            else:
+                values.append(value)
+            i += 1
+        return values
+
+    def _structure(self, start: int, end: int) -> List[tuple]:
+        """Statement list for a token range, with if statements kept structured"""
+        tokens, blocks = self.tokens, self.blocks
+        body = []
+        for s, e in _split_statements(tokens, blocks, start, end):
+            if tokens[s].value != 'if' or s not in blocks.branches or blocks.closer.get(s) != e - 1:
+                body.append(('stmt', self._normalise(s, e)))
+                continue
+            marks = blocks.branches[s] + [e - 1]
+            arms, otherwise, head = [], None, s
+            for n, mark in enumerate(marks[:-1]):
+                if tokens[mark].value == 'then':
+                    arms.append((self._normalise(head + 1, mark), self._structure(mark + 1, marks[n + 1])))
+                elif tokens[mark].value == 'else':
+                    otherwise = self._structure(mark + 1, marks[n + 1])
+                else:
+                    head = mark
+            body.append(('if', arms, otherwise))
+        return body
+
+    def _infer_roles(self, bodies):
+        """Pick the register stack, constant pool and environment by indexing patterns"""
+        assigned: Counter = Counter()
+        indexed: Counter = Counter()
+        lookups: Counter = Counter()
+        for values in _all_values(bodies):
+            for j, value in enumerate(values[:-1]):
+                if values[j + 1] != '[' or not _is_name(value) or (j and values[j - 1] in ('.', ':')):
+                    continue
+                close = _matching(values, j + 1)
+                inner = values[j + 2:close]
+                if inner[:1] and _is_name(inner[0]) and inner[1:2] == ['[']:
+                    lookups[(value, inner[0])] += 1
+                if not any(v.startswith('$') for v in inner):
+                    continue
+                indexed[value] += 1
+                if j == 0 and values[close + 1:close + 2] == ['=']:
+                    assigned[value] += 1
+        stack = (assigned or indexed).most_common(1)[0][0] if (assigned or indexed) else None
+        constants = env = None
+        for (outer, inner), _ in lookups.most_common():
+            if inner != stack and outer != stack:
+                env, constants = outer, inner
+                break
+        if constants is None:
+            constants = next((name for name, _ in indexed.most_common()
+                              if name != stack and name not in assigned), None)
+        self.roles.update(stack=stack, constants=constants, env=env)
+
+
+def _all_values(bodies):
+    for body in bodies:
+        for entry in body:
+            if entry[0] == 'stmt':
+                yield entry[1]
+                continue
+            for cond, arm in entry[1]:
+                yield cond
+                yield from _all_values([arm])
+            if entry[2] is not None:
+                yield from _all_values([entry[2]])
+
+
+def _rename(body: List[tuple], renames: Dict[str, str]) -> List[tuple]:
+    def swap(values):
+        return [renames.get(v, v) if _is_name(v) and (j == 0 or values[j - 1] not in ('.', ':'))
+                else v for j, v in enumerate(values)]
+    out = []
+    for entry in body:
+        if entry[0] == 'stmt':
+            out.append(('stmt', swap(entry[1])))
+        else:
+            arms = [(swap(cond), _rename(arm, renames)) for cond, arm in entry[1]]
+            out.append(('if', arms, None if entry[2] is None else _rename(entry[2], renames)))
+    return out
+
+
+def loop_fingerprint(tokens: List[Token], start: int, end: int) -> str:
+    """Whitespace-insensitive hash of a dispatch loop's token stream"""
+    digest = hashlib.sha1()
+    for tok in tokens[start:end + 1]:
+        digest.update(tok.value.encode('utf-8', errors='surrogateescape'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def remember_vm(vm: VirtualMachine) -> None:
+    """Add a VM to the opcode map cache so its dispatch loop is not re-analysed"""
+    if vm.fingerprint not in _OPCODE_MAPS and len(_OPCODE_MAPS) >= MAX_CACHED_VMS:
+        del _OPCODE_MAPS[next(iter(_OPCODE_MAPS))]
+    _OPCODE_MAPS[vm.fingerprint] = vm
+
+
+def locate_vm(tokens: List[Token], blocks: BlockMap) -> Optional[Tuple[int, VirtualMachine]]:
+    """(loop token index, VM) for the dispatch loop with the most recoverable handlers"""
+    best: Optional[Tuple[int, VirtualMachine]] = None
+    for i, tok in enumerate(tokens):
+        if tok.value != 'while' or tok.kind != 'keyword' or i not in blocks.closer:
+            continue
+        fingerprint = loop_fingerprint(tokens, i, blocks.closer[i])
+        vm = _OPCODE_MAPS.get(fingerprint)
+        if vm is None:
+            vm = _LoopAnalysis(tokens, blocks, i).run()
+            if vm is None:
+                continue
+            remember_vm(vm)
+        if best is None or len(vm.handlers) > len(best[1].handlers):
+            best = (i, vm)
+    return best
+
+
+def find_vm(code: str, tokens: Optional[List[Token]] = None,
+            blocks: Optional[BlockMap] = None) -> Optional[VirtualMachine]:
+    """Locate the dispatch loop with the most recoverable opcode handlers"""
+    if tokens is None:
+        tokens = tokenize(code)
+    if blocks is None:
+        blocks = match_blocks(tokens)
+    located = locate_vm(tokens, blocks)
+    return located[1] if located else None
+
+
+# ------------------------------------------------------- instruction stream
+
+class _NotLiteral(Exception):
+    pass
+
+
+def _parse_literal(tokens: List[Token], i: int) -> Tuple[Any, int]:
+    """Parse a constant Lua value (tables of literals included) starting at token i"""
+    tok = tokens[i]
+    if tok.kind == 'number':
+        return parse_number(tok.value), i + 1
+    if tok.kind == 'string':
+        return decode_string_literal(tok.value).decode('utf-8', errors='surrogateescape'), i + 1
+    if tok.value in ('true', 'false', 'nil'):
+        return {'true': True, 'false': False, 'nil': None}[tok.value], i + 1
+    if tok.value == '-' and tokens[i + 1].kind == 'number':
+        return -parse_number(tokens[i + 1].value), i + 2
+    if tok.value != '{':
+        raise _NotLiteral(tok.value)
+
+    table: Dict[Any, Any] = {}
+    position = 1
+    i += 1
+    while tokens[i].value != '}':
+        if tokens[i].value == '[':
+            key, i = _parse_literal(tokens, i + 1)
+            if tokens[i].value != ']' or tokens[i + 1].value != '=':
+                raise _NotLiteral(tokens[i].value)
+            table[key], i = _parse_literal(tokens, i + 2)
+        elif tokens[i].kind == 'name' and tokens[i + 1].value == '=':
+            table[tokens[i].value], i = _parse_literal(tokens, i + 2)
+        else:
+            table[position], i = _parse_literal(tokens, i)
+            position += 1
+        if tokens[i].value in (',', ';'):
+            i += 1
+    return table, i + 1
+
+
+def find_table(tokens: List[Token], name: Optional[str]) -> Optional[Dict[Any, Any]]:
+    """Literal table assigned to name anywhere in the script"""
+    if not name:
+        return None
+    for i in range(len(tokens) - 2):
+        if (tokens[i].value == name and tokens[i + 1].value == '=' and tokens[i + 2].value == '{'
+                and (i == 0 or tokens[i - 1].value not in ('.', ':'))):
+            try:
+                value, _ = _parse_literal(tokens, i + 2)
+            except (_NotLiteral, IndexError, TypeError):
+                continue
+            return value
+    return None
+
+
+def _call_arguments(tokens: List[Token], i: int) -> List[Tuple[int, int]]:
+    """Token ranges of the arguments of the call whose '(' is at token i"""
+    args = []
+    depth = 0
+    begin = i + 1
+    for j in range(i, len(tokens)):
+        value = tokens[j].value
+        if value in ('(', '[', '{'):
+            depth += 1
+        elif value in (')', ']', '}'):
+            depth -= 1
+            if depth == 0:
+                if begin < j:
+                    args.append((begin, j))
+                return args
+        elif value == ',' and depth == 1:
+            args.append((begin, j))
+            begin = j + 1
+    return args
+
+
+def _argument_table(tokens: List[Token], blocks: BlockMap, loop: int,
+                    name: Optional[str]) -> Optional[Dict[Any, Any]]:
+    """Resolve a table that reaches the VM function as a parameter"""
+    block = blocks.block_of[loop]
+    while block > 0:
+        func = blocks.owner[block]
+        block = blocks.parent[block]
+        if tokens[func].value != 'function' or func not in blocks.body:
+            continue
+        params = [tok.value for tok in tokens[func + 1:blocks.body[func]] if tok.kind == 'name']
+        if tokens[func + 1].kind == 'name':
+            callee, params = params[0], params[1:]
+        else:
+            callee = None
+        if name not in params:
+            return None
+        position = params.index(name)
+
+        # Call sites: `callee(...)` or an immediately invoked `(function ... end)(...)`
+        calls = []
+        end = blocks.closer.get(func, len(tokens) - 1)
+        if end + 2 < len(tokens) and tokens[end + 1].value == ')' and tokens[end + 2].value == '(':
+            calls.append(end + 2)
+        if callee:
+            calls.extend(j + 1 for j in range(len(tokens) - 1)
+                         if tokens[j].value == callee and tokens[j + 1].value == '(' and j != func + 1)
+        for call in calls:
+            args = _call_arguments(tokens, call)
+            if position >= len(args):
+                continue
+            start, stop = args[position]
+            try:
+                if tokens[start].value == '{':
+                    return _parse_literal(tokens, start)[0]
+            except (_NotLiteral, IndexError, TypeError):
+                continue
+            if stop - start == 1 and tokens[start].kind == 'name':
+                table = find_table(tokens, tokens[start].value)
+                if table is not None:
+                    return table
+        return None
+    return None
+
+
+def _resolve_table(tokens: List[Token], blocks: BlockMap, loop: int,
+                   name: Optional[str]) -> Optional[Dict[Any, Any]]:
+    table = find_table(tokens, name)
+    return table if table is not None else _argument_table(tokens, blocks, loop, name)
+
+
+def records_from_bytes(data: bytes, vm: VirtualMachine) -> List[Dict[Any, Any]]:
+    """Split a decoded payload into fixed-width instruction records (opcode first)"""
+    width = vm.operand_width
+    return [{k + 1: data[pos + k] for k in range(width)}
+            for pos in range(0, len(data) - width + 1, width)]
+
+
+# ------------------------------------------------------------------ lifting
+
+_BINARY_OPERATORS = frozenset({'=', '==', '~=', '<', '>', '<=', '>=', '+', '-', '*', '/', '//',
+                               '%', '^', '..', 'and', 'or', '&', '|', '~', '<<', '>>'})
+
+
+def lua_literal(value: Any) -> str:
+    """Render a Python constant as Lua source"""
+    if value is None:
+        return 'nil'
+    if value is True or value is False:
+        return 'true' if value else 'false'
+    if isinstance(value, float):
+        if value.is_integer() and abs(value) < 2 ** 53:
+            return f"{value:.1f}"
+        return repr(value) if math.isfinite(value) else ('(1/0)' if value > 0 else '(-1/0)' if value < 0 else '(0/0)')
+    if isinstance(value, int):
+        return str(value)
+    if isinstance(value, str):
+        return encode_string_literal(value.encode('utf-8', errors='surrogateescape'))
+    return '{...}'
+
+
+def _join(pieces: List[str]) -> str:
+    """Join rendered tokens with conventional Lua spacing"""
+    out = []
+    prev = ''
+    last_unary = False
+    for piece in pieces:
+        if out:
+            unary = piece in ('-', 'not', '#') and (prev in _BINARY_OPERATORS or prev in ('(', '[', '{', ',', 'return'))
+            if prev == ',' or (piece in _BINARY_OPERATORS and not unary) or (
+                    prev in _BINARY_OPERATORS and not (prev in ('-', '#') and last_unary)):
+                out.append(' ')
+            elif (prev[-1:].isalnum() or prev[-1:] in '_"') and (piece[:1].isalnum() or piece[:1] in '_"'):
+                out.append(' ')
+            last_unary = unary
+        else:
+            last_unary = piece in ('-', 'not', '#')
+        out.append(piece)
+        prev = piece
+    return ''.join(out)
+
+
+class _Lifter:
+    """Instantiates handlers for concrete instructions in one linear pass"""
+
+    def __init__(self, vm: VirtualMachine, constants: Optional[Dict[Any, Any]]):
+        self.vm = vm
+        self.constants = constants
+        self.registers: set = set()
+        self.index = 0
+        self.instruction: Dict[Any, Any] = {}
+
+    def operand(self, field: str) -> Any:
+        key = _field_key(field)
+        if key not in self.instruction:
+            raise Unliftable(f"missing operand {field}")
+        return self.instruction[key]
+
+    def constant(self, index: Any) -> Any:
+        if self.constants is None or index not in self.constants:
+            raise Unliftable(f"unknown constant {index}")
+        return self.constants[index]
+
+    def number(self, values: Sequence[str], env: Dict[str, Any]) -> int:
+        """Fold an operand expression (sums and products of integers) to an int"""
+        terms: List[List[Any]] = [[1, 1]]
+        expect_value = True
+        i = 0
+        while i < len(values):
+            value = values[i]
+            if expect_value:
+                sign = 1
+                while value in ('-', '+'):
+                    sign = -sign if value == '-' else sign
+                    i += 1
+                    value = values[i] if i < len(values) else ''
+                if value.startswith('$'):
+                    number = self.operand(value[1:])
+                elif value == PC:
+                    number = self.pc_value
+                elif value in env:
+                    number = env[value]
+                else:
+                    number = parse_number(value) if value[:1].isdigit() else None
+                if not isinstance(number, (int, float)) or isinstance(number, bool):
+                    raise Unliftable(f"not an operand expression: {' '.join(values)}")
+                terms[-1][1] *= sign * number
+            elif value in ('+', '-'):
+                terms.append([1 if value == '+' else -1, 1])
+            elif value != '*':
+                raise Unliftable(f"not an operand expression: {' '.join(values)}")
+            expect_value = not expect_value
+            i += 1
+        if expect_value:
+            raise Unliftable("truncated operand expression")
+        total = sum(sign * product for sign, product in terms)
+        return int(total) if float(total).is_integer() else total
+
+    @property
+    def pc_value(self) -> int:
+        return self.index + 1 if self.vm.pc_mode == 'pre' else self.index
+
+    def register(self, n: Any) -> str:
+        if not isinstance(n, int) or n < 0:
+            raise Unliftable(f"bad register {n}")
+        self.registers.add(n)
+        return f"r{n}"
+
+    def key(self, values: Sequence[str], env: Dict[str, Any]) -> Any:
+        """Value of a constant-pool or operand reference"""
+        if values[:2] == [CONSTANTS, '['] and _matching(values, 1) == len(values) - 1:
+            return self.constant(self.number(values[2:-1], env))
+        if len(values) == 1 and values[0].startswith('$'):
+            return self.operand(values[0][1:])
+        raise Unliftable(f"not a constant: {' '.join(values)}")
+
+    def render(self, values: Sequence[str], env: Dict[str, Any]) -> List[str]:
+        """Substitute operands, registers and constants into a token list"""
+        out: List[str] = []
+        i = 0
+        while i < len(values):
+            value = values[i]
+            nxt = values[i + 1] if i + 1 < len(values) else ''
+            if value in (STACK, CONSTANTS, ENV) and nxt == '[':
+                close = _matching(values, i + 1)
+                inner = values[i + 2:close]
+                if value == STACK:
+                    out.append(self.register(self.number(inner, env)))
+                elif value == CONSTANTS:
+                    out.append(lua_literal(self.constant(self.number(inner, env))))
+                else:
+                    name = self.key(inner, env)
+                    if isinstance(name, str) and _is_name(name):
+                        out.append(name)
+                    else:
+                        out.extend(['_ENV', '[', lua_literal(name), ']'])
+                i = close + 1
+                continue
+            if value in ('unpack', 'table') and self._is_unpack(values, i):
+                i = self._render_unpack(values, i, env, out)
+                continue
+            if value.startswith('$'):
+                out.append(lua_literal(self.operand(value[1:])))
+            elif value == PC:
+                out.append(str(self.pc_value))
+            elif value in env and _is_name(value) and (not out or out[-1] not in ('.', ':')):
+                out.append(lua_literal(env[value]))
+            elif value == ENV:
+                out.append('_ENV')
+            elif value.startswith('@'):
+                raise Unliftable(f"role {value} used as a value")
+            else:
+                out.append(value)
+            i += 1
+        return out
+
+    @staticmethod
+    def _is_unpack(values: Sequence[str], i: int) -> bool:
+        if values[i] == 'table':
+            if values[i + 1:i + 3] != ['.', 'unpack']:
+                return False
+            i += 2
+        return values[i + 1:i + 4] == ['(', STACK, ',']
+
+    def _render_unpack(self, values: Sequence[str], i: int, env: Dict[str, Any],
+                       out: List[str]) -> int:
+        """unpack(stack, a, b) -> ra, ..., rb"""
+        if values[i] == 'table':
+            i += 2
+        close = _matching(values, i + 1)
+        args, depth, current = [], 0, []
+        for value in values[i + 4:close]:
+            if value in ('(', '[', '{'):
+                depth += 1
+            elif value in (')', ']', '}'):
+                depth -= 1
+            if value == ',' and depth == 0:
+                args.append(current)
+                current = []
+            else:
+                current.append(value)
+        args.append(current)
+        if len(args) != 2:
+            raise Unliftable("open-ended unpack")
+        first, last = (self.number(arg, env) for arg in args)
+        for n in range(first, last + 1):
+            if n > first:
+                out.append(',')
+            out.append(self.register(n))
+        return close + 1
+
+    def jump(self, values: Sequence[str], env: Dict[str, Any]) -> int:
+        written = self.number(values, env)
+        return written + 1 if self.vm.pc_mode == 'post' else written
+
+    def block(self, statements: List[tuple], env: Dict[str, Any], nodes: List[list]) -> bool:
+        """Lift a handler's statements into nodes; returns False when control cannot fall through"""
+        for entry in statements:
+            if entry[0] == 'if':
+                arms = []
+                for cond, arm in entry[1]:
+                    arm_nodes: List[list] = []
+                    self.block(arm, dict(env), arm_nodes)
+                    arms.append([_join(self.render(cond, env)), arm_nodes])
+                otherwise = None
+                if entry[2] is not None:
+                    otherwise = []
+                    self.block(entry[2], dict(env), otherwise)
+                nodes.append(['if', arms, otherwise])
+                continue
+
+            values = entry[1]
+            if values[:1] == ['local'] and len(values) >= 4 and values[2] == '=' and _is_name(values[1]):
+                try:
+                    env[values[1]] = self.number(values[3:], env)
+                    continue
+                except Unliftable:
+                    pass
+            if values[:2] == [PC, '=']:
+                nodes.append(['jump', self.jump(values[2:], env)])
+                return False
+            if values in ([HALT, '=', 'false'], ['break']):
+                nodes.append(['line', 'do return end'])
+                return False
+            text = _join(self.render(values, env))
+            if values[0] == 'return':
+                text = f"do {text} end"
+            nodes.append(['line', text])
+        return True
+
+    def lift(self, instructions: Sequence[Dict[Any, Any]]) -> LiftedProgram:
+        handlers = self.vm.handlers
+        dispatch = _field_key(self.vm.dispatch)
+        base = 1
+        per_instruction: List[Tuple[List[list], bool]] = []
+        lifted = unknown = 0
+        for offset, instruction in enumerate(instructions):
+            self.index = base + offset
+            self.instruction = instruction
+            opcode = instruction.get(dispatch)
+            handler = handlers.get(opcode)
+            nodes: List[list] = []
+            falls = True
+            if handler is None:
+                nodes.append(['line', f"-- [{self.index}] unknown opcode {opcode}"])
+                unknown += 1
+            else:
+                saved = set(self.registers)
+                try:
+                    body: List[list] = []
+                    falls = self.block(handler.statements, {}, body)
+                    if any(node[0] == 'line' and node[1].startswith('local ') for node in body):
+                        body = [['do', body]]
+                    nodes.extend(body)
+                    lifted += 1
+                except (Unliftable, IndexError, TypeError) as e:
+                    self.registers = saved
+                    falls = True
+                    operands = ', '.join(f"{lua_literal(v)}" for k, v in sorted(instruction.items(), key=str)
+                                         if k != dispatch)
+                    nodes.append(['line', f"-- [{self.index}] {handler.operation} {operands}  ({e})"])
+                    unknown += 1
+            per_instruction.append((nodes, falls))
+
+        out = [f"-- Devirtualized VM {self.vm.fingerprint[:12]}: "
+               f"{len(instructions)} instructions, {len(handlers)} handlers"]
+        if self.registers:
+            names = [f"r{n}" for n in sorted(self.registers)]
+            for k in range(0, len(names), 16):
+                out.append('local ' + ', '.join(names[k:k + 16]))
+        out.extend(_Structurer(per_instruction, base).lines())
+        return LiftedProgram('\n'.join(out) + '\n', len(instructions), lifted, unknown,
+                             len(self.registers))
+
+
+def _jumps(nodes: List[list]) -> Iterator[list]:
+    for node in nodes:
+        if node[0] == 'jump':
+            yield node
+        elif node[0] == 'do':
+            yield from _jumps(node[1])
+        elif node[0] == 'if':
+            for _, arm in node[1]:
+                yield from _jumps(arm)
+            if node[2] is not None:
+                yield from _jumps(node[2])
+
+
+def _texts(nodes: List[list]) -> Iterator[str]:
+    """Statement and condition texts of a node list"""
+    for node in nodes:
+        if node[0] == 'line':
+            yield node[1]
+        elif node[0] == 'do':
+            yield from _texts(node[1])
+        elif node[0] == 'if':
+            for cond, arm in node[1]:
+                yield cond
+                yield from _texts(arm)
+            if node[2] is not None:
+                yield from _texts(node[2])
+
+
+def _falls(nodes: List[list]) -> bool:
+    """Can control run off the end of a node list?"""
+    if not nodes:
+        return True
+    last = nodes[-1]
+    if last[0] == 'jump' or last == ['line', 'do return end']:
+        return False
+    if last[0] == 'do':
+        return _falls(last[1])
+    if last[0] == 'if':
+        return last[2] is None or _falls(last[2]) or any(_falls(arm) for _, arm in last[1])
+    return True
+
+
+def _sink(nodes: List[list]) -> None:
+    """Move a trailing jump into the arms of the statement before it, so every
+    jump ends its path and can become a break or vanish into fall-through"""
+    while len(nodes) >= 2 and nodes[-1][0] == 'jump' and nodes[-2][0] in ('if', 'do'):
+        jump = nodes.pop()
+        last = nodes[-1]
+        if last[0] == 'do':
+            last[1].append(jump)
+            _sink(last[1])
+            return
+        for _, arm in last[1]:
+            if _falls(arm):
+                arm.append(list(jump))
+                _sink(arm)
+        if last[2] is None:
+            last[2] = [jump]
+        elif _falls(last[2]):
+            last[2].append(jump)
+            _sink(last[2])
+        return
+
+
+class _Unstructured(Exception):
+    """The jumps do not nest into loops and breaks"""
+
+
+class _Structurer:
+    """Lays lifted instructions out as Lua 5.1 / Luau control flow.
+
+    Basic blocks stay in instruction order. A backward jump makes its
+    target the head of a `while true do ... end` loop; a forward jump that
+    cannot simply fall through becomes a `break` out of the loop or out of
+    a `repeat ... until true` wrapped around its sources. Flow that does not
+    nest that way (a jump into the middle of a loop, a break across two
+    levels, a `continue`) is lowered to a dispatch loop over the blocks.
+    """
+
+    def __init__(self, per_instruction: List[Tuple[List[list], bool]], base: int):
+        end = base + len(per_instruction)
+        leaders = {base}
+        for offset, (nodes, falls) in enumerate(per_instruction):
+            jumps = list(_jumps(nodes))
+            leaders.update(jump[1] for jump in jumps if base <= jump[1] < end)
+            if jumps or not falls:
+                leaders.add(base + offset + 1)
+        starts = sorted(k for k in leaders if k < end)
+        self.blocks: List[List[list]] = []
+        for n, start in enumerate(starts):
+            stop = starts[n + 1] if n + 1 < len(starts) else end
+            nodes = [node for nodes, _ in per_instruction[start - base:stop - base] for node in nodes]
+            if per_instruction[stop - base - 1][1]:
+                nodes.append(['jump', stop])                # fall-through made explicit
+            _sink(nodes)
+            self.blocks.append(nodes)
+        block_at = {start: n for n, start in enumerate(starts)}
+        jumps = [jump for nodes in self.blocks for jump in _jumps(nodes)]
+        for jump in jumps:
+            jump.append(block_at[jump[1]] if base <= jump[1] < end else len(starts))
+
+        # Thread jumps through blocks that only jump on, then drop unreachable blocks
+        onward = {n: nodes[0][2] for n, nodes in enumerate(self.blocks)
+                  if len(nodes) == 1 and nodes[0][0] == 'jump'}
+        for jump in jumps:
+            seen = set()
+            while jump[2] in onward and jump[2] not in seen:
+                seen.add(jump[2])
+                jump[2] = onward[jump[2]]
+        live = {0}
+        work = [0]
+        while work:
+            for jump in _jumps(self.blocks[work.pop()]):
+                if jump[2] < len(starts) and jump[2] not in live:
+                    live.add(jump[2])
+                    work.append(jump[2])
+        kept = sorted(live)
+        renumber = {n: k for k, n in enumerate(kept)}
+        renumber[len(starts)] = len(kept)
+        for n in kept:
+            for jump in _jumps(self.blocks[n]):
+                jump[2] = renumber[jump[2]]
+        self.starts = [starts[n] for n in kept]         # first instruction of each block
+        self.blocks = [self.blocks[n] for n in kept]
+        self.exit = len(kept)                               # block index standing for the end
+        self.stacks: List[List[Tuple[str, int, int]]] = []
+
+    # ------------------------------------------------------------------ layout
+
+    def _loops(self) -> Dict[int, int]:
+        """Loop head -> last block, from the backward jumps"""
+        loops: Dict[int, int] = {}
+        for n, nodes in enumerate(self.blocks):
+            for jump in _jumps(nodes):
+                target = jump[2]
+                if target <= n:
+                    loops[target] = max(loops.get(target, n), n)
+        for n, nodes in enumerate(self.blocks):
+            for jump in _jumps(nodes):
+                for head, last in loops.items():
+                    if head < jump[2] <= last and not head <= n <= last:
+                        raise _Unstructured("jump into the middle of a loop")
+        return loops
+
+    def _place(self, loops: Dict[int, int], repeats: Dict[int, int]) -> None:
+        """Nest the loops and repeat blocks and record the open ones per block"""
+        changed = True
+        while changed:
+            changed = False
+            for target, first in list(repeats.items()):
+                # A repeat block ending after a loop (or another block) it starts inside encloses it
+                for head, last in loops.items():
+                    if head < first <= last < target:
+                        first = head
+                for other, other_first in repeats.items():
+                    if other < target and other_first < first < other:
+                        first = other_first
+                if first != repeats[target]:
+                    repeats[target] = first
+                    changed = True
+
+        constructs = [('loop', head, last) for head, last in loops.items()]
+        constructs += [('repeat', first, target - 1) for target, first in repeats.items()]
+        # Outer first: earlier start, later end; a repeat block encloses a loop ending with it
+        constructs.sort(key=lambda c: (c[1], -c[2], c[0] == 'loop'))
+        stack: List[Tuple[str, int, int]] = []
+        self.stacks = []
+        opened = 0
+        for n in range(len(self.blocks)):
+            while stack and stack[-1][2] < n:
+                stack.pop()
+            while opened < len(constructs) and constructs[opened][1] == n:
+                construct = constructs[opened]
+                if stack and construct[2] > stack[-1][2]:
+                    raise _Unstructured("overlapping loops")
+                stack.append(construct)
+                opened += 1
+            self.stacks.append(list(stack))
+
+    @staticmethod
+    def _after(stack: List[Tuple[str, int, int]], n: int) -> int:
+        """Block reached by running off the end of block n"""
+        for kind, first, last in reversed(stack):
+            if last != n:
+                break
+            if kind == 'loop':
+                return first
+        return n + 1
+
+    def _lower(self, n: int, target: int, tail: bool) -> Optional[str]:
+        """Statement for a jump from block n, '' for plain fall-through, None if impossible"""
+        stack = self.stacks[n]
+        if tail and target == self._after(stack, n):
+            return ''
+        if stack:
+            kind, first, last = stack[-1]
+            reached = last + 1 if kind == 'repeat' else self._after(stack[:-1], last)
+            if reached == target:
+                return 'break'
+        if target == self.exit:
+            return 'do return end'
+        return None
+
+    def _jump_sites(self, nodes: List[list], tail: bool) -> Iterator[Tuple[list, bool]]:
+        for k, node in enumerate(nodes):
+            last = tail and k == len(nodes) - 1
+            if node[0] == 'jump':
+                yield node, last
+            elif node[0] == 'do':
+                yield from self._jump_sites(node[1], last)
+            elif node[0] == 'if':
+                for _, arm in node[1]:
+                    yield from self._jump_sites(arm, last)
+                if node[2] is not None:
+                    yield from self._jump_sites(node[2], last)
+
+    def layout(self) -> None:
+        loops = self._loops()
+        repeats: Dict[int, int] = {}
+        for _ in range(len(self.blocks) + 1):
+            self._place(loops, repeats)
+            missing = False
+            for n, nodes in enumerate(self.blocks):
+                for jump, tail in self._jump_sites(nodes, True):
+                    target = jump[2]
+                    if self._lower(n, target, tail) is not None:
+                        continue
+                    if target <= n or repeats.get(target, n + 1) <= n:
+                        raise _Unstructured("jump needs a continue or a multi-level break")
+                    repeats[target] = n
+                    missing = True
+            if not missing:
+                return
+        raise _Unstructured("layout did not settle")
+
+    # --------------------------------------------------------------- rendering
+
+    def _render(self, nodes: List[list], indent: str, tail: bool, jump_text, out: List[str],
+                top: bool = True) -> None:
+        for k, node in enumerate(nodes):
+            last = tail and k == len(nodes) - 1
+            kind = node[0]
+            if kind == 'line':
+                out.append(indent + node[1])
+            elif kind == 'jump':
+                out.extend(indent + line for line in jump_text(node, last, top))
+            elif kind == 'do':
+                out.append(f"{indent}do")
+                self._render(node[1], indent + '    ', last, jump_text, out, False)
+                out.append(f"{indent}end")
+            else:
+                arms = []
+                for cond, arm in node[1]:
+                    lines: List[str] = []
+                    self._render(arm, indent + '    ', last, jump_text, lines, False)
+                    arms.append((cond, lines))
+                otherwise: List[str] = []
+                if node[2] is not None:
+                    self._render(node[2], indent + '    ', last, jump_text, otherwise, False)
+                if len(arms) == 1 and not arms[0][1] and otherwise:
+                    arms, otherwise = [(f"not ({arms[0][0]})", otherwise)], []
+                for n, (cond, lines) in enumerate(arms):
+                    out.append(f"{indent}{'if' if n == 0 else 'elseif'} {cond} then")
+                    out.extend(lines)
+                if otherwise:
+                    out.append(f"{indent}else")
+                    out.extend(otherwise)
+                out.append(f"{indent}end")
+
+    def structured(self) -> List[str]:
+        self.layout()
+        out: List[str] = []
+        depth = 0
+        for n, nodes in enumerate(self.blocks):
+            previous = self.stacks[n - 1] if n else []
+            stack = self.stacks[n]
+            shared = 0
+            while shared < min(len(previous), len(stack)) and previous[shared] == stack[shared]:
+                shared += 1
+            for construct in reversed(previous[shared:]):
+                depth -= 1
+                out.append('    ' * depth + ('end' if construct[0] == 'loop' else 'until true'))
+            for construct in stack[shared:]:
+                out.append('    ' * depth + ('while true do' if construct[0] == 'loop' else 'repeat'))
+                depth += 1
+
+            def jump_text(jump: list, tail: bool, top: bool, n: int = n) -> List[str]:
+                text = self._lower(n, jump[2], tail)
+                if text == 'break' and top:
+                    text = 'do break end'        # Lua 5.1 wants break last in its block
+                return [text] if text else []
+
+            indent = '    ' * depth
+            self._render(nodes, indent, True, jump_text, out)
+        for construct in reversed(self.stacks[-1] if self.stacks else []):
+            depth -= 1
+            out.append('    ' * depth + ('end' if construct[0] == 'loop' else 'until true'))
+        return out
+
+    def dispatched(self) -> List[str]:
+        """Fallback: a loop dispatching on the current block"""
+        starts = self.starts
+        pc = 'pc'
+        while any(re.search(rf'\b{pc}\b', text) for nodes in self.blocks for text in _texts(nodes)):
+            pc += '_'
+        out = [f"local {pc} = {starts[0]}", "while true do"]
+        for n, nodes in enumerate(self.blocks):
+            nested = any(not tail for _, tail in self._jump_sites(nodes, True))
+
+            def jump_text(jump: list, tail: bool, top: bool) -> List[str]:
+                if jump[2] == self.exit:
+                    return ['do return end']
+                return [f"{pc} = {starts[jump[2]]}"] + ([] if tail else ['break'])
+
+            out.append(f"    {'if' if n == 0 else 'elseif'} {pc} == {starts[n]} then")
+            if nested:
+                out.append("        repeat")
+            lines: List[str] = []
+            self._render(nodes, '            ' if nested else '        ', True, jump_text, lines)
+            out.extend(lines)
+            if nested:
+                out.append("        until true")
+        out.append("    end")
+        out.append("end")
+        return out
+
+    def lines(self) -> List[str]:
+        if not self.blocks:
+            return []
+        try:
+            return self.structured()
+        except _Unstructured:
+            return self.dispatched()
+
+
+def lift(vm: VirtualMachine, instructions: Sequence[Dict[Any, Any]],
+         constants: Optional[Dict[Any, Any]] = None) -> LiftedProgram:
+    """Lift a decoded instruction stream back to Lua source"""
+    return _Lifter(vm, constants).lift(instructions)
+
+
+def devirtualize(code: str, payload: Optional[bytes] = None
+                 ) -> Tuple[Optional[VirtualMachine], Optional[LiftedProgram]]:
+    """Recover the VM of a script and lift its instruction stream.
+
+    Instructions come from a literal table assigned to the VM's code table
+    or, failing that, from payload (a decoded bytecode string) split into
+    fixed-width records.
+    """
+    tokens = tokenize(code)
+    blocks = match_blocks(tokens)
+    located = locate_vm(tokens, blocks)
+    if located is None:
+        return None, None
+    loop, vm = located
+
+    table = _resolve_table(tokens, blocks, loop, vm.roles.get('code'))
+    if isinstance(table, dict) and table and all(isinstance(v, dict) for v in table.values()):
+        instructions = [table[k] for k in sorted(k for k in table if isinstance(k, int))]
+    elif payload:
+        instructions = records_from_bytes(payload, vm)
+    else:
+        return vm, None
+    constants = _resolve_table(tokens, blocks, loop, vm.roles.get('constants'))
+    return vm, lift(vm, instructions, constants)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description='Lua Devirtualizer - Lift VM-protected Lua back to source')
+    parser.add_argument('input_file', help='VM-obfuscated Lua file')
+    parser.add_argument('-m', '--map', action='store_true', help='Only print the recovered opcode map')
+    args = parser.parse_args(argv)
+
+    try:
+        with open(args.input_file, 'rb') as f:
+            code = f.read().decode('utf-8', errors='ignore')
+    except OSError as e:
+        print(f"Error loading file: {e}")
+        return 1
+
+    vm, program = devirtualize(code)
+    if vm is None:
+        print("No VM dispatch loop found")
+        return 1
+    print(f"-- VM {vm.fingerprint[:12]}: {len(vm.handlers)} handlers, pc {vm.pc_mode}-incremented")
+    for opcode, handler in sorted(vm.handlers.items()):
+        print(f"--   {opcode:4d} {handler.operation:<10} {handler.pattern}")
+    if args.map:
+        return 0
+    if program is None:
+        print("-- Instruction stream not found")
+        return 1
+    print(program.source, end='')
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
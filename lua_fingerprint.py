@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+"""
+Lua Fingerprint - Per-build cache of learned obfuscator runtime parameters
+Fingerprints the runtime prologue of a protected script (the tokens before
+its payload string) with a normalised structural hash: names become their
+order of first appearance and string literals a placeholder, so every
+sample of one obfuscator build hashes alike even when renamed. Parameters
+learned from the first sample of a build are kept in a local JSON cache:
+- Payload alphabet and additive (Caesar) cipher key
+- Decoder, loader and VM executor function names
+- The VM's opcode handlers (see lua_devirtualizer)
+Names and the alphabet are stored by position and resolved against each
+later sample, which then skips the learning phase entirely.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+from typing import Any, Dict, List, Optional, Tuple
+
+from lua_devirtualizer import VirtualMachine, locate_vm, remember_vm
+from lua_lexer import BlockMap, Token, decode_string_literal, match_blocks, tokenize
+
+PAYLOAD_MIN = 256          # shortest string literal treated as a payload
+PROLOGUE_TOKENS = 4096     # prologue cut-off when no payload string is found
+ALPHABET_MIN = 32          # shortest string of distinct characters taken as an alphabet
+MAX_CACHE_ENTRIES = 256
+CACHE_ENV = 'LUA_DEOBF_CACHE'
+
+_NAMED_ROLES = ('decoder', 'loader', 'executor')
+
+
+def default_cache_path() -> str:
+    """$LUA_DEOBF_CACHE, else fingerprints.json in the user cache directory"""
+    if os.environ.get(CACHE_ENV):
+        return os.environ[CACHE_ENV]
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'lua-deobfuscator', 'fingerprints.json')
+
+
+class SampleIndex:
+    """Token stream of one sample with the positional tables parameters refer to"""
+
+    __slots__ = ('tokens', 'blocks', 'names', 'name_order', 'strings', 'prologue', 'fingerprint')
+
+    def __init__(self, code: str):
+        self.tokens = tokenize(code)
+        self.blocks: Optional[BlockMap] = None
+        self.names: List[str] = []             # distinct names in order of first appearance
+        self.name_order: Dict[str, int] = {}
+        self.strings: List[int] = []           # token indices of string literals
+        self.prologue = len(self.tokens)
+        self.fingerprint = self._index()
+
+    def _index(self) -> str:
+        digest = hashlib.sha1()
+        limit = min(len(self.tokens), PROLOGUE_TOKENS)
+        for i, tok in enumerate(self.tokens):
+            if tok.kind == 'name':
+                if tok.value not in self.name_order:
+                    self.name_order[tok.value] = len(self.names)
+                    self.names.append(tok.value)
+                value = f'${self.name_order[tok.value]}'
+            elif tok.kind == 'string':
+                self.strings.append(i)
+                if len(tok.value) >= PAYLOAD_MIN and i < self.prologue:
+                    self.prologue = i
+                value = '"'
+            else:
+                value = tok.value
+            if i < self.prologue and i < limit:
+                digest.update(value.encode('utf-8', errors='surrogateescape'))
+                digest.update(b'\0')
+        self.prologue = min(self.prologue, limit)
+        return digest.hexdigest()
+
+    def block_map(self) -> BlockMap:
+        if self.blocks is None:
+            self.blocks = match_blocks(self.tokens)
+        return self.blocks
+
+    def string_value(self, i: int) -> str:
+        return decode_string_literal(self.tokens[i].value).decode('latin-1')
+
+
+class BuildParameters:
+    """Decoder parameters of one obfuscator build, learned or recalled from the cache"""
+
+    __slots__ = ('fingerprint', 'cached', 'alphabet', 'cipher_key', 'decoder', 'loader',
+                 'executor', 'vm', 'payload')
+
+    def __init__(self, fingerprint: str):
+        self.fingerprint = fingerprint
+        self.cached = False
+        self.alphabet: Optional[str] = None
+        self.cipher_key = 0
+        self.decoder: Optional[str] = None
+        self.loader: Optional[str] = None
+        self.executor: Optional[str] = None
+        self.vm: Optional[VirtualMachine] = None
+        self.payload: Optional[str] = None     # this sample's encoded payload (never cached)
+
+    @property
+    def learned(self) -> bool:
+        return bool(self.decoder or self.vm or self.alphabet)
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            'fingerprint': self.fingerprint,
+            'cached': self.cached,
+            'alphabet': self.alphabet,
+            'cipher_key': self.cipher_key,
+            'decoder': self.decoder,
+            'loader': self.loader,
+            'executor': self.executor,
+            'opcode_map': self.vm.summary()['opcode_map'] if self.vm else None,
+        }
+
+    def to_entry(self, index: SampleIndex) -> Dict[str, Any]:
+        """Cache entry with names and the alphabet stored by position"""
+        entry: Dict[str, Any] = {role: index.name_order.get(getattr(self, role)) for role in _NAMED_ROLES}
+        entry['alphabet'] = None
+        if self.alphabet is not None:
+            entry['alphabet'] = next((n for n, i in enumerate(index.strings)
+                                      if index.string_value(i) == self.alphabet), None)
+        entry['cipher_key'] = self.cipher_key
+        entry['vm'] = self.vm.as_dict() if self.vm else None
+        return entry
+
+    @classmethod
+    def from_entry(cls, entry: Dict[str, Any], index: SampleIndex) -> Optional['BuildParameters']:
+        """Resolve a cache entry against a sample; None when it does not fit"""
+        params = cls(index.fingerprint)
+        params.cached = True
+        try:
+            for role in _NAMED_ROLES:
+                if entry.get(role) is not None:
+                    setattr(params, role, index.names[entry[role]])
+            if entry.get('alphabet') is not None:
+                params.alphabet = index.string_value(index.strings[entry['alphabet']])
+            params.cipher_key = int(entry.get('cipher_key') or 0)
+            if entry.get('vm'):
+                params.vm = VirtualMachine.from_dict(entry['vm'])
+        except (IndexError, KeyError, TypeError, ValueError):
+            return None
+        if params.alphabet is not None and len(set(params.alphabet)) != len(params.alphabet):
+            return None
+        return params
+
+
+class FingerprintCache:
+    """Learned parameters keyed by prologue fingerprint, persisted as JSON"""
+
+    __slots__ = ('path', '_entries')
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or default_cache_path()
+        self._entries: Optional[Dict[str, Dict[str, Any]]] = None
+
+    @property
+    def entries(self) -> Dict[str, Dict[str, Any]]:
+        if self._entries is None:
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                self._entries = data if isinstance(data, dict) else {}
+            except (OSError, ValueError):
+                self._entries = {}
+        return self._entries
+
+    def get(self, fingerprint: str) -> Optional[Dict[str, Any]]:
+        return self.entries.get(fingerprint)
+
+    def put(self, fingerprint: str, entry: Dict[str, Any]) -> bool:
+        """Store an entry (evicting the oldest beyond MAX_CACHE_ENTRIES) and save"""
+        entries = self.entries
+        entries.pop(fingerprint, None)
+        entries[fingerprint] = entry
+        while len(entries) > MAX_CACHE_ENTRIES:
+            del entries[next(iter(entries))]
+        return self.save()
+
+    def save(self) -> bool:
+        temporary = f'{self.path}.{os.getpid()}.tmp'
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(temporary, 'w', encoding='utf-8') as f:
+                json.dump(self.entries, f)
+            os.replace(temporary, self.path)
+            return True
+        except OSError:
+            return False
+
+
+# ------------------------------------------------------------------ learning
+
+def _payload_call(index: SampleIndex, decoder: Optional[str] = None) -> Optional[Tuple[int, int]]:
+    """(callee token, string token) of the call passing the longest payload-sized string"""
+    tokens = index.tokens
+    best: Optional[Tuple[int, int]] = None
+    for i in index.strings:
+        if len(tokens[i].value) < PAYLOAD_MIN:
+            continue
+        callee = i - 1
+        if tokens[callee].value == '(' and i + 1 < len(tokens) and tokens[i + 1].value == ')':
+            callee -= 1
+        if callee < 0 or tokens[callee].kind != 'name':
+            continue
+        if decoder is not None and tokens[callee].value != decoder:
+            continue
+        if best is None or len(tokens[i].value) > len(tokens[best[1]].value):
+            best = (callee, i)
+    return best
+
+
+def _function_name(tokens: List[Token], function: int) -> Optional[str]:
+    """Name bound by `[local] function NAME(` or `[local] NAME = function(`"""
+    if function + 2 < len(tokens) and tokens[function + 1].kind == 'name' and tokens[function + 2].value == '(':
+        return tokens[function + 1].value
+    if function >= 2 and tokens[function - 1].value == '=' and tokens[function - 2].kind == 'name':
+        if function < 3 or tokens[function - 3].value not in ('.', ':'):
+            return tokens[function - 2].value
+    return None
+
+
+def _enclosing_function(blocks: BlockMap, tokens: List[Token], i: int) -> Optional[int]:
+    block = blocks.block_of[i]
+    while block > 0:
+        owner = blocks.owner[block]
+        if tokens[owner].value == 'function':
+            return owner
+        block = blocks.parent[block]
+    return None
+
+
+def _find_loader(tokens: List[Token], callee: int) -> Optional[str]:
+    # loader(decoder(...)) or local v = decoder(...) ... loader(v)
+    if callee >= 2 and tokens[callee - 1].value == '(' and tokens[callee - 2].kind == 'name':
+        return tokens[callee - 2].value
+    if callee >= 2 and tokens[callee - 1].value == '=' and tokens[callee - 2].kind == 'name':
+        variable = tokens[callee - 2].value
+        for j in range(callee + 1, len(tokens) - 2):
+            if (tokens[j].kind == 'name' and tokens[j + 1].value == '('
+                    and tokens[j + 2].value == variable):
+                return tokens[j].value
+    return None
+
+
+def _find_cipher_key(tokens: List[Token], start: int, end: int) -> int:
+    """Additive key of a `(x - K) % 256` / `(x + K) % 256` byte shift in the decoder"""
+    for j in range(start, end - 4):
+        sign, number, close, modulo, base = tokens[j:j + 5]
+        if (sign.value in ('+', '-') and number.kind == 'number' and close.value == ')'
+                and modulo.value == '%' and base.kind == 'number'):
+            try:
+                key, width = int(number.value, 0), int(base.value, 0)
+            except ValueError:
+                continue
+            if width == 256:
+                return key % 256 if sign.value == '-' else -key % 256
+    return 0
+
+
+def _find_alphabet(index: SampleIndex, payload: Optional[str]) -> Optional[str]:
+    """Longest prologue string of distinct characters that covers the payload"""
+    needed = set(payload) - {'_'} if payload else set()
+    best: Optional[str] = None
+    for i in index.strings:
+        if i >= index.prologue:
+            break
+        if len(index.tokens[i].value) < ALPHABET_MIN + 2:
+            continue
+        value = index.string_value(i)
+        if len(set(value)) == len(value) and needed <= set(value):
+            if best is None or len(value) > len(best):
+                best = value
+    return best
+
+
+def learn(index: SampleIndex) -> BuildParameters:
+    """Learning phase: recover the build's decoder parameters from one sample"""
+    tokens = index.tokens
+    params = BuildParameters(index.fingerprint)
+    blocks = index.block_map()
+
+    # Step 1: decoder and loader, from the call carrying the payload
+    call = _payload_call(index)
+    if call is not None:
+        callee, payload = call
+        params.decoder = tokens[callee].value
+        params.payload = index.string_value(payload)
+        params.loader = _find_loader(tokens, callee)
+
+    # Step 2: cipher key, from the decoder's own body
+    if params.decoder is not None:
+        for i, tok in enumerate(tokens):
+            if tok.value == 'function' and i in blocks.closer and _function_name(tokens, i) == params.decoder:
+                params.cipher_key = _find_cipher_key(tokens, i, blocks.closer[i])
+                break
+
+    # Step 3: alphabet
+    params.alphabet = _find_alphabet(index, params.payload)
+
+    # Step 4: the VM and the function running its dispatch loop
+    located = locate_vm(tokens, blocks)
+    if located is not None:
+        loop, params.vm = located
+        function = _enclosing_function(blocks, tokens, loop)
+        if function is not None:
+            params.executor = _function_name(tokens, function)
+    return params
+
+
+def resolve_build(code: str, cache: Optional[FingerprintCache] = None) -> BuildParameters:
+    """Parameters for the sample's build: from the cache on a hit, learned (and stored) otherwise"""
+    index = SampleIndex(code)
+    entry = cache.get(index.fingerprint) if cache is not None else None
+    params = BuildParameters.from_entry(entry, index) if entry else None
+    if params is None:
+        params = learn(index)
+        if cache is not None and params.learned:
+            cache.put(index.fingerprint, params.to_entry(index))
+    else:
+        if params.decoder is not None:
+            call = _payload_call(index, params.decoder)
+            if call is not None:
+                params.payload = index.string_value(call[1])
+        if params.vm is not None:
+            remember_vm(params.vm)
+    return params
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description='Lua Fingerprint - Learn or recall per-build decoder parameters')
+    parser.add_argument('input_files', nargs='+', help='Protected Lua files')
+    parser.add_argument('-c', '--cache', help=f'Cache file (default: ${CACHE_ENV} or the user cache directory)')
+    parser.add_argument('-n', '--no-cache', action='store_true', help='Learn every sample from scratch')
+    args = parser.parse_args(argv)
+
+    cache = None if args.no_cache else FingerprintCache(args.cache)
+    status = 0
+    for filename in args.input_files:
+        try:
+            with open(filename, 'rb') as f:
+                code = f.read().decode('utf-8', errors='ignore')
+        except OSError as e:
+            print(f"Error loading file: {e}")
+            status = 1
+            continue
+        params = resolve_build(code, cache)
+        print(json.dumps(dict(file=filename, **params.summary())))
+    return status
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""
+Lua Format - Streaming pretty-printer shared by the deobfuscation tools
+Re-flows Lua source driven by the token stream rather than input lines:
+- One statement per line, indented by block depth
+- Minified payloads packed on a single multi-megabyte line are split
+  into statements; over-long expressions wrap after ',' / '..' / and / or
+- Comments and single blank lines between statements are kept
+The printer makes one pass over a lazy token stream and only keeps a
+small record per open block plus the line being built, so memory does
+not grow with the length of the input line.
+"""
+
+import argparse
+import sys
+from typing import Iterator, List, Optional
+
+from lua_lexer import Token, iter_tokens
+
+INDENT = '  '
+MAX_WIDTH = 120
+
+_STATEMENT_KEYWORDS = frozenset({'local', 'if', 'while', 'for', 'return', 'do', 'function',
+                                 'repeat', 'goto', 'break'})
+_EXPRESSION_END = frozenset({')', ']', '}', 'end', 'true', 'false', 'nil', '...', 'break'})
+_BINARY_OPERATORS = frozenset({'=', '==', '~=', '<', '>', '<=', '>=', '+', '-', '*', '/', '//',
+                               '%', '^', '..', 'and', 'or', '&', '|', '~', '<<', '>>', '->', '::',
+                               '+=', '-=', '*=', '/=', '//=', '%=', '^=', '..='})
+_UNARY_OPERATORS = frozenset({'-', '#', '~', 'not'})
+_WRAP_AFTER = frozenset({',', '..', 'and', 'or'})
+_OPEN = frozenset({'(', '[', '{'})
+_CLOSE = frozenset({')', ']', '}'})
+_NO_SPACE_BEFORE = frozenset({')', ']', '}', ',', ';', '.', ':', '?'})
+_NO_SPACE_AFTER = frozenset({'(', '[', '{', '.', ':', '@'})
+
+
+def _ends_expression(tok: Token) -> bool:
+    return tok.kind in ('name', 'number', 'string', 'label') or tok.value in _EXPRESSION_END
+
+
+def _wordlike(text: str) -> bool:
+    return text[:1].isalnum() or text[:1] in '_"\''
+
+
+class _Level:
+    """Per-block printer state: one record per open block"""
+
+    __slots__ = ('depth', 'loops', 'if_then', 'if_else')
+
+    def __init__(self):
+        self.depth = 0     # bracket depth inside this block
+        self.loops = 0     # while/for headers still waiting for their 'do'
+        self.if_then = 0   # Luau if-expressions waiting for 'then'
+        self.if_else = 0   # Luau if-expressions waiting for 'else'
+
+
+class _Printer:
+    """Token-driven line builder; finished lines collect in `ready`"""
+
+    def __init__(self, indent: str, width: int):
+        self.indent = indent
+        self.width = width
+        self.levels: List[_Level] = [_Level()]
+        self.ready: List[str] = []
+        self.pieces: List[str] = []
+        self.length = 0
+        self.continued = False     # current line continues the previous statement
+        self.prev: Optional[Token] = None
+        self.prev_unary = False
+        self.last_line = 0
+        self.written = False       # at least one line has been produced
+        self.blank = False         # the last line produced was blank
+        self.params = -1           # bracket depth of a pending function parameter list
+        self.awaiting_params = False
+
+    def flush(self, continued: bool = False) -> None:
+        if self.pieces:
+            self.ready.append(''.join(self.pieces))
+            self.pieces = []
+            self.length = 0
+            self.written = True
+            self.blank = False
+        self.continued = continued
+
+    def separate(self, tok: Token) -> None:
+        # Keep (a single) blank line where the source had one
+        if self.written and not self.blank and tok.line > self.last_line + 1:
+            self.ready.append('')
+            self.blank = True
+
+    def append(self, text: str, space: bool) -> None:
+        if not self.pieces:
+            prefix = self.indent * (len(self.levels) - 1 + self.continued)
+            self.pieces.append(prefix)
+            self.length = len(prefix)
+        elif space:
+            self.pieces.append(' ')
+            self.length += 1
+        self.pieces.append(text)
+        self.length += len(text)
+
+    def start_statement(self, tok: Token) -> None:
+        self.flush()
+        self.separate(tok)
+
+    def open_block(self) -> None:
+        self.flush()
+        self.levels.append(_Level())
+
+    def close_block(self) -> None:
+        self.flush()
+        if len(self.levels) > 1:
+            self.levels.pop()
+
+    def space_before(self, tok: Token, unary: bool) -> bool:
+        prev = self.prev
+        value = tok.value
+        before = prev.value
+        if before[-1:] == '-' and value[:1] == '-':
+            return True    # never glue two minus signs into a comment
+        if before[-1:] == '[' and value[:1] in '[=':
+            return True    # never open a long bracket by accident
+        if self.prev_unary:
+            return before == 'not'
+        if before in _NO_SPACE_AFTER or value in _NO_SPACE_BEFORE:
+            return False
+        if value in ('(', '['):
+            return not (_ends_expression(prev) or before == 'function')
+        if before == ',' or prev.kind == 'keyword' or tok.kind == 'keyword':
+            return True
+        if (value in _BINARY_OPERATORS and not unary) or before in _BINARY_OPERATORS:
+            return True
+        return _wordlike(before[-1:]) and _wordlike(value)
+
+    def comment(self, tok: Token) -> None:
+        if tok.line > self.last_line and self.pieces:
+            self.flush(not self.at_statement_end())
+        trailing = bool(self.pieces)
+        if not trailing:
+            self.separate(tok)
+        elif tok.value.startswith('--[') and '\n' not in tok.value:
+            self.append(tok.value, True)
+            self.last_line = tok.line
+            return
+        self.append(tok.value, trailing)
+        # Line comments run to the end of the line; anything after continues below
+        self.flush(not self.at_statement_end() if trailing else self.continued)
+        self.last_line = tok.line + tok.value.count('\n')
+
+    def at_statement_end(self) -> bool:
+        return self.prev is not None and _ends_expression(self.prev) and self.levels[-1].depth == 0
+
+    def feed(self, tok: Token) -> None:
+        kind = tok.kind
+        if kind == 'comment':
+            self.comment(tok)
+            return
+
+        value = tok.value
+        level = self.levels[-1]
+        keyword = kind == 'keyword'
+
+        # Step 1: block closers dedent before they are printed
+        if keyword and value in ('end', 'until', 'elseif', 'else') and level.depth == 0 and not (
+                value in ('else', 'elseif') and level.if_else):
+            self.close_block()
+            self.append(value, False)
+            self.prev, self.prev_unary = tok, False
+            self.last_line = tok.line
+            if value == 'else':
+                self.open_block()
+            return
+
+        # Step 2: a name or statement keyword after a complete expression starts a statement
+        starts = (level.depth == 0 and self.at_statement_end() and (
+            kind in ('name', 'label') or (keyword and value in _STATEMENT_KEYWORDS
+                                          and not (value == 'do' and level.loops))))
+        if value == ';' and level.depth == 0:
+            starts = False
+        elif starts or not (self.pieces or self.continued):
+            self.start_statement(tok)
+            starts = True
+
+        # Step 3: print the token with conventional spacing
+        unary = value in _UNARY_OPERATORS and kind != 'string' and (
+            self.prev is None or not _ends_expression(self.prev))
+        text = f'::{value}::' if kind == 'label' else value
+        self.append(text, self.prev is not None and len(self.pieces) > 1 and self.space_before(tok, unary))
+        self.prev, self.prev_unary = tok, unary
+        self.last_line = tok.line + value.count('\n')
+
+        # Step 4: track brackets, blocks and wrapping
+        if kind == 'op':
+            if value in _OPEN:
+                if value == '(' and self.awaiting_params:
+                    self.params = level.depth
+                    self.awaiting_params = False
+                level.depth += 1
+            elif value in _CLOSE:
+                level.depth = max(level.depth - 1, 0)
+                if value == ')' and level.depth == self.params:
+                    self.params = -1
+                    self.open_block()
+                    return
+            elif value == ';' and level.depth == 0:
+                self.flush()
+                return
+        elif keyword:
+            if value == 'function':
+                self.awaiting_params = True
+            elif value in ('while', 'for'):
+                level.loops += 1
+            elif value == 'if':
+                if not starts:
+                    level.if_then += 1    # Luau if-expression, stays inline
+            elif value == 'elseif':
+                level.if_else -= 1
+                level.if_then += 1
+            elif value == 'then':
+                if level.if_then:
+                    level.if_then -= 1
+                    level.if_else += 1
+                else:
+                    self.open_block()
+                    return
+            elif value == 'else':
+                level.if_else -= 1
+            elif value == 'do':
+                if level.loops:
+                    level.loops -= 1
+                self.open_block()
+                return
+            elif value == 'repeat':
+                self.open_block()
+                return
+
+        if value in _WRAP_AFTER and self.length > self.width and not unary:
+            self.flush(True)
+
+
+def iter_lines(code: str, indent: str = INDENT, width: int = MAX_WIDTH) -> Iterator[str]:
+    """Yield re-flowed lines of Lua source in one streaming pass"""
+    printer = _Printer(indent, width)
+    ready = printer.ready
+    for tok in iter_tokens(code, comments=True):
+        printer.feed(tok)
+        if ready:
+            yield from ready
+            ready.clear()
+    printer.flush()
+    yield from ready
+
+
+def reflow(code: str, indent: str = INDENT, width: int = MAX_WIDTH) -> str:
+    """Re-flow Lua source into one indented statement per line"""
+    return '\n'.join(iter_lines(code, indent, width))
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description='Lua Format - Re-flow minified Lua into indented statements')
+    parser.add_argument('input_file', help='Lua file to format')
+    parser.add_argument('-o', '--output', help='Output file (default: stdout)')
+    parser.add_argument('-w', '--width', type=int, default=MAX_WIDTH,
+                        help=f'Wrap long expressions past this column (default: {MAX_WIDTH})')
+    args = parser.parse_args(argv)
+
+    try:
+        with open(args.input_file, 'r', encoding='utf-8', errors='ignore') as f:
+            code = f.read()
+    except OSError as e:
+        print(f"Error loading file: {e}")
+        return 1
+
+    if not args.output:
+        for line in iter_lines(code, width=args.width):
+            print(line)
+        return 0
+
+    try:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            for line in iter_lines(code, width=args.width):
+                f.write(line + '\n')
+    except OSError as e:
+        print(f"Error saving file: {e}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
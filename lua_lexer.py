@@ -0,0 +1,442 @@
+#!/usr/bin/env python3
+"""
+Lua Lexer - Tokenizer shared by the deobfuscation tools
+Produces a flat token stream (whitespace and, by default, comments dropped) covering
+Lua 5.1-5.4 and Luau syntax, plus a block matcher that pairs every
+block-opening keyword with its closing keyword in a single pass, and a
+string literal codec that decodes every escape form and re-emits values
+in their shortest readable form.
+"""
+
+import re
+from typing import Dict, Iterator, List, NamedTuple, Tuple, Union
+
+
+class Token(NamedTuple):
+    kind: str    # 'name', 'keyword', 'number', 'string', 'op', 'label' (or 'comment')
+    value: str
+    start: int   # offset of the first character in the source
+    end: int     # offset one past the last character
+    line: int
+
+
+LUA_KEYWORDS = frozenset({
+    'and', 'break', 'do', 'else', 'elseif', 'end', 'false', 'for',
+    'function', 'goto', 'if', 'in', 'local', 'nil', 'not', 'or', 'repeat',
+    'return', 'then', 'true', 'until', 'while',
+})
+
+_LONG_BRACKET = re.compile(r'\[(=*)\[')
+_TOKEN = re.compile(r'''
+      (?P<ws>[ \t\r\f\v]+|\n)
+    | (?P<comment>--)
+    | (?P<name>[A-Za-z_][A-Za-z0-9_]*)
+    | (?P<number>0[xX](?:[0-9a-fA-F_]*\.?[0-9a-fA-F_]*)(?:[pP][+-]?[0-9]+)?
+                |(?:[0-9][0-9_]*\.?[0-9_]*|\.[0-9][0-9_]*)(?:[eE][+-]?[0-9]+)?)
+    | (?P<quote>["'])
+    | (?P<long>\[=*\[)
+    | (?P<label>::[ \t]*[A-Za-z_][A-Za-z0-9_]*[ \t]*::)
+    | (?P<op>\.\.\.|\.\.=?|//=?|>>|<<|::|[=~<>]=|->|[-+*/%^&|]=|[-+*/%^#&~|<>=(){}\[\];:,.?@])
+''', re.VERBOSE)
+
+
+def _skip_long_bracket(code: str, pos: int, level: str) -> int:
+    """Return the offset just past the closing bracket of a long string/comment"""
+    close = code.find(']' + level + ']', pos)
+    if close < 0:
+        return len(code)
+    return close + len(level) + 2
+
+
+# Characters that can end a short string: its quote, or a raw line break
+_QUOTED_STOP = {quote: re.compile('[%s\n]' % quote) for quote in '"\''}
+_LINE_SPACE = re.compile(r'[ \t\n\r\f\v]*')
+_SPACE_CHARS = ' \t\n\r\f\v'
+# Line breaks Lua reads as a single \n inside a long bracket (a bare \n needs no change)
+_LONG_LINE_BREAK = re.compile(r'\n\r|\r\n?')
+
+
+def _escaped(code: str, k: int, start: int) -> bool:
+    """Is the character at k preceded by an odd run of backslashes (none before start)?"""
+    j = k
+    while j > start and code[j - 1] == '\\':
+        j -= 1
+    return (k - j) % 2 == 1
+
+
+def _skip_quoted(code: str, pos: int, quote: str) -> int:
+    """Return the offset just past the closing quote of a short string
+
+    Only quotes and line breaks can end the string, so the scan jumps
+    between those. A quote or line break counts when the backslashes before it
+    are paired. A line break can also be one of the following:
+    - the second half of an escaped \\r\\n
+    - whitespace swallowed by \\z
+    """
+    search = _QUOTED_STOP[quote].search
+    start = pos + 1
+    k = start
+    while True:
+        m = search(code, k)
+        if m is None:
+            return len(code)
+        k = m.start()
+        if _escaped(code, k, start):
+            k += 1
+            continue
+        if code[k] == '\n':
+            if k - 1 > start and code[k - 1] == '\r' and _escaped(code, k - 1, start):
+                k += 1
+                continue
+            j = k
+            while j > start and code[j - 1] in _SPACE_CHARS:
+                j -= 1
+            if j - 1 > start and code[j - 1] == 'z' and _escaped(code, j - 1, start):
+                k = _LINE_SPACE.match(code, k).end()
+                continue
+        return k + 1
+
+
+def iter_tokens(code: str, comments: bool = False) -> Iterator[Token]:
+    """Yield the tokens of Lua source lazily, optionally including comments"""
+    match = _TOKEN.match
+    length = len(code)
+    pos = 0
+    line = 1
+
+    while pos < length:
+        m = match(code, pos)
+        if m is None:
+            # Unknown character (e.g. stray unicode) - skip it
+            pos += 1
+            continue
+
+        kind = m.lastgroup
+        end = m.end()
+
+        if kind == 'ws':
+            if m.group() == '\n':
+                line += 1
+            pos = end
+            continue
+
+        if kind == 'comment':
+            long_match = _LONG_BRACKET.match(code, end)
+            if long_match:
+                end = _skip_long_bracket(code, long_match.end(), long_match.group(1))
+            else:
+                newline = code.find('\n', end)
+                end = length if newline < 0 else newline
+            if comments:
+                yield Token('comment', code[pos:end], pos, end, line)
+            line += code.count('\n', pos, end)
+            pos = end
+            continue
+
+        if kind == 'quote':
+            end = _skip_quoted(code, pos, m.group())
+            yield Token('string', code[pos:end], pos, end, line)
+        elif kind == 'long':
+            level = m.group()[1:-1]
+            end = _skip_long_bracket(code, end, level)
+            yield Token('string', code[pos:end], pos, end, line)
+        elif kind == 'name':
+            value = m.group()
+            yield Token('keyword' if value in LUA_KEYWORDS else 'name', value, pos, end, line)
+        elif kind == 'label':
+            name = m.group()[2:-2].strip()
+            yield Token('label', name, pos, end, line)
+        else:
+            yield Token(kind, m.group(), pos, end, line)
+
+        line += code.count('\n', pos, end)
+        pos = end
+
+
+def tokenize(code: str) -> List[Token]:
+    """Split Lua source into tokens in one linear pass"""
+    return list(iter_tokens(code))
+
+
+# What follows a backslash in a quoted literal, indexed by byte: the decoded
+# bytes, or one of the escape kinds below. Unknown escapes keep the character,
+# as Lua 5.1 does.
+_HEX, _DECIMAL, _UNICODE, _SKIP_SPACE, _NEWLINE = range(5)
+_ESCAPE_ACTIONS: List[Union[bytes, int]] = [bytes((b,)) for b in range(256)]
+for _c, _value in zip(b'abfnrtv', b'\a\b\f\n\r\t\v'):
+    _ESCAPE_ACTIONS[_c] = bytes((_value,))
+for _c in b'0123456789':
+    _ESCAPE_ACTIONS[_c] = _DECIMAL
+_ESCAPE_ACTIONS[ord('x')] = _HEX
+_ESCAPE_ACTIONS[ord('u')] = _UNICODE
+_ESCAPE_ACTIONS[ord('z')] = _SKIP_SPACE
+_ESCAPE_ACTIONS[ord('\n')] = _ESCAPE_ACTIONS[ord('\r')] = _NEWLINE
+
+_HEX_VALUE = [-1] * 256
+for _c in b'0123456789abcdefABCDEF':
+    _HEX_VALUE[_c] = int(chr(_c), 16)
+_SPACE = frozenset(b' \t\n\r\f\v')
+
+# Shortest readable source form of each byte inside "..." and '...'
+_BYTE_FORMS = {}
+for _quote in '"\'':
+    _forms = [chr(b) if 32 <= b < 127 else f'\\{b}' for b in range(256)]
+    for _c, _form in zip('\a\b\f\n\r\t\v\\', 'abfnrtv\\'):
+        _forms[ord(_c)] = '\\' + _form
+    _forms[ord(_quote)] = '\\' + _quote
+    _BYTE_FORMS[_quote] = _forms
+LONG_STRING_MIN_LINES = 2     # multi-line text reads better in a long bracket
+
+
+def _utf8(codepoint: int) -> bytes:
+    """UTF-8 encoding as Lua 5.4 produces it, including values past U+10FFFF"""
+    if codepoint < 0x80:
+        return bytes((codepoint,))
+    out = []
+    limit = 0x3F
+    while True:
+        out.append(0x80 | (codepoint & 0x3F))
+        codepoint >>= 6
+        limit >>= 1
+        if codepoint <= limit:
+            break
+    out.append(((~limit << 1) | codepoint) & 0xFF)
+    return bytes(reversed(out))
+
+
+def decode_string_literal(literal: str) -> bytes:
+    """Decode a Lua string token (quoted or long bracket) to its byte value
+
+    Covers every Lua 5.1-5.4 and Luau escape (\\ddd, \\xHH, \\u{...}, \\z,
+    escaped newlines) in one scan: plain runs are copied whole and the byte
+    after each backslash is looked up in a 256-entry table.
+    """
+    if literal[:1] == '[':
+        level = literal.index('[', 1) + 1
+        body = literal[level:-level]
+        if '\r' in body:
+            body = _LONG_LINE_BREAK.sub('\n', body)
+        if body[:1] == '\n':
+            body = body[1:]
+        return body.encode('utf-8', errors='surrogateescape')
+
+    body = literal[1:-1] if len(literal) >= 2 and literal[-1] == literal[0] else literal[1:]
+    data = body.encode('utf-8', errors='surrogateescape')
+    if b'\\' not in data:
+        return data
+    out = bytearray()
+    length = len(data)
+    find = data.find
+    actions = _ESCAPE_ACTIONS
+    hex_value = _HEX_VALUE
+    pos = 0
+    while True:
+        k = find(b'\\', pos)
+        if k < 0 or k + 1 >= length:
+            out += data[pos:k if k >= 0 else length]
+            return bytes(out)
+        out += data[pos:k]
+        action = actions[data[k + 1]]
+        pos = k + 2
+        if type(action) is bytes:
+            out += action
+        elif action == _DECIMAL:
+            end = pos
+            while end < k + 4 and end < length and 48 <= data[end] <= 57:
+                end += 1
+            out.append(int(data[k + 1:end]) & 0xFF)
+            pos = end
+        elif action == _HEX:
+            if pos + 1 < length and hex_value[data[pos]] >= 0 and hex_value[data[pos + 1]] >= 0:
+                out.append(hex_value[data[pos]] << 4 | hex_value[data[pos + 1]])
+                pos += 2
+            else:
+                out += b'x'
+        elif action == _UNICODE:
+            close = data.find(b'}', pos)
+            digits = data[pos + 1:close]
+            if data[pos:pos + 1] == b'{' and close > pos + 1 and all(hex_value[c] >= 0 for c in digits):
+                out += _utf8(min(int(digits, 16), 0x7FFFFFFF))
+                pos = close + 1
+            else:
+                out += b'u'
+        elif action == _SKIP_SPACE:
+            while pos < length and data[pos] in _SPACE:
+                pos += 1
+        else:
+            # An escaped line break; \\r\\n and \\n\\r count as one
+            out += b'\n'
+            if pos < length and data[pos] in (10, 13) and data[pos] != data[k + 1]:
+                pos += 1
+
+
+def encode_string_literal(data: bytes) -> str:
+    """Render bytes as the shortest readable Lua string literal
+
+    Printable text (including valid UTF-8) stays as is; everything else
+    becomes the shortest escape that every Lua version reads (\\n, \\ddd).
+    The quote needing fewer escapes is used, and multi-line text becomes a
+    long bracket string when nothing in it needs escaping.
+    """
+    text = data.decode('utf-8', errors='surrogateescape')
+    if text.count('\n') >= LONG_STRING_MIN_LINES and '\r' not in text and all(
+            ch.isprintable() or ch in '\n\t' for ch in text):
+        level = ''
+        while ']' + level + ']' in text + ']':
+            level += '='
+        # The newline right after the opening bracket is skipped when read back
+        lead = '\n' if text[:1] == '\n' else ''
+        return f'[{level}[{lead}{text}]{level}]'
+
+    quote = "'" if text.count('"') > text.count("'") else '"'
+    forms = _BYTE_FORMS[quote]
+    out = []
+    last = len(text) - 1
+    for n, ch in enumerate(text):
+        code = ord(ch)
+        if code < 128:
+            form = forms[code]
+        elif ch.isprintable():
+            out.append(ch)
+            continue
+        elif 0xDC80 <= code <= 0xDCFF:
+            form = forms[code - 0xDC00]        # a byte that was not valid UTF-8
+        else:
+            form = ''.join(forms[b] for b in ch.encode('utf-8', errors='surrogatepass'))
+        # A decimal escape followed by a digit needs all three digits
+        if form[-1:].isdigit() and form[:1] == '\\' and n < last and '0' <= text[n + 1] <= '9':
+            head, _, number = form.rpartition('\\')
+            form = f'{head}\\{int(number):03d}'
+        out.append(form)
+    return quote + ''.join(out) + quote
+
+
+def normalize_string_literal(literal: str) -> str:
+    """Re-emit a Lua string token in its shortest readable form"""
+    return encode_string_literal(decode_string_literal(literal))
+
+
+class BlockMap:
+    """Block structure of a token stream.
+
+    closer[i]   -- for a statement keyword (if/while/for/function/repeat/do)
+                   the index of its final 'end'/'until' token
+    opener[i]   -- the reverse mapping, from 'end'/'until' to the statement keyword
+    branches[i] -- for an 'if' statement the indices of its then/elseif/else tokens
+    body[i]     -- for while/for/do/function/repeat the index of the token that
+                   opens the body ('do', ')' of the parameter list, or 'repeat')
+    block_of[i] -- id of the innermost block containing token i (0 is the chunk)
+    parent[b]   -- enclosing block id of block b
+    owner[b]    -- statement keyword index that opened block b (-1 for the chunk)
+    start[b]    -- index of the keyword opening block b (then/else/do/repeat/function)
+    stop[b]     -- index of the token closing block b (end/until/elseif/else)
+    """
+
+    __slots__ = ('closer', 'opener', 'branches', 'body', 'block_of', 'parent', 'owner',
+                 'start', 'stop')
+
+    def __init__(self):
+        self.closer: Dict[int, int] = {}
+        self.opener: Dict[int, int] = {}
+        self.branches: Dict[int, List[int]] = {}
+        self.body: Dict[int, int] = {}
+        self.block_of: List[int] = []
+        self.parent: List[int] = [-1]
+        self.owner: List[int] = [-1]
+        self.start: List[int] = [-1]
+        self.stop: List[int] = [0]
+
+
+def match_blocks(tokens: List[Token]) -> BlockMap:
+    """Pair block keywords with their terminators in a single pass"""
+    blocks = BlockMap()
+    block_of = blocks.block_of
+    parent = blocks.parent
+    stop = blocks.stop
+    stop[0] = len(tokens)
+
+    stack: List[int] = []              # statement keyword index per open block
+    pending: List[Tuple[int, int]] = []  # (while/for/if index, stack depth) awaiting do/then
+    function_params: List[Tuple[int, int]] = []  # (function index, paren depth) awaiting ')'
+    paren_depth = 0
+    current = 0
+
+    for i, tok in enumerate(tokens):
+        block_of.append(current)
+        value = tok.value
+
+        if tok.kind == 'op':
+            if value == '(':
+                paren_depth += 1
+            elif value == ')':
+                paren_depth -= 1
+                if function_params and function_params[-1][1] == paren_depth:
+                    blocks.body[function_params.pop()[0]] = i
+            continue
+        if tok.kind != 'keyword':
+            continue
+
+        if value in ('while', 'for', 'if'):
+            pending.append((i, len(stack)))
+            if value == 'if':
+                blocks.branches[i] = []
+            continue
+
+        if value == 'elseif':
+            if stack and tokens[stack[-1]].value == 'if':
+                stmt = stack.pop()
+                stop[current] = i
+                current = parent[current]
+                block_of[i] = current
+                blocks.branches[stmt].append(i)
+                pending.append((stmt, len(stack)))
+            continue
+
+        if value == 'end' or value == 'until':
+            if stack:
+                stmt = stack.pop()
+                stop[current] = i
+                current = parent[current]
+                block_of[i] = current
+                blocks.closer[stmt] = i
+                blocks.opener[i] = stmt
+            continue
+
+        if value == 'else':
+            if not stack or tokens[stack[-1]].value != 'if':
+                continue
+            stmt = stack.pop()
+            stop[current] = i
+            current = parent[current]
+            block_of[i] = current
+            blocks.branches[stmt].append(i)
+        elif value == 'then':
+            if not pending or pending[-1][1] != len(stack) or tokens[pending[-1][0]].value != 'if':
+                continue
+            stmt = pending.pop()[0]
+            blocks.branches[stmt].append(i)
+        elif value == 'do':
+            if pending and pending[-1][1] == len(stack) and tokens[pending[-1][0]].value != 'if':
+                stmt = pending.pop()[0]
+            else:
+                stmt = i
+            blocks.body[stmt] = i
+        elif value == 'repeat':
+            stmt = i
+            blocks.body[stmt] = i
+        elif value == 'function':
+            stmt = i
+            function_params.append((i, paren_depth))
+        else:
+            continue
+
+        # Open a new block for the statement
+        new_id = len(parent)
+        parent.append(current)
+        blocks.owner.append(stmt)
+        blocks.start.append(i)
+        stop.append(len(tokens))
+        stack.append(stmt)
+        current = new_id
+
+    return blocks
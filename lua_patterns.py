@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Lua Patterns - Precompiled pattern tables shared by the deobfuscation tools
+Every regex is compiled once, when this module is first imported:
+- Generic obfuscation indicators used by LuaDeobfuscator
+- Hercules runtime signatures and extraction patterns
+plus a linear-time ordered keyword search that replaces lazy
+'a.*?b.*?c' regex chains, which backtrack catastrophically on large inputs.
+"""
+
+import re
+from typing import Dict, Sequence
+
+LUA_PATTERNS: Dict[str, re.Pattern] = {
+    # String encoding patterns
+    'string_concat': re.compile(r'string\.char\([^)]+\)', re.IGNORECASE),
+    'string_format': re.compile(r'string\.format\([^)]+\)', re.IGNORECASE),
+    'table_concat': re.compile(r'table\.concat\([^)]+\)', re.IGNORECASE),
+
+    # Variable obfuscation patterns
+    'random_vars': re.compile(r'\b[a-zA-Z][a-zA-Z0-9_]{10,}\b'),
+    'hex_vars': re.compile(r'\b[a-fA-F0-9]{8,}\b'),
+
+    # Function obfuscation patterns
+    'loadstring': re.compile(r'loadstring\([^)]+\)', re.IGNORECASE),
+    'load': re.compile(r'\bload\([^)]+\)', re.IGNORECASE),
+
+    # Bytecode patterns
+    'bytecode_dump': re.compile(r'string\.dump\([^)]+\)', re.IGNORECASE),
+
+    # Control flow patterns
+    'goto_labels': re.compile(r'::[a-zA-Z_][a-zA-Z0-9_]*::', re.IGNORECASE),
+    'goto_jumps': re.compile(r'goto\s+[a-zA-Z_][a-zA-Z0-9_]*', re.IGNORECASE),
+
+    # Encoded strings
+    'base64_like': re.compile(r'[A-Za-z0-9+/]{20,}={0,2}'),
+    'hex_encoded': re.compile(r'\\x[0-9a-fA-F]{2}'),
+    'decimal_encoded': re.compile(r'\\[0-9]{1,3}'),
+
+    # Literals and names
+    'string_literal': re.compile(r'"([^"\\]|\\.)*"|\'([^\'\\]|\\.)*\''),
+    'number_literal': re.compile(r'\b\d+(?:\.\d+)?\b'),
+    'identifier': re.compile(r'\b[a-zA-Z_][a-zA-Z0-9_]*\b'),
+    'digits': re.compile(r'\d+'),
+}
+
+HERCULES_PATTERNS: Dict[str, re.Pattern] = {
+    'version': re.compile(r'Hercules.*?v?(\d+\.\d+(?:\.\d+)?)', re.IGNORECASE),
+    'decoder_call': re.compile(r'HuDWadUZyHyr\(.*?\)'),
+    'bytecode_string': re.compile(r"HuDWadUZyHyr\('([^']+)'"),
+    'function_def': re.compile(r'function\s+(\w+)\s*\([^)]*\)'),
+    'local_constant': re.compile(r'local\s+(\w+)\s*=\s*([^;\n]+)'),
+    'debug_access': re.compile(r'debug\.|getfenv|setfenv'),
+    'function_header': re.compile(r'function\s+\w+\s*\('),
+    'function_value': re.compile(r'local\s+\w+\s*=\s*function'),
+    'string_literal': LUA_PATTERNS['string_literal'],
+}
+
+# Keyword sequences checked with contains_in_order()
+HERCULES_VM_STRUCTURE = ('return', 'function', 'local', 'while', 'alpha', 'do')
+HERCULES_ANTI_TAMPER = ('cuCzEJpiRD', 'afToLAMJHixs', 'fTAKBayDIjj')
+
+
+def contains_in_order(text: str, words: Sequence[str], same_line: bool = False) -> bool:
+    """Whether the words occur in text in the given order, like re.search('w1.*?w2...')
+
+    Taking the earliest occurrence of each word is always optimal, so one
+    forward scan suffices. With same_line the words must share a line (the
+    regex without DOTALL); a failed line is skipped as a whole.
+    """
+    if not words:
+        return True
+    first = words[0]
+    pos = 0
+    while True:
+        start = text.find(first, pos)
+        if start < 0:
+            return False
+        limit = len(text)
+        if same_line:
+            newline = text.find('\n', start)
+            if newline >= 0:
+                limit = newline
+        cursor = start + len(first)
+        for word in words[1:]:
+            found = text.find(word, cursor, limit)
+            if found < 0:
+                break
+            cursor = found + len(word)
+        else:
+            return True
+        if limit == len(text):
+            return False
+        pos = limit + 1
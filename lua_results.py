@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Result objects shared by the deobfuscation tools
+Lightweight __slots__ containers returned by the in-memory library API,
+so callers can deobfuscate strings/bytes without touching the disk.
+"""
+
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional, Union
+
+Source = Union[str, bytes, bytearray, memoryview]
+
+
+def decode_source(source: Source) -> str:
+    """Normalise str/bytes input the same way load_file() reads files"""
+    if isinstance(source, str):
+        return source
+    return bytes(source).decode('utf-8', errors='ignore')
+
+
+class Timings:
+    """Wall-clock time spent in each pipeline stage, in seconds"""
+
+    __slots__ = ('stages',)
+
+    def __init__(self):
+        self.stages: Dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Time the enclosed block and accumulate it under name"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    @property
+    def total(self) -> float:
+        return sum(self.stages.values())
+
+    def as_dict(self) -> Dict[str, float]:
+        timings = dict(self.stages)
+        timings['total'] = self.total
+        return timings
+
+    def __repr__(self) -> str:
+        stages = ', '.join(f"{name}={seconds * 1000:.1f}ms" for name, seconds in self.stages.items())
+        return f"Timings({stages})"
+
+
+class DeobfuscationResult:
+    """Output of one in-memory run: deobfuscated code, report and timings"""
+
+    __slots__ = ('output', 'report', 'timings')
+
+    def __init__(self, output: Optional[str], report: Dict[str, Any], timings: Timings):
+        self.output = output        # None when only analysis was requested
+        self.report = report
+        self.timings = timings
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            'output': self.output,
+            'report': self.report,
+            'timings': self.timings.as_dict(),
+        }
+
+    def __repr__(self) -> str:
+        size = 'None' if self.output is None else f"{len(self.output)} chars"
+        return f"DeobfuscationResult(output={size}, timings={self.timings!r})"
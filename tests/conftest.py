@@ -0,0 +1,109 @@
+import os
+import sys
+
+import pytest
+
+# The tools are top-level modules rather than an installed package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+STEP_LIMIT = 10 ** 7      # VM instructions before a script counts as stuck
+
+_PRELUDE = '''
+local emit, pack, concat, tostring = ...
+print = function(...)
+    local values = pack(...)
+    for i = 1, values.n do values[i] = tostring(values[i]) end
+    emit(concat(values, '\\t', 1, values.n))
+end
+debug.sethook(function() error('step limit', 0) end, '', %d)
+''' % STEP_LIMIT
+
+
+@pytest.fixture
+def run_lua():
+    """Run a script on Lua 5.4 and return its printed lines, ending with
+    'error' when it raises or runs past the step limit"""
+    lua54 = pytest.importorskip('lupa.lua54')
+
+    def run(code):
+        lua = lua54.LuaRuntime()
+        lines = []
+        lua.execute(_PRELUDE, lines.append, lua.eval('table.pack'), lua.eval('table.concat'),
+                    lua.eval('tostring'))
+        try:
+            lua.execute(code)
+        except lua54.LuaError:
+            lines.append('error')
+        return lines
+
+    return run
+
+
+@pytest.fixture
+def same_output(run_lua):
+    """Assert that two scripts print the same lines, and return them"""
+    def check(original, transformed):
+        expected = run_lua(original)
+        assert 'error' not in expected, f"the original script fails: {expected}"
+        assert run_lua(transformed) == expected, transformed
+        return expected
+
+    return check
+
+
+_HERCULES = '''-- Obfuscated with Hercules v1.6.2 obfuscator
+return (function(...)
+local ALPHABET = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+local function {decoder}(s)
+  local out = {{}}
+  for part in s:gmatch("[^_]+") do
+    out[#out + 1] = string.char((tonumber(part, 36) - 7) % 256)
+  end
+  return table.concat(out)
+end
+local function {executor}(code, env)
+  local stack = {{}}
+  local pc = 1
+  local alpha = true
+  while alpha do
+    local inst = code[pc]
+    local op = inst[1]
+    pc = pc + 1
+    if op == 0 then
+      stack[inst[2]] = inst[3]
+    elseif op == 1 then
+      stack[inst[2]] = env[inst[3]]
+    elseif op == 2 then
+      stack[inst[2]](stack[inst[3]])
+    elseif op == 3 then
+      alpha = false
+    end
+  end
+end
+local function {loader}(text)
+  return {executor}({{{{1, 1, "print"}}, {{0, 2, text}}, {{2, 1, 2}}, {{3}}}}, _G)
+end
+{loader}({decoder}('{payload}'))
+end)(...)
+'''
+
+
+def _base36(n):
+    digits = ''
+    while True:
+        n, digit = divmod(n, 36)
+        digits = '0123456789abcdefghijklmnopqrstuvwxyz'[digit] + digits
+        if not n:
+            return digits
+
+
+@pytest.fixture
+def hercules_sample():
+    """Build a signed Hercules-style sample whose runtime functions carry the
+    given names; it prints text, decoded from a base-36 Caesar payload"""
+    def build(decoder='HuDWadUZyHyr', loader='SVkOeWirtS', executor='iLkvhyKfZlmz',
+              text='decoded by the payload ' * 12):
+        payload = '_'.join(_base36((b + 7) % 256) for b in text.encode())
+        return _HERCULES.format(decoder=decoder, loader=loader, executor=executor, payload=payload)
+
+    return build
@@ -0,0 +1,32 @@
+"""Hercules deobfuscator entry points"""
+
+from hercules_deobfuscator import HerculesDeobfuscator
+
+
+def test_load_file_resets_cached_analysis(tmp_path):
+    first, second = tmp_path / 'first.lua', tmp_path / 'second.lua'
+    first.write_text('local x = "\\72\\101\\108\\108\\111" print(x)')
+    second.write_bytes(b'print("second")\r\n')
+    deobfuscator = HerculesDeobfuscator()
+
+    assert deobfuscator.load_file(str(first))
+    build, triage = deobfuscator.learn_build(), deobfuscator.triage()
+    assert deobfuscator.load_file(str(second))
+    assert deobfuscator.original_code == 'print("second")\r\n'
+    assert deobfuscator.learn_build() is not build
+    assert deobfuscator.triage() is not triage
+
+
+def test_load_file_reports_missing_files(tmp_path):
+    assert not HerculesDeobfuscator().load_file(str(tmp_path / 'missing.lua'))
+
+
+def test_renamed_build_scores_like_the_stock_one(hercules_sample):
+    detections = []
+    for source in (hercules_sample(), hercules_sample('decode', 'load', 'execute')):
+        deobfuscator = HerculesDeobfuscator()
+        deobfuscator.load_source(source)
+        detections.append(deobfuscator.detect_hercules())
+    stock, renamed = detections
+    assert {'string_decoder_function', 'bytecode_loader', 'vm_executor'} <= set(stock['indicators'])
+    assert renamed == stock
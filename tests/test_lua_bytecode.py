@@ -0,0 +1,73 @@
+"""Discovery of precompiled chunks embedded in scripts"""
+
+import pytest
+
+from lua_bytecode import HEAD_CHARS, _decode_escaped, disassemble, find_chunks, parse_chunk
+from lua_lexer import decode_string_literal
+
+# Luau compiler output (-O1 -g2, with type information) for:
+#   local t = {alpha = 1, beta = 2}
+#   local function greet(name: string)
+#     print("hello", name, math.floor(2.5))
+#   end
+#   greet(t.alpha)
+#   return t
+LUAU_CHUNK = bytes.fromhex(
+    '060309057072696e740568656c6c6f046d61746805666c6f6f72056772656574046e616d6505616c7068610462657461'
+    '017400020601000000060300000501030b0c01010000000040050202000603000005050300490c05020c040600001440'
+    '801504020015010001160001000703010400000040030202000000000000044003030304040014408000020501180000'
+    '00000000000000000103000000010106000b000004000001020b0000020f00010d0f0108060e41000000360002000401'
+    '0100100100360000000004010200100100a10100000040010300060201000f0300360000000015020201160002000403'
+    '070308050200010600010001000118000000000000000001030000000101000000010209080e0005090e010001'
+)
+
+
+def dump(source, version='51'):
+    lupa = pytest.importorskip(f'lupa.lua{version}')
+    lua = lupa.LuaRuntime(encoding=None)
+    load = 'loadstring' if version == '51' else 'load'
+    return lua.eval(f'function(s) return string.dump({load}(s)) end')(source.encode())
+
+
+@pytest.mark.parametrize('escape', ['\\{}', '\\{:03d}', '\\x{:02x}'])
+def test_escaped_chunk_is_found(escape):
+    data = dump('local t = {} ' + ' '.join(f't[{k}] = {k}' for k in range(200)) + ' return t')
+    literal = '"' + ''.join(escape.format(b) for b in data) + '"'
+    assert len(literal) > HEAD_CHARS
+    found = find_chunks(f'local payload = {literal}\nreturn loadstring(payload)\n')
+    assert [chunk.size for _, chunk in found] == [len(data)]
+    assert found[0][0] == 'literal@line 1'
+
+
+def test_long_escaped_literal_without_a_header_is_skipped():
+    literal = '"' + '\\120' * 100000 + '"'
+    assert find_chunks(f'local junk = {literal}\n') == []
+
+
+@pytest.mark.parametrize('literal', [
+    '"\\1\\01\\001\\255"', '"\\1\\0012"', '"\\256\\1"', '"\\x41\\x4"', '"\\x41a"', '"\\1\\\\"',
+])
+def test_batch_decoding_matches_the_literal_codec(literal):
+    assert _decode_escaped(literal) == decode_string_literal(literal)
+
+
+@pytest.mark.parametrize('version, number', [('52', 1.0), ('53', 1)])
+def test_later_dumps_parse(version, number):
+    chunk = parse_chunk(dump('local t = {alpha = 1} print(t.alpha * 2.5, "hi") return t', version))
+    assert chunk.version == f'{version[0]}.{version[1]}'
+    assert chunk.constants() == ['alpha', number, 'print', 2.5, 'hi']
+    listing = disassemble(chunk)
+    assert 'GETTABUP' in listing and '; "print"' in listing
+
+
+def test_luau_chunk_parses():
+    chunk = parse_chunk(LUAU_CHUNK)
+    assert chunk.version == 'luau-6' and chunk.size == len(LUAU_CHUNK)
+    main, greet = chunk.main.walk()
+    assert greet.name == 'greet' and greet.line_defined == 2
+    assert ('import', 'print') in greet.constants and ('import', 'math.floor') in greet.constants
+    assert ('table', [0, 1]) in main.constants
+    assert main.locals == [('t', 8, 14), ('greet', 9, 14)] and greet.locals == [('name', 0, 11)]
+    assert sorted(set(main.lineinfo)) == [1, 2, 5, 6] and sorted(set(greet.lineinfo)) == [3, 4]
+    listing = disassemble(chunk)
+    assert '[3]\tGETIMPORT' in listing and '; import math.floor' in listing
@@ -0,0 +1,341 @@
+"""Control flow graph construction and deflattening"""
+
+import time
+
+import pytest
+
+from lua_cfg import build_cfg, deflatten
+from lua_deobfuscator import deobfuscate_source
+
+
+def flattened(code):
+    """Deflatten code, expecting every dispatcher to go"""
+    output, stats = deflatten(code)
+    assert 'while s' not in output, output
+    return output, stats
+
+
+def test_linear_dispatcher(same_output):
+    code = '''
+local s = 1
+while s ~= 0 do
+  if s == 1 then print("a") s = 3
+  elseif s == 2 then print("never") s = 0
+  elseif s == 3 then print("b") s = 0
+  end
+end
+print("after")'''
+    output, stats = flattened(code)
+    assert same_output(code, output) == ['a', 'b', 'after']
+    assert stats['dispatchers_removed'] == 1
+    assert stats['unreachable_blocks_removed'] == 1
+
+
+def test_nil_state_leaves_the_loop(same_output):
+    code = 'local s=1 while s do if s==1 then print("a") s=2 elseif s==2 then print("b") s=nil end end'
+    output, _ = flattened(code)
+    assert same_output(code, output) == ['a', 'b']
+    assert 'while' not in output
+
+
+def test_nil_state_through_the_pipeline(same_output):
+    code = 'local s=1 while s do if s==1 then print("a") s=2 elseif s==2 then print("b") s=nil end end'
+    same_output(code, deobfuscate_source(code).output)
+
+
+@pytest.mark.parametrize('state, key', [('"\\98"', '"b"'), ("'b'", '"b"'), ('"b"', '[[b]]'), ('"\\x62"', "'\\98'")])
+def test_string_states_compare_by_value(same_output, state, key):
+    code = f'''
+local s = {state}
+while s ~= "x" do
+  if s == {key} then print(1) s = "x" else print("other") s = "x" end
+end'''
+    output, _ = flattened(code)
+    assert same_output(code, output) == ['1']
+
+
+def test_conditional_transition_becomes_if_else(same_output):
+    for flag in ('true', 'false'):
+        code = f'''
+local x = {flag}
+local s = 1
+while s ~= 0 do
+  if s == 1 then
+    print("start")
+    if x then s = 2 else s = 3 end
+  elseif s == 2 then print("yes") s = 4
+  elseif s == 3 then print("no") s = 4
+  elseif s == 4 then print("end") s = 0
+  end
+end'''
+        output, _ = flattened(code)
+        assert 'if x then' in output
+        same_output(code, output)
+
+
+def test_conditional_transition_with_return_and_locals(same_output):
+    code = '''
+local function f(y)
+  local s = 1
+  while s do
+    if s == 1 then
+      if y > 2 then
+        local u = y
+        print("big", u)
+        s = 2
+      elseif y > 1 then
+        return "mid"
+      else
+        s = nil
+      end
+    elseif s == 2 then
+      print("two")
+      s = nil
+    end
+  end
+  return "done"
+end
+print(f(3)) print(f(2)) print(f(1))'''
+    output, _ = flattened(code)
+    same_output(code, output)
+
+
+def test_nested_forks(same_output):
+    code = '''
+local a, b = true, false
+local s = 1
+while s ~= 0 do
+  if s == 1 then
+    if a then s = 2 else s = 3 end
+  elseif s == 2 then
+    if b then s = 4 else s = 5 end
+  elseif s == 3 then print(3) s = 0
+  elseif s == 4 then print(4) s = 0
+  elseif s == 5 then print(5) s = 0
+  end
+end'''
+    output, _ = flattened(code)
+    assert same_output(code, output) == ['5']
+
+
+def test_fork_looping_back_becomes_a_while_loop(same_output):
+    code = '''
+local i = 1
+local s = 1
+while s ~= 0 do
+  if s == 1 then if i <= 3 then s = 2 else s = 3 end
+  elseif s == 2 then print(i) i = i + 1 s = 1
+  elseif s == 3 then print("done") s = 0
+  elseif s == 7 then print("never") s = 0
+  end
+end'''
+    output, stats = flattened(code)
+    assert 'while i <= 3 do' in output and 'never' not in output
+    assert stats['unreachable_blocks_removed'] == 1
+    assert same_output(code, output) == ['1', '2', '3', 'done']
+
+
+def test_loop_staying_on_the_else_branch(same_output):
+    code = '''
+local i = 1
+local s = 1
+while s ~= 0 do
+  if s == 1 then if i > 2 then s = 3 else s = 2 end
+  elseif s == 2 then print(i) i = i + 1 s = 1
+  elseif s == 3 then print("done") s = 0
+  end
+end'''
+    output, _ = flattened(code)
+    assert 'while not (i > 2) do' in output
+    same_output(code, output)
+
+
+def test_loop_with_statements_before_the_fork(same_output):
+    code = '''
+local n = 0
+local s = 1
+while true do
+  if s == 1 then
+    n = n + 1
+    if n > 3 then s = 2 end
+  elseif s == 2 then
+    print(n) break
+  end
+end'''
+    output, _ = flattened(code)
+    assert 'while true do' in output and 'then break end' in output
+    assert same_output(code, output) == ['4']
+
+
+def test_nested_loops(same_output):
+    code = '''
+local i, j = 1, 1
+local s = 1
+while s ~= 0 do
+  if s == 1 then if i <= 2 then s = 2 else s = 5 end
+  elseif s == 2 then j = 1 s = 3
+  elseif s == 3 then if j <= 2 then s = 4 else s = 6 end
+  elseif s == 4 then print(i, j) j = j + 1 s = 3
+  elseif s == 6 then i = i + 1 s = 1
+  elseif s == 5 then print("end") s = 0
+  end
+end'''
+    output, _ = flattened(code)
+    assert output.count('while') == 2
+    assert same_output(code, output) == ['1\t1', '1\t2', '2\t1', '2\t2', 'end']
+
+
+def test_if_else_inside_a_loop(same_output):
+    code = '''
+local i = 1
+local s = 1
+while s ~= 0 do
+  if s == 1 then if i <= 3 then s = 2 else s = 9 end
+  elseif s == 2 then if i % 2 == 0 then s = 3 else s = 4 end
+  elseif s == 3 then print("even", i) s = 5
+  elseif s == 4 then print("odd", i) s = 5
+  elseif s == 5 then i = i + 1 s = 1
+  elseif s == 9 then print("end") s = 0
+  end
+end'''
+    output, _ = flattened(code)
+    assert same_output(code, output) == ['odd\t1', 'even\t2', 'odd\t3', 'end']
+
+
+def test_loop_left_through_a_return(same_output):
+    code = '''
+local function f(n)
+  local s = 1
+  while s do
+    if s == 1 then n = n - 1 if n <= 0 then return "done" else s = 2 end
+    elseif s == 2 then print(n) s = 1
+    end
+  end
+end
+print(f(3))'''
+    output, _ = flattened(code)
+    assert same_output(code, output) == ['2', '1', 'done']
+
+
+@pytest.mark.parametrize('arms', [
+    # The state assignment is not the last statement of its branch
+    '''if s == 1 then x = x + 1 if x > 2 then s = 2 print("leaving") end
+  elseif s == 7 then print("never") s = 1
+  elseif s == 2 then print("x", x) s = 0''',
+    # Leaving the dispatcher from inside a loop needs a break past the code after it
+    '''if s == 1 then if x < 5 then s = 2 else s = 3 end
+  elseif s == 7 then print("never") s = 1
+  elseif s == 2 then x = x + 1 if x == 3 then s = 0 else s = 1 end
+  elseif s == 3 then print("done") s = 0''',
+    # A whole dispatch statement goes, and the first arm of another
+    '''if s == 8 then print("never") s = 1 else x = x + 1 end
+  if s == 1 then if x > 2 then s = 2 print("leaving") end
+  elseif s == 2 then print("x", x) s = 0
+  end
+  if s == 9 then print("gone") s = 1''',
+])
+def test_kept_dispatcher_loses_unreachable_arms(same_output, arms):
+    code = f'''
+local x = 0
+local s = 1
+while s ~= 0 do
+  {arms}
+  end
+end'''
+    output, stats = deflatten(code)
+    assert stats['dispatchers_removed'] == 0
+    assert stats['unreachable_blocks_removed'] >= 1
+    assert 'never' not in output and 'gone' not in output
+    same_output(code, output)
+
+
+def test_cyclic_dispatcher_becomes_a_loop(same_output):
+    code = '''
+local function count()
+  local n = 0
+  local s = 1
+  while s ~= 0 do
+    if s == 1 then n = n + 1 s = 2
+    elseif s == 2 then print(n) if n > 2 then return end s = 1
+    end
+  end
+end
+count()'''
+    output, _ = flattened(code)
+    assert 'while true do' in output
+    assert same_output(code, output) == ['1', '2', '3']
+
+
+def test_goto_chain_is_laid_out(same_output):
+    code = '''
+goto a
+::c::
+print(3)
+goto d
+::b::
+print(2)
+goto c
+::a::
+print(1)
+goto b
+::d::'''
+    output, stats = deflatten(code)
+    assert 'goto' not in output
+    assert stats['gotos_removed'] == 4
+    assert same_output(code, output) == ['1', '2', '3']
+
+
+def test_goto_segments_do_not_move_across_locals(same_output):
+    code = '''
+goto a
+::b::
+print(x)
+goto c
+::a::
+local x = 5
+print(x)
+goto b
+::c::'''
+    output, _ = deflatten(code)
+    assert same_output(code, output) == ['5', 'nil']
+
+
+def test_captured_state_keeps_the_dispatcher(same_output):
+    code = '''
+local s = 1
+local peek = function() return s end
+while s ~= 0 do
+  if s == 1 then print(peek()) s = 0 end
+end'''
+    output, stats = deflatten(code)
+    assert stats['dispatchers_removed'] == 0
+    same_output(code, output)
+
+
+def test_analysis_reports_forking_dispatchers():
+    cfg = build_cfg('local s = 1 while s do if s == 1 then if x then s = 2 else s = nil end '
+                    'elseif s == 2 then print(2) s = nil end end')
+    assert len(cfg.dispatchers) == 1
+    assert all(case.node.reachable for case in cfg.dispatchers[0].cases)
+
+
+def _dispatchers(n):
+    return '\n'.join(f'local s{k} = 1 while s{k} ~= 0 do if s{k} == 1 then print({k}) s{k} = 2 '
+                     f'elseif s{k} == 2 then s{k} = 0 end end' for k in range(n))
+
+
+def _goto_chain(n):
+    return '\n'.join(['goto L0'] + [f'::L{k}:: print({k}) goto L{k + 1}' for k in range(n)] + [f'::L{n}::'])
+
+
+@pytest.mark.parametrize('generate, size', [(_dispatchers, 400), (_goto_chain, 2000)])
+def test_graph_building_scales_linearly(generate, size):
+    def timed(n):
+        code = generate(n)
+        start = time.perf_counter()
+        build_cfg(code)
+        return time.perf_counter() - start
+
+    timed(size)     # warm up
+    small, large = min(timed(size) for _ in range(3)), min(timed(4 * size) for _ in range(3))
+    assert large < 8 * small
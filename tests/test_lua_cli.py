@@ -0,0 +1,9 @@
+"""Start-up cost of the command line entry point"""
+
+from lua_cli import DEFERRED_MODULES, STARTUP_BUDGET, measure_startup
+
+
+def test_startup_stays_within_budget():
+    elapsed, loaded = measure_startup()
+    assert not set(loaded) & set(DEFERRED_MODULES), loaded
+    assert elapsed < STARTUP_BUDGET, f'{elapsed * 1000:.1f} ms'
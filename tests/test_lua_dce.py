@@ -0,0 +1,92 @@
+"""Def-use based dead-code elimination"""
+
+import time
+
+import pytest
+
+from lua_dce import eliminate_dead_code
+
+
+def test_opaque_predicates_and_junk_locals_go(same_output):
+    code = '''
+local k = 3
+local junk = k * 2
+if k * 2 == 7 then print("no") else print("yes") end
+while false do print(1) end
+local a = 1 local b = a + 1
+print(k)'''
+    output, stats = eliminate_dead_code(code)
+    assert same_output(code, output) == ['yes', '3']
+    assert 'junk' not in output and 'while' not in output
+    assert stats['opaque_predicates_folded'] == 1
+    assert stats['unused_locals_removed'] == 3
+
+
+@pytest.mark.parametrize('definition', [
+    'function handler() return 1 end',
+    'handler = function() return 1 end',
+    'handler, other = function() end, 2',
+])
+def test_later_writes_are_not_folded(same_output, definition):
+    code = f'''
+local handler
+local other
+{definition}
+if handler then print("has handler") else print("none") end
+print(other)'''
+    output, _ = eliminate_dead_code(code)
+    assert same_output(code, output)[0] == 'has handler'
+
+
+def test_function_statements_on_fields_keep_the_table(same_output):
+    code = '''
+local obj = {}
+function obj.greet() return "hi" end
+function obj:name() return "obj" end
+if obj then print(obj.greet(), obj:name()) end'''
+    output, _ = eliminate_dead_code(code)
+    assert same_output(code, output) == ['hi\tobj']
+
+
+def test_locals_used_only_by_dropped_branches_go(same_output):
+    code = '''
+local debug_mode = false
+local message = "debugging"
+if debug_mode then print(message) end
+print("done")'''
+    output, stats = eliminate_dead_code(code)
+    assert same_output(code, output) == ['done']
+    assert 'message' not in output
+
+
+def test_side_effects_are_kept(same_output):
+    code = '''
+local unused = print("effect")
+local t = {f = print}
+local also_unused = t.f("field call")
+print("end")'''
+    output, _ = eliminate_dead_code(code)
+    assert same_output(code, output) == ['effect', 'field call', 'end']
+
+
+def test_emptied_do_blocks_go(same_output):
+    code = '''
+do local a = 1 do local b = a end print("kept") end
+do local c = 2 do local d = c end; do end end
+print("after")'''
+    output, _ = eliminate_dead_code(code)
+    assert same_output(code, output) == ['kept', 'after']
+    assert output.count('do') == 1 and 'local' not in output
+
+
+def test_nested_do_blocks_prune_linearly():
+    def timed(depth):
+        code = 'do local junk = 1 ' * depth + 'end ' * depth
+        start = time.perf_counter()
+        output, _ = eliminate_dead_code(code)
+        assert not output.strip()
+        return time.perf_counter() - start
+
+    timed(500)      # warm up
+    small, large = min(timed(500) for _ in range(3)), min(timed(2000) for _ in range(3))
+    assert large < 8 * small
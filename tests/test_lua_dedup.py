@@ -0,0 +1,126 @@
+"""Hash-consing of repeated function bodies and blocks"""
+
+import time
+
+import pytest
+
+from lua_dedup import deduplicate
+
+BODY = 'function(a) local t = a .. x .. a; print(t); return t end'
+
+
+def test_repeated_functions_and_blocks_share_a_definition(same_output):
+    code = f'''
+x = "-"
+local f = {BODY}
+local g = {BODY}
+local function h(b) local u = b .. x .. b; print(u); return u end
+pcall({BODY}, "p")
+do local n = 0 for i = 1, 3 do n = n + i end print("block", n) end
+do local m = 0 for j = 1, 3 do m = m + j end print("block", m) end
+f(1) g(2) h(3)'''
+    output, stats = deduplicate(code)
+    assert same_output(code, output)
+    assert stats['shared_definitions'] == 2
+    assert stats['duplicates_replaced'] == 6
+
+
+def test_local_env_keeps_bodies_apart(same_output):
+    code = f'''
+x = 1
+local f = {BODY}
+local g
+do
+  local _ENV = {{print = print, x = "x"}}
+  g = {BODY}
+end
+f(1)
+g("mine")'''
+    output, stats = deduplicate(code)
+    assert same_output(code, output) == ['111', 'minexmine']
+    assert stats['duplicates_replaced'] == 0
+
+
+def test_env_parameter_keeps_bodies_apart(same_output):
+    code = f'''
+x = 1
+local f = {BODY}
+local function make(_ENV) return {BODY} end
+f(1)
+make({{print = print, x = "y"}})(2)'''
+    output, _ = deduplicate(code)
+    assert same_output(code, output) == ['111', '2y2']
+
+
+@pytest.mark.parametrize('store, compare', [
+    ('t.a = {f}\nt.b = {f}', 't.a ~= t.b'),
+    ('t[1] = {f}\nt[2] = {f}', 't[1] == t[2]'),
+    ('t = {{{f}, {f}}}', 't[1] == t[2]'),
+    ('t = {{a = {f}, b = {f}}}', 'rawequal(t.a, t.b)'),
+    ('local p = {f}\nlocal q = {f}', 'rawequal(p, q)'),
+    ('function t.a(a) local t = a .. x .. a; print(t); return t end\n'
+     'function t.b(a) local t = a .. x .. a; print(t); return t end', 't.a == t.b'),
+])
+def test_function_identity_is_preserved(same_output, store, compare):
+    code = f'local t = {{}}\n{store.format(f=BODY)}\nprint({compare})'
+    output, _ = deduplicate(code)
+    same_output(code, output)
+
+
+def test_shebang_and_luau_directives_stay_first():
+    code = f'#!/usr/bin/env lua\n--!strict\n--!native\nlocal f = {BODY}\nlocal g = {BODY}\n'
+    output, stats = deduplicate(code)
+    assert stats['shared_definitions'] == 1
+    assert output.splitlines()[:4] == ['#!/usr/bin/env lua', '--!strict', '--!native', 'local __shared = {}']
+
+
+@pytest.mark.parametrize('use', [
+    'local m = {f, g}\nprint(m[1] == m[2])',
+    'print(tostring(f) == tostring(g))',
+    'local h = f\nprint(h == g)',
+    'local seen = {}\nseen[f] = 1 seen[g] = 1\nlocal n = 0 for _ in pairs(seen) do n = n + 1 end print(n)',
+])
+def test_bindings_read_other_than_by_calls_are_kept(same_output, use):
+    code = f'x = "-"\nlocal f = {BODY}\nlocal g = {BODY}\n{use}'
+    output, stats = deduplicate(code)
+    same_output(code, output)
+    assert stats['duplicates_replaced'] == 0
+
+
+def test_anonymous_arguments_are_kept_apart(same_output):
+    code = f'''
+x = "-"
+local seen, n = {{}}, 0
+local function register(fn) if not seen[fn] then seen[fn] = true n = n + 1 end end
+register({BODY})
+register({BODY})
+print(n)'''
+    output, stats = deduplicate(code)
+    assert same_output(code, output) == ['2']
+    assert stats['duplicates_replaced'] == 0
+
+
+def test_nested_bodies_keep_their_references_apart(same_output):
+    # The inner functions are alike but for which parameter of the outer one they return
+    outer = 'function(a, b) local pad = "." .. a .. b; local function inner() return {} .. pad end return inner() end'
+    code = f'''
+local first = {outer.format('a')}
+local second = {outer.format('b')}
+local third = {outer.format('a')}
+print(first(1, 2), second(1, 2), third(3, 4))'''
+    output, stats = deduplicate(code)
+    assert same_output(code, output) == ['1.12\t2.12\t3.34']
+    assert stats['shared_definitions'] == 1
+    assert stats['duplicates_replaced'] == 2
+
+
+def test_nested_bodies_are_hashed_once():
+    def timed(depth):
+        code = ''.join(f'do local v = {k} print(v, "level") ' for k in range(depth)) + 'end ' * depth
+        start = time.perf_counter()
+        deduplicate(code)
+        return time.perf_counter() - start
+
+    timed(250)      # warm up
+    small, large = min(timed(250) for _ in range(3)), min(timed(1000) for _ in range(3))
+    assert large < 8 * small
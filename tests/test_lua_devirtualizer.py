@@ -0,0 +1,162 @@
+"""Devirtualisation of `while alpha do` dispatch loops"""
+
+import lua_devirtualizer
+from lua_devirtualizer import _join, devirtualize, records_from_bytes
+
+# Opcodes of the toy VM below
+LOADK, GETGLOBAL, CALL, ADD, TEST, JMP, LT, HALT = range(8)
+
+VM = '''
+local function run(code, K, env)
+  local stack = {}
+  local pc = 1
+  local alpha = true
+  while alpha do
+    local inst = code[pc]
+    local op = inst[1]
+    pc = pc + 1
+    if op == 0 then
+      stack[inst[2]] = K[inst[3]]
+    elseif op == 1 then
+      stack[inst[2]] = env[K[inst[3]]]
+    elseif op == 2 then
+      stack[inst[2]](stack[inst[3]])
+    elseif op == 3 then
+      stack[inst[2]] = stack[inst[3]] + stack[inst[4]]
+    elseif op == 4 then
+      if stack[inst[2]] then pc = inst[3] end
+    elseif op == 5 then
+      pc = inst[2]
+    elseif op == 6 then
+      stack[inst[2]] = stack[inst[3]] < stack[inst[4]]
+    elseif op == 7 then
+      alpha = false
+    end
+  end
+end
+'''
+
+# print lives in r1; the constants 0, 1, 3 and 2 are loaded into r2, r3, r6 and r7
+CONSTANTS = '{[1] = "print", [2] = 1, [3] = 0, [4] = 3, [5] = 2}'
+PROLOGUE = [(GETGLOBAL, 1, 1), (LOADK, 2, 3), (LOADK, 3, 2), (LOADK, 6, 4), (LOADK, 7, 5)]
+
+
+def script(code):
+    rows = ',\n'.join('  {%s}' % ', '.join(map(str, instruction)) for instruction in code)
+    return f'{VM}local K = {CONSTANTS}\nlocal code = {{\n{rows}\n}}\nrun(code, K, _G)\n'
+
+
+def lifted(code, same_output, payload=None):
+    vm, program = devirtualize(code, payload)
+    assert vm is not None and program is not None
+    assert program.unknown == 0
+    same_output(code, program.source)
+    return program.source
+
+
+def test_opcode_map():
+    vm, _ = devirtualize(script(PROLOGUE + [(HALT,)]))
+    assert vm.pc_mode == 'pre'
+    assert vm.opcode_map == {0: 'LOADK', 1: 'GETGLOBAL', 2: 'CALL', 3: 'ADD', 4: 'TEST',
+                             5: 'JMP', 6: 'UNKNOWN', 7: 'RETURN'}
+
+
+def test_straight_line(same_output):
+    code = script(PROLOGUE + [(ADD, 4, 3, 6), (CALL, 1, 4), (CALL, 1, 7), (HALT,)])
+    source = lifted(code, same_output)
+    assert 'while' not in source and 'if' not in source
+
+
+def test_forward_conditional_jump(same_output):
+    for left, right in ((2, 3), (3, 2)):
+        code = script(PROLOGUE + [
+            (LT, 4, left, right),       # 6
+            (TEST, 4, 9),               # 7: skip the first print
+            (CALL, 1, 6),               # 8
+            (CALL, 1, 7),               # 9
+            (HALT,),
+        ])
+        source = lifted(code, same_output)
+        assert 'if' in source and 'while' not in source
+
+
+def test_backward_conditional_jump(same_output):
+    code = script(PROLOGUE + [
+        (CALL, 1, 2),                   # 6: loop body
+        (ADD, 2, 2, 3),                 # 7
+        (LT, 4, 2, 6),                  # 8
+        (TEST, 4, 6),                   # 9: back to 6 while r2 < 3
+        (HALT,),
+    ])
+    source = lifted(code, same_output)
+    assert source.count('while true do') == 1
+
+
+def test_nested_loops(same_output):
+    code = script(PROLOGUE + [
+        (LT, 4, 2, 6),                  # 6: outer loop head, i < 3
+        (TEST, 4, 9),                   # 7
+        (HALT,),                        # 8
+        (LOADK, 5, 3),                  # 9: j = 0
+        (LT, 4, 5, 7),                  # 10: inner loop head, j < 2
+        (TEST, 4, 13),                  # 11
+        (JMP, 17),                      # 12: leave the inner loop
+        (ADD, 8, 2, 5),                 # 13
+        (CALL, 1, 8),                   # 14: print(i + j)
+        (ADD, 5, 5, 3),                 # 15
+        (JMP, 10),                      # 16
+        (ADD, 2, 2, 3),                 # 17
+        (JMP, 6),                       # 18
+    ])
+    source = lifted(code, same_output)
+    assert source.count('while true do') == 2
+    assert 'pc' not in source
+
+
+def test_jump_into_a_loop_falls_back_to_a_dispatch_loop(same_output):
+    code = script(PROLOGUE + [
+        (LT, 4, 2, 6),                  # 6
+        (TEST, 4, 9),                   # 7: enter the loop below at its second block
+        (ADD, 2, 2, 3),                 # 8: loop head
+        (CALL, 1, 2),                   # 9
+        (LT, 4, 2, 6),                  # 10
+        (TEST, 4, 8),                   # 11
+        (HALT,),
+    ])
+    source = lifted(code, same_output)
+    assert 'local pc = ' in source
+
+
+def test_payload_records(same_output):
+    program = PROLOGUE + [(ADD, 4, 3, 6), (CALL, 1, 4), (CALL, 1, 7), (HALT,)]
+    payload = bytes(b for instruction in program for b in (instruction + (0, 0, 0))[:4])
+    escaped = ''.join('\\%d' % b for b in payload)
+    code = VM + f'''local K = {CONSTANTS}
+local data = "{escaped}"
+local code = {{}}
+for i = 1, #data, 4 do code[#code + 1] = {{data:byte(i, i + 3)}} end
+run(code, K, _G)
+'''
+    vm, _ = devirtualize(code)
+    assert records_from_bytes(payload, vm)[:2] == [{1: GETGLOBAL, 2: 1, 3: 1, 4: 0},
+                                                   {1: LOADK, 2: 2, 3: 3, 4: 0}]
+    lifted(code, same_output, payload)
+
+
+def test_opcode_map_cache_hit(monkeypatch, same_output):
+    monkeypatch.setattr(lua_devirtualizer, '_OPCODE_MAPS', {})
+    first, _ = devirtualize(script(PROLOGUE + [(HALT,)]))
+
+    def analyse(self):
+        raise AssertionError('dispatch loop analysed again')
+
+    monkeypatch.setattr(lua_devirtualizer._LoopAnalysis, 'run', analyse)
+    code = script(PROLOGUE + [(CALL, 1, 6), (HALT,)])
+    vm, program = devirtualize(code)
+    assert vm is first
+    same_output(code, program.source)
+
+
+def test_join_spacing():
+    assert _join(['-', 'x']) == '-x'
+    assert _join(['r1', '=', '-', 'r2', '-', '#', 'r3']) == 'r1 = -r2 - #r3'
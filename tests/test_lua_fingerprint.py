@@ -0,0 +1,54 @@
+"""Per-build parameter learning and the fingerprint cache"""
+
+import os
+
+from hercules_deobfuscator import HerculesDeobfuscator
+from lua_fingerprint import BuildParameters, FingerprintCache, SampleIndex, resolve_build
+
+
+def test_learned_build_is_recalled_for_a_renamed_sample(tmp_path, hercules_sample):
+    path = str(tmp_path / 'fingerprints.json')
+    learned = resolve_build(hercules_sample(), FingerprintCache(path))
+    assert not learned.cached
+    assert (learned.decoder, learned.loader, learned.executor) == ('HuDWadUZyHyr', 'SVkOeWirtS', 'iLkvhyKfZlmz')
+    assert learned.cipher_key == 7 and learned.vm is not None
+
+    renamed = hercules_sample('decode', 'load', 'execute', text='another payload ' * 20)
+    recalled = resolve_build(renamed, FingerprintCache(path))
+    assert recalled.cached and recalled.fingerprint == learned.fingerprint
+    assert (recalled.decoder, recalled.loader, recalled.executor) == ('decode', 'load', 'execute')
+    assert (recalled.alphabet, recalled.cipher_key) == (learned.alphabet, learned.cipher_key)
+    assert recalled.vm.opcode_map == learned.vm.opcode_map
+    assert len(recalled.payload.split('_')) == len('another payload ' * 20)
+
+
+def test_mismatched_entry_is_rejected(tmp_path, hercules_sample):
+    index = SampleIndex(hercules_sample())
+    entry = resolve_build(hercules_sample()).to_entry(index)
+    assert BuildParameters.from_entry(entry, index) is not None
+
+    assert BuildParameters.from_entry(dict(entry, decoder=len(index.names)), index) is None
+    assert BuildParameters.from_entry(dict(entry, alphabet=len(index.strings)), index) is None
+    # The payload repeats characters, so it cannot be an alphabet
+    assert BuildParameters.from_entry(dict(entry, alphabet=len(index.strings) - 1), index) is None
+
+    # resolve_build learns afresh rather than trusting the entry
+    cache = FingerprintCache(str(tmp_path / 'fingerprints.json'))
+    cache.put(index.fingerprint, dict(entry, decoder=len(index.names)))
+    params = resolve_build(hercules_sample(), cache)
+    assert not params.cached and params.decoder == 'HuDWadUZyHyr'
+
+
+def test_cache_is_opt_in(tmp_path, monkeypatch, hercules_sample):
+    monkeypatch.setenv('LUA_DEOBF_CACHE', str(tmp_path / 'default.json'))
+    deobfuscator = HerculesDeobfuscator()
+    deobfuscator.load_source(hercules_sample())
+    assert deobfuscator.learn_build().learned
+    assert deobfuscator.cache is None
+    assert not os.listdir(tmp_path)
+
+    path = tmp_path / 'opted_in.json'
+    deobfuscator = HerculesDeobfuscator(cache_path=str(path))
+    deobfuscator.load_source(hercules_sample())
+    assert not deobfuscator.learn_build().cached
+    assert path.exists()
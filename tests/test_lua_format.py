@@ -0,0 +1,50 @@
+"""Token-driven reflow of minified sources"""
+
+import pytest
+
+from hercules_deobfuscator import HerculesDeobfuscator
+from lua_format import MAX_WIDTH, reflow
+
+MINIFIED = ('local a,b=5,3;local function f(s) return "<"..tostring(s)..">" end '
+            '--[[ block\ncomment ]] print(a - -b);print(a- -b) print(-a - -b) '
+            'local t={x=1,[2]="two";"three"} print(f"x") print(f{}~=nil) print(f[[long]]) '
+            'local s=[==[a]]b\n]==] print(s,#s) -- trailing comment\n'
+            'for i=1,3 do if i==2 then goto continue end print(i) ::continue:: end '
+            'local n=0 repeat n=n+1 until n>=2 print(n);;; print(t.x,t[2],t[1]) '
+            'do local x<const> = 4 print(x) end print(2^-2, 7//2, 1~2, "a".."b", #"abc", not nil)')
+
+
+def test_minified_line_round_trips(same_output):
+    output = reflow(MINIFIED)
+    assert same_output(MINIFIED, output)
+    lines = output.splitlines()
+    assert len(lines) > 15
+    assert all(len(line) <= MAX_WIDTH for line in lines)
+    assert 'print(a - -b)' in lines
+    assert '::continue::' in output and 'goto continue' in output
+
+
+def test_statements_are_indented_by_depth():
+    lines = reflow('if x then while y do f() end else g() end').splitlines()
+    assert lines == ['if x then', '  while y do', '    f()', '  end', 'else', '  g()', 'end']
+
+
+@pytest.mark.parametrize('code', [
+    'local x = 1 (print)(x)',                  # a call on a parenthesised expression
+    'local t = {} t.f = print t.f"sugar"',
+    'print(#{1, 2}, - - 3, ~5)',
+    'local s = "a\\\nb" print(s)',             # escaped newline inside a string
+])
+def test_tricky_statements_round_trip(same_output, code):
+    same_output(code, reflow(code))
+
+
+def test_long_payload_line_is_not_discarded():
+    # One statement per function, packed onto a single line far past 200 characters
+    payload = ' '.join(f'function helper{k}(value) return value * {k} end' for k in range(6))
+    payload += ' local wrapped = function(value) return helper0(value) end'
+    assert len(payload) > 200 and '\n' not in payload
+    deobfuscator = HerculesDeobfuscator()
+    deobfuscator.load_source(payload)
+    lines = deobfuscator._extract_readable_content().splitlines()
+    assert lines == [f'function helper{k}(value)' for k in range(6)] + ['local wrapped = function(value)']
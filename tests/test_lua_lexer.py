@@ -0,0 +1,101 @@
+"""Tokenizer and string literal codec"""
+
+import pytest
+
+from lua_deobfuscator import LuaDeobfuscator
+from lua_lexer import decode_string_literal, normalize_string_literal, tokenize
+
+
+def strings(code):
+    return [tok.value for tok in tokenize(code) if tok.kind == 'string']
+
+
+@pytest.mark.parametrize('literal, value', [
+    ('"abc\\z\n   def"', b'abcdef'),
+    ('"abc\\z \r\n\t def"', b'abcdef'),
+    ("'a\\z\n\n\nb'", b'ab'),
+    ('"a\\\r\nb"', b'a\nb'),
+    ('"a\\\n\rb"', b'a\nb'),
+    ('"a\\\nb"', b'a\nb'),
+    ('"a\\\n\nb"', None),         # the second line break is raw, the string ends there
+])
+def test_escaped_line_breaks_stay_in_one_literal(literal, value):
+    code = f'print({literal})'
+    tokens = tokenize(code)
+    if value is None:
+        assert strings(code)[0] != literal
+        return
+    assert [tok.value for tok in tokens] == ['print', '(', literal, ')']
+    assert decode_string_literal(literal) == value
+
+
+def test_line_numbers_count_line_breaks_inside_literals():
+    tokens = tokenize('x = "a\\z\n\n  b"\ny = 1')
+    assert [(tok.value, tok.line) for tok in tokens if tok.kind == 'name'] == [('x', 1), ('y', 4)]
+
+
+def test_raw_line_break_ends_a_short_string():
+    assert strings('x = "abc\ny = 1') == ['"abc\n']
+
+
+@pytest.mark.parametrize('literal, value', [
+    ('"\\98\\x63\\u{64}"', b'bcd'),
+    ("'\\65\\066\\0677'", b'ABC7'),
+    ('"\\u{7FFFFFFF}"', b'\xfd\xbf\xbf\xbf\xbf\xbf'),
+    ('[==[\nx]]y]==]', b'x]]y'),
+    ('"\\q"', b'q'),
+])
+def test_decode_escape_forms(literal, value):
+    assert decode_string_literal(literal) == value
+
+
+@pytest.mark.parametrize('literal, value', [
+    ('[[a\r\nb]]', b'a\nb'),
+    ('[[\r\na\n\rb\rc]]', b'a\nb\nc'),
+    ('[=[\n\r\r\nx]=]', b'\nx'),
+    ('[[a\n\n\r\nb]]', b'a\n\n\nb'),
+])
+def test_long_bracket_line_breaks_read_as_newlines(literal, value):
+    assert decode_string_literal(literal) == value
+
+
+def test_long_bracket_in_a_crlf_file(same_output):
+    code = 'local s = [[a\r\nb\r\n\r\nc]]\r\nprint(#s, s == "a\\nb\\n\\nc")\r\n'
+    deobfuscator = LuaDeobfuscator()
+    deobfuscator.load_source(code)
+    assert same_output(code, deobfuscator.deobfuscate_strings()) == ['6\ttrue']
+
+
+@pytest.mark.parametrize('literal', [
+    '"\\0001"', '"tab\\there"', "'say \"hi\"'", '"\\255\\254"', '"line\\nline\\nline"',
+])
+def test_normalized_literal_decodes_to_the_same_bytes(literal):
+    assert decode_string_literal(normalize_string_literal(literal)) == decode_string_literal(literal)
+
+
+@pytest.mark.parametrize('code', [
+    'print("abc\\z\n   def")',
+    'print("a\\\r\nb", "c")',
+    'print("a\\\n\rb")',
+    "print('x\\z  \r\n\t y', 'z')",
+    'print("\\104\\x69\\u{21}", #"\\0\\00\\000")',
+    'print(string.char(104, 105) .. "!")',
+    'print(("%d"):format(7), [[\nlong\n]])',
+])
+def test_string_deobfuscation_round_trip(same_output, code):
+    deobfuscator = LuaDeobfuscator()
+    deobfuscator.load_source(code)
+    same_output(code, deobfuscator.deobfuscate_strings())
+
+
+@pytest.mark.parametrize('code, folded', [
+    ('local string = {char = function() return "mine" end} print(string.char(65))', 0),
+    ('local function f(string) return string.char(65) end print(f({char = tostring}), string.char(66))', 1),
+    ('do local string = {char = tostring} print(string.char(65)) end print(string.char(66))', 1),
+])
+def test_local_string_is_not_folded(same_output, code, folded):
+    deobfuscator = LuaDeobfuscator()
+    deobfuscator.load_source(code)
+    output = deobfuscator.deobfuscate_strings()
+    assert output.count('string.char') == code.count('string.char') - folded
+    same_output(code, output)
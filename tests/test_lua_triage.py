@@ -0,0 +1,83 @@
+"""Triage scores, lanes and the two feature extractors"""
+
+import os
+import random
+
+import pytest
+
+import lua_triage
+from lua_triage import extract_features, triage
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE = os.path.join(ROOT, 'obf_USt8699Rq2bfiXQ93Za91xpB0A5QX61s671rNhAFv33NWZNz5E8OQL925279N3aQ.lua')
+
+CLEAN = '''
+local function greet(name)
+  local message = "hello, " .. name
+  print(message)
+  return #message
+end
+
+for index, name in ipairs({"alpha", "beta"}) do
+  greet(name)
+end
+''' * 8
+
+
+def test_clean_code_takes_the_fast_lane():
+    result = triage(CLEAN)
+    assert result.score < lua_triage.FAST_LANE_THRESHOLD
+    assert (result.family, result.lane) == ('clean', 'fast')
+
+
+def test_empty_input():
+    result = triage(b'')
+    assert (result.score, result.family, result.lane) == (0.0, 'empty', 'fast')
+
+
+def test_escaped_strings_take_the_full_lane():
+    payload = ''.join('\\%d' % b for b in b'print("hidden")' * 40)
+    result = triage(f'local s = "{payload}"\nload(s)()\n')
+    assert result.score > 0.8
+    assert (result.family, result.lane) == ('escaped_strings', 'full')
+
+
+def test_marker_overrides_a_low_score():
+    result = triage(CLEAN + 'while alpha do end\n')
+    assert result.score < lua_triage.FAST_LANE_THRESHOLD
+    assert (result.family, result.lane) == ('hercules', 'full')
+
+
+def test_obfuscated_sample_takes_the_full_lane():
+    with open(SAMPLE, 'rb') as f:
+        result = triage(f.read())
+    assert result.score > 0.5
+    assert result.lane == 'full'
+
+
+def test_token_bigrams():
+    # Quotes are tokens of their own; the letters between them make a name
+    features = extract_features('x1 = 12ab + "s"')
+    pairs = ['name operator', 'operator number', 'number operator', 'operator string', 'string name', 'name string']
+    assert features['token_bigrams'] == dict.fromkeys(pairs, round(1 / 6, 5))
+
+
+def _samples():
+    rng = random.Random(7)
+    yield pytest.param(bytes(rng.randrange(256) for _ in range(4096)), id='noise')
+    words = [b'v12', b'_9', b'aB', b'x_1', b'12ab', b'0x1F', b'a.b', b'\\x1b', b'"q"']
+    yield pytest.param(b' '.join(rng.choice(words) for _ in range(2000)), id='words')
+    yield pytest.param(b'\\\\0 \\u{41} a\r\nb\n\n_\n9', id='edges')
+    yield pytest.param(CLEAN.encode(), id='clean')
+    with open(SAMPLE, 'rb') as f:
+        yield pytest.param(f.read(), id='sample')
+
+
+@pytest.mark.parametrize('data', list(_samples()))
+def test_numpy_and_stdlib_features_agree(monkeypatch, data):
+    monkeypatch.setattr(lua_triage, 'np', pytest.importorskip('numpy'))
+    fast, slow = lua_triage._numpy_features(data), lua_triage._python_features(data)
+    assert fast.pop('entropy') == pytest.approx(slow.pop('entropy'))
+    for key in ('byte_counts', 'line_lengths'):
+        assert list(fast.pop(key)) == slow.pop(key)
+    assert fast == slow